@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import datetime
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,8 +47,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 请求性能统计(Server-Timing、/metrics、N+1日志)，放在最前面
+    'BookLib.utils.perfMiddleware.PerformanceMiddleware',
     # 'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # 读写分离：GET/HEAD读副本，写操作之后读主库
+    'book.db.routers.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,11 +87,42 @@ WSGI_APPLICATION = 'BookLib.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# 部署环境：dev、prod，决定数据库连接池等参数
+BOOKLIB_ENV = os.environ.get('BOOKLIB_ENV', 'dev')
+
+# 数据库连接池(book.db.pool)，各环境的参数
+# MAX_SIZE常驻连接数，MAX_OVERFLOW高峰时临时多建的连接数，TIMEOUT连接用尽时等待的秒数
+# IDLE_TIMEOUT空闲连接保留的秒数，MAX_LIFETIME连接最长使用的秒数(都要小于MySQL的wait_timeout)
+# PING_INTERVAL空闲超过该秒数的连接取出时先ping检查
+# 多进程部署时总连接数为 进程数 * (MAX_SIZE + MAX_OVERFLOW)，不能超过MySQL的max_connections
+DATABASE_POOLS = {
+    'dev': {
+        'MAX_SIZE': 5,
+        'MAX_OVERFLOW': 5,
+        'TIMEOUT': 10,
+        'IDLE_TIMEOUT': 300,
+        'MAX_LIFETIME': 3600,
+        'PING_INTERVAL': 30,
+    },
+    'prod': {
+        'MAX_SIZE': 20,
+        'MAX_OVERFLOW': 20,
+        'TIMEOUT': 5,
+        'IDLE_TIMEOUT': 600,
+        'MAX_LIFETIME': 1800,
+        'PING_INTERVAL': 10,
+    },
+}
+
 DATABASES = {
     'default': {
         # 'ENGINE': 'django.db.backends.sqlite3',
         # 'NAME': BASE_DIR / 'db.sqlite3',
-        'ENGINE': 'django.db.backends.mysql',
+        # 带连接池的MySQL后端；不使用连接池时为django.db.backends.mysql
+        'ENGINE': 'book.db.backends.mysql',
+        # 使用连接池时保持0：请求结束后连接归还连接池，而不是被当前线程一直占用
+        'CONN_MAX_AGE': 0,
+        'POOL': DATABASE_POOLS[BOOKLIB_ENV],
         # 'HOST': '192.168.94.131',
         'HOST': '127.0.0.1',
         'PORT': '3306',
@@ -98,6 +134,24 @@ DATABASES = {
     }
 }
 
+# 只读副本：环境变量DB_REPLICA_HOSTS=10.0.0.2,10.0.0.3，每个副本复制default的配置，只替换HOST
+# 测试时副本指向测试库(MIRROR)，不单独创建
+for i, host in enumerate(h.strip() for h in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if h.strip()):
+    DATABASES['replica%d' % (i + 1)] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+
+# 读写分离(book.db.routers)
+DATABASE_ROUTERS = ['book.db.routers.ReplicaRouter']
+
+DATABASE_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias.startswith('replica')],
+    'APP_LABELS': ['book'],               # 只有这些应用的查询读副本
+    'STRATEGY': 'round_robin',            # round_robin轮询，least_lag选复制延迟最小的
+    'MAX_LAG': 10,                        # 复制延迟超过该秒数的副本暂时不用
+    'CHECK_INTERVAL': 5,                  # 每个副本健康检查的间隔(秒)
+    'PIN_SECONDS': 15,                    # 写操作之后该客户端读主库的秒数，实际不小于MAX_LAG + CHECK_INTERVAL
+    'PIN_COOKIE': 'db_primary_until',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -167,7 +221,8 @@ REST_FRAMEWORK = {
         # 'rest_framework_jwt.authentication.JSONWebTokenAuthentication',        # DRF JWT
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',                  # 前两个用来生成 Token
-        'rest_framework.authentication.TokenAuthentication',                    # DRF auth Token
+        # 'rest_framework.authentication.TokenAuthentication',                  # DRF auth Token
+        'book.auth.authentication.CachedTokenAuthentication',                   # 带缓存的DRF auth Token
     ),
     # 用户限流
     # 'DEFAULT_THROTTLE_CLASSES': (
@@ -186,6 +241,17 @@ REST_FRAMEWORK = {
     #     'contacts': '50/day',
     #     'uploads': '2000/day',
     # },
+    # 令牌桶限流(book.throttling)，多个worker进程共享限额
+    # 视图限流只对声明了throttle_scope的视图(ContactListView、UploadView等)生效，其他视图不查询限流存储
+    # 'DEFAULT_THROTTLE_CLASSES': (
+    #     'book.throttling.BucketScopedRateThrottle',
+    # ),
+    # 'DEFAULT_THROTTLE_RATES': {
+    #     'anon': '100/day',
+    #     'user': '1000/day',
+    #     'contacts': '50/day',
+    #     'uploads': '2000/day',
+    # },
     
     # 过滤
     'DEFAULT_FILTER_BACKENDS': (
@@ -202,7 +268,12 @@ REST_FRAMEWORK = {
 
     # 自定义渲染器，返回指定格式的JSON数据  
     # 'DEFAULT_RENDERER_CLASSES': (
-    #     'BookLib.utils.customDRFRenderer',
+    #     'BookLib.utils.customDRFRenderer.CustomRenderer',
+    #     'rest_framework.renderers.BrowsableAPIRenderer',
+    # ),
+    # 只使用更快的JSON编码(orjson)，不改变返回格式
+    # 'DEFAULT_RENDERER_CLASSES': (
+    #     'BookLib.utils.customDRFRenderer.FastJSONRenderer',
     #     'rest_framework.renderers.BrowsableAPIRenderer',
     # ),
 }
@@ -211,3 +282,79 @@ JWT_AUTH = {
   'JWT_AUTH_HEADER_PREFIX': 'JWT',
 }
 
+
+# Token认证缓存：进程内LRU，指定CACHE_ALIAS时改用Django缓存框架(多进程共享)
+# 进程内缓存的失效只对当前进程生效，删除的token、禁用的用户在其他worker中最多TTL秒后才失效；
+# TTL越长命中率越高，但这段时间也越长。部署了Redis等共享缓存时指定CACHE_ALIAS，失效对所有进程立即生效
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 30,                    # 秒
+    'CACHE_ALIAS': None,
+}
+
+# 用户缓存：session认证时get_user的短时缓存
+AUTH_USER_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 30,                    # 秒
+    'CACHE_ALIAS': None,
+}
+
+# 密码哈希线程池：限制同时计算的哈希数量，计算中+排队的任务超过上限时返回429
+PASSWORD_HASHING_POOL = {
+    'MAX_WORKERS': 4,             # 为0时不使用线程池
+    'MAX_QUEUE': 32,
+    'TIMEOUT': 10,                # 秒
+}
+
+# 缓存：默认进程内缓存，多进程部署时改用文件或Redis等共享缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'booklib',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': '/var/tmp/booklib_cache',
+    # },
+}
+
+# 响应缓存：书籍、人物的列表和详情接口，写入后通过信号失效
+RESPONSE_CACHE = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,               # 秒
+    'LOCK_TIMEOUT': 10,           # 单飞锁超时(秒)，等待者最多等待这么久
+}
+
+# 请求性能统计(BookLib.utils.perfMiddleware)
+PERF_METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,                # 响应头中返回Server-Timing
+    'N_PLUS_ONE_THRESHOLD': 10,           # 同一请求中同一形状的SQL执行达到该次数时记录警告
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),                 # 秒
+    'QUERY_BUCKETS': (1, 2, 5, 10, 20, 50, 100),
+    'SIZE_BUCKETS': (1024, 4096, 16384, 65536, 262144, 1048576),                                # 字节
+    'METRICS_ALLOWED_IPS': ['127.0.0.1', '::1'],     # 可以不登录访问/metrics的来源IP(Prometheus)，其他来源需要管理员
+}
+
+# 限流存储：本机所有worker进程共享的SQLite文件
+THROTTLE_STORE = {
+    'PATH': os.environ.get('BOOKLIB_THROTTLE_DB', '/var/tmp/booklib_throttle.sqlite3'),
+    'TIMEOUT': 1,                 # 等待写锁的秒数
+}
+
+# 阅读量/评论量计数器：进程内缓冲增量，批量落库
+BOOK_COUNTER = {
+    'FLUSH_INTERVAL': 5,          # 秒
+    'FLUSH_THRESHOLD': 1000,      # 缓冲的增量达到该值时立即落库
+}
+
+# 排行榜：每个进程在内存中维护各榜单(阅读量、评论量、加权分数，可按出版年份)的前DEPTH名
+LEADERBOARD = {
+    'DEPTH': 200,                 # 每个榜单保留的名次，大于MAX_LIMIT，名次靠后的书籍追上来时不必每次重新加载
+    'MAX_LIMIT': 100,             # 接口一次最多返回的名次
+    'RECONCILE_INTERVAL': 60,     # 秒，与数据库对账(重新加载)的间隔，其他进程的计数在对账后体现
+    'MAX_BOARDS': 64,             # 最多保留的榜单数(按年份的榜单按需创建)，超过时淘汰最久未使用的
+    'SCORE_WEIGHTS': {'read_count': 1, 'comment_count': 10},      # 加权分数 = 阅读量 * 1 + 评论量 * 10
+}
@@ -17,11 +17,16 @@ from django.contrib import admin
 from django.urls import path, re_path, include
 from rest_framework.documentation import include_docs_urls
 
+from BookLib.utils.perfMiddleware import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
     path('book/', include('book.urls')),
 
+    # Prometheus指标
+    path('metrics', metrics_view),
+
 
     # 总路由中添加接口文档路径
     re_path(r'^docs/', include_docs_urls(title='My API title'))
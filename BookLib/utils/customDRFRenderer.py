@@ -1,26 +1,102 @@
+import datetime
+import decimal
+import json
+import uuid
+
 from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from BookLib.utils.perfMiddleware import timer
+
+try:
+    import orjson
+except ImportError:         # 未安装orjson时使用标准库
+    orjson = None
+
+
+# 常见类型直接转换，其余类型(懒翻译字符串、QuerySet等)交给DRF的编码器
+_drf_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    if isinstance(obj, datetime.datetime):
+        representation = obj.isoformat()
+        # 与DRF一致：UTC时间以Z结尾
+        if representation.endswith('+00:00'):
+            representation = representation[:-6] + 'Z'
+        return representation
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    return _drf_encoder.default(obj)
+
+
+def dumps_orjson(data):
+    # orjson原生处理date/datetime/UUID，dict、list的子类(ReturnDict、OrderedDict)不需要转换
+    return orjson.dumps(data, default=encode_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+def dumps_json(data):
+    return json.dumps(data, default=encode_default, ensure_ascii=False, separators=(',', ':'),
+                      allow_nan=not api_settings.STRICT_JSON).encode()
+
+
+# 可选的JSON编码后端，默认优先orjson
+JSON_BACKENDS = {'json': dumps_json}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = dumps_orjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    使用orjson(未安装时为标准库)的JSON渲染器
+    """
+    json_backend = 'orjson' if orjson is not None else 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # 计入请求的渲染耗时(Server-Timing、/metrics)；中间件已经给response.render计时时只计外层
+        with timer('render'):
+            return self._render(data, accepted_media_type, renderer_context)
 
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # 需要缩进(可浏览API、Accept中指定indent)时仍使用DRF的实现
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = JSON_BACKENDS[self.json_backend](data)
+        # 与DRF一致：转义U+2028、U+2029，可以直接嵌入JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
 
 
-class CustomRenderer(JSONRenderer):
+class CustomRenderer(FastJSONRenderer):
     """
     自定义渲染器
     """
 
     # 重构render方法
+    # 不修改视图返回的数据：原来pop掉msg、code会改动response.data(响应缓存中的数据也是它)
     def render(self, data, accepted_media_type=None, renderer_context=None):
         if renderer_context:
+            msg = 'success'
+            code = 200
             # 判断实例的类型，返回的数据可能是列表也可能是字典
             if isinstance(data, dict):
                 # 如果是字典的话应该是返回的数据，会包含msg,code,status等字段必须抽离出来
-                msg = data.pop('msg', 'success')
-                code = data.pop('code', 200)
+                msg = data.get('msg', msg)
+                code = data.get('code', code)
                 # 重新构建返回的JSON字典
-                if 'status' in data.keys():
-                    del data['status']
+                if 'status' in data:
                     data = data['data']
-                else:
-                    data = data
+                elif 'msg' in data or 'code' in data:
+                    # 只复制第一层的键，不复制数据本身
+                    data = {k: v for k, v in data.items() if k not in ('msg', 'code')}
             # 自定义返回数据格式
             ret = {
                 'msg': msg,
@@ -33,4 +109,4 @@ class CustomRenderer(JSONRenderer):
             # 返回JSON数据
             return super().render(ret, accepted_media_type, renderer_context)
         else:
-            return super().render(data, accepted_media_type, renderer_context)
\ No newline at end of file
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,296 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django import http
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+
+# 请求性能统计
+# 每个请求按视图(BookModelView.list、CustomDRFObtainAuthToken.post等)记录：SQL条数和耗时、序列化耗时、渲染耗时、总耗时、响应大小
+#   1. 响应头Server-Timing，浏览器开发者工具中可以直接看到各阶段耗时
+#   2. /metrics接口，Prometheus文本格式的直方图，按视图聚合
+#   3. 同一请求中同一形状的SQL(参数不同)执行超过N_PLUS_ONE_THRESHOLD次时记录警告日志，通常是循环中逐条查询关联对象(N+1)
+
+# 当前请求的统计，contextvars保证异步视图在线程池中执行的查询也记到同一个请求上
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.db_count = 0
+        self.db_time = 0.0
+        self.timings = Counter()        # serialize、render
+        self.active = set()             # 正在计时的阶段，嵌套调用(CustomRenderer.render调用父类render)只计最外层
+        self.shapes = Counter()
+
+
+@contextlib.contextmanager
+def timer(name):
+    metrics = _current.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    metrics.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - start
+        metrics.active.discard(name)
+
+
+# SQL形状：IN (%s, %s, ...)的参数个数不同也视为同一形状
+_in_list = re.compile(r'\((?:%s|\?)(?:, (?:%s|\?))*\)')
+
+
+def sql_shape(sql):
+    return _in_list.sub('(...)', sql)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - start
+        metrics.db_count += 1
+        metrics.shapes[sql_shape(sql)] += 1
+
+
+# 每个数据库连接(包括线程池中的)建立时挂上SQL计时；连接池复用连接对象时会再次触发，不重复添加
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_wrapper)
+
+
+# 序列化耗时：序列化器继承TimedSerializerMixin，.data(包括many=True时的ListSerializer)计入序列化耗时
+# 渲染耗时：PerformanceMiddleware.process_template_response给响应(DRF Response、TemplateResponse)的render计时，
+# 与使用哪个渲染器无关；不替换DRF类的属性，不影响进程中其他序列化器、响应
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timer('serialize'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    @property
+    def data(self):
+        with timer('serialize'):
+            return super().data
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        serializer = super().many_init(*args, **kwargs)
+        # Meta中没有指定list_serializer_class时换成计时的ListSerializer(只多了计时，没有其他状态)
+        if type(serializer) is serializers.ListSerializer:
+            serializer.__class__ = TimedListSerializer
+        return serializer
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # 最后一个是+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# 按视图聚合的指标
+class MetricsRegistry:
+    histograms = {
+        # 名称: (说明, 桶)
+        'booklib_request_duration_seconds': ('Request latency', 'LATENCY_BUCKETS'),
+        'booklib_db_duration_seconds': ('Time spent in SQL per request', 'LATENCY_BUCKETS'),
+        'booklib_serialize_duration_seconds': ('Time spent in serializers per request', 'LATENCY_BUCKETS'),
+        'booklib_render_duration_seconds': ('Time spent rendering the response body', 'LATENCY_BUCKETS'),
+        'booklib_db_queries': ('SQL queries per request', 'QUERY_BUCKETS'),
+        'booklib_response_size_bytes': ('Response body size', 'SIZE_BUCKETS'),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}                 # {(指标, 视图): Histogram}
+        self.n_plus_one = Counter()     # {视图: 次数}
+
+    def observe(self, view, values):
+        with self._lock:
+            for name, value in values.items():
+                histogram = self._data.get((name, view))
+                if histogram is None:
+                    buckets = settings.PERF_METRICS[self.histograms[name][1]]
+                    histogram = self._data[(name, view)] = Histogram(buckets)
+                histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.n_plus_one.clear()
+
+    def exposition(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in self.histograms.items():
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s histogram' % name)
+                for (metric, view), histogram in sorted(self._data.items()):
+                    if metric != name:
+                        continue
+                    label = 'view="%s"' % view
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, label, bound, cumulative))
+                    lines.append('%s_sum{%s} %s' % (name, label, repr(histogram.sum)))
+                    lines.append('%s_count{%s} %d' % (name, label, histogram.count))
+            lines.append('# HELP booklib_n_plus_one_total Requests with repeated SQL shapes')
+            lines.append('# TYPE booklib_n_plus_one_total counter')
+            for view, count in sorted(self.n_plus_one.items()):
+                lines.append('booklib_n_plus_one_total{view="%s"} %d' % (view, count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def view_name(view_func, request):
+    # DRF视图：类名.动作(视图集)或类名.请求方法；普通函数视图：函数名
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    actions = getattr(view_func, 'actions', None) or {}
+    return '%s.%s' % (cls.__name__, actions.get(request.method.lower(), request.method.lower()))
+
+
+# GET /metrics：管理员，或来源IP在PERF_METRICS['METRICS_ALLOWED_IPS']中(Prometheus抓取)
+def metrics_view(request):
+    user = getattr(request, 'user', None)
+    if request.META.get('REMOTE_ADDR') not in settings.PERF_METRICS['METRICS_ALLOWED_IPS'] and not (
+            user is not None and user.is_active and user.is_staff):
+        raise PermissionDenied
+    return http.HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# 放在MIDDLEWARE最前面，统计的总耗时包括其他中间件
+# 同时支持同步、异步：ASGI下只有同步的中间件时，Django把整个中间件链和视图放进同一个线程(thread_sensitive)执行，
+# 异步视图也被串行化(book.viewsAsync)
+@sync_and_async_middleware
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # 让Django把该中间件当作协程函数
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            # 异步的钩子：同步的钩子在ASGI下要切换到线程执行
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.PERF_METRICS['ENABLED']:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not settings.PERF_METRICS['ENABLED']:
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    # Django在中间件链内部、调用response.render()之前调用，此时请求的统计仍然有效
+    def process_template_response(self, request, response):
+        return self.time_render(response)
+
+    async def aprocess_template_response(self, request, response):
+        return self.time_render(response)
+
+    @staticmethod
+    def time_render(response):
+        if _current.get() is None:
+            return response
+        render = response.render
+
+        def timed_render():
+            # 渲染后去掉实例属性，响应仍可以被pickle(缓存)
+            del response.render
+            with timer('render'):
+                return render()
+
+        response.render = timed_render
+        return response
+
+    def finish(self, request, response, metrics, total):
+        # 视图名取自URL解析结果(不用process_view：同步的process_view在ASGI下也要切换到线程执行)
+        # 未匹配到视图(404)的请求不按路径统计，避免标签数量无限增长
+        match = getattr(request, 'resolver_match', None)
+        view = view_name(match.func, request) if match is not None else 'unresolved'
+        if view == metrics_view.__qualname__:
+            return response
+
+        size = len(response.content) if not response.streaming else 0
+        serialize, render = metrics.timings['serialize'], metrics.timings['render']
+        registry.observe(view, {
+            'booklib_request_duration_seconds': total,
+            'booklib_db_duration_seconds': metrics.db_time,
+            'booklib_serialize_duration_seconds': serialize,
+            'booklib_render_duration_seconds': render,
+            'booklib_db_queries': metrics.db_count,
+            'booklib_response_size_bytes': size,
+        })
+        if settings.PERF_METRICS['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join([
+                'db;dur=%.2f;desc="%d queries"' % (metrics.db_time * 1000, metrics.db_count),
+                'serialize;dur=%.2f' % (serialize * 1000),
+                'render;dur=%.2f' % (render * 1000),
+                'total;dur=%.2f' % (total * 1000),
+            ])
+        self.check_n_plus_one(view, metrics, request)
+        return response
+
+    def check_n_plus_one(self, view, metrics, request):
+        threshold = settings.PERF_METRICS['N_PLUS_ONE_THRESHOLD']
+        repeated = [(shape, count) for shape, count in metrics.shapes.most_common(3) if count >= threshold]
+        if not repeated:
+            return
+        with registry._lock:
+            registry.n_plus_one[view] += 1
+        for shape, count in repeated:
+            logger.warning('N+1 queries in %s (%s %s): %d x %s', view, request.method, request.path, count, shape)
@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class BookConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'book'
+
+    def ready(self):
+        # 注册token、用户缓存失效的信号处理函数
+        import book.auth.authentication  # noqa: F401
+        import book.auth.backends  # noqa: F401
+        # 注册搜索索引增量维护的信号处理函数
+        import book.search  # noqa: F401
+        # 注册书籍统计增量维护的信号处理函数
+        import book.stats  # noqa: F401
+        # 注册排行榜增量更新的信号处理函数
+        import book.leaderboard  # noqa: F401
+        # 注册书籍详情文档增量重建的信号处理函数
+        import book.documents  # noqa: F401
+        # 注册响应缓存失效的信号处理函数
+        import book.response_cache  # noqa: F401
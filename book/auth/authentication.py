@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from book.models import User
+
+
+# 认证缓存：进程内LRU + TTL，指定cache_alias时改用Django缓存框架
+# 进程内LRU的失效(信号)只对当前进程生效：其他worker进程中，被删除的token、被禁用的用户在TTL内仍然有效，
+# 所以进程内缓存的TTL要短；需要立即全局失效时，cache_alias指定多进程共享的缓存(Redis、Memcached)
+class AuthCache:
+    def __init__(self, key_prefix, max_size=10000, ttl=300, cache_alias=None):
+        self.key_prefix = key_prefix
+        self.max_size = max_size
+        self.ttl = ttl
+        # 指定cache_alias时使用Django缓存框架(多进程共享、失效对所有进程生效)，否则使用进程内LRU
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._data = OrderedDict()          # {key: (过期时间, 缓存值)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if self.cache_alias:
+            value = caches[self.cache_alias].get(self.key_prefix + key)
+        else:
+            with self._lock:
+                item = self._data.get(key)
+                if item is not None and item[0] < time.monotonic():
+                    del self._data[key]
+                    item = None
+                if item is not None:
+                    self._data.move_to_end(key)
+                value = item[1] if item is not None else None
+
+        # 多线程同时+=会丢失计数，命中统计同样在锁内更新
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.cache_alias:
+            caches[self.cache_alias].set(self.key_prefix + key, value, self.ttl)
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            # 超出容量时淘汰最久未使用的
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        if self.cache_alias:
+            caches[self.cache_alias].delete(self.key_prefix + key)
+            return
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        # 只清空进程内数据和命中统计，不清空共享的Django缓存
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._data)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0,
+            'size': size,
+        }
+
+
+# Token认证缓存
+# DRF自带的TokenAuthentication每个请求都要 Token JOIN User 查一次库
+# 缓存 key -> (user, token)，热点token不再访问数据库；token删除/轮换、用户修改(如禁用)时通过信号失效
+cache_settings = getattr(settings, 'TOKEN_AUTH_CACHE', {})
+token_cache = AuthCache(
+    'authtoken:',
+    max_size=cache_settings.get('MAX_SIZE', 10000),
+    ttl=cache_settings.get('TTL', 30),
+    cache_alias=cache_settings.get('CACHE_ALIAS'),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    cache = token_cache
+
+    def authenticate_credentials(self, key):
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        # 未命中时走父类查询，token无效、用户被禁用时父类直接抛出AuthenticationFailed，不会缓存
+        user_auth_tuple = super().authenticate_credentials(key)
+        if user_auth_tuple[0].is_delete:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        self.cache.set(key, user_auth_tuple)
+        return user_auth_tuple
+
+
+# token创建、轮换(删除旧token)时失效旧key
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance=None, **kwargs):
+    token_cache.delete(instance.key)
+
+
+# 用户信息修改(禁用、逻辑删除等)时失效其token，下次认证重新校验is_active
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance=None, created=False, **kwargs):
+    if created:
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        token_cache.delete(key)
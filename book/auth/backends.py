@@ -1,4 +1,15 @@
 import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.request import Request
+
+from book.auth.authentication import AuthCache
+from book.auth.hashing import HashingPoolFull, hashing_pool
 from book.models import User
 
 
@@ -14,28 +25,87 @@ username_re = re.compile(
 )  # literal form, ipv4 address (SMTP 4.1.3)
 
 
+
+# 正则较复杂，不含@的一定不是邮箱，直接跳过；同一账号反复登录时复用匹配结果
+@lru_cache(maxsize=4096)
+def is_email(username):
+    return '@' in username and username_re.match(username) is not None
+
+
+# session认证时AuthenticationMiddleware每个请求都会调用get_user，短时间缓存用户对象，用户修改/删除时失效
+cache_settings = getattr(settings, 'AUTH_USER_CACHE', {})
+user_cache = AuthCache(
+    'authuser:',
+    max_size=cache_settings.get('MAX_SIZE', 10000),
+    ttl=cache_settings.get('TTL', 30),
+    cache_alias=cache_settings.get('CACHE_ALIAS'),
+)
+
+
 class CustomAuthBackend:
 
     # 重写authenticate
-    def authenticate(self, username=None, password=None):
-        is_user = username_re.match(username)
-        if is_user:
-            qs = User.objects.filter(email=username)
-        else:
-            qs = User.objects.filter(username=username)
-
-        try:
-            user = qs.get()
-        except User.DoesNotExist:
+    # 用户不存在、密码错误时抛出PermissionDenied：authenticate()不再尝试后面的ModelBackend，
+    # 否则它会再查询一次用户、在哈希线程池之外再计算一次哈希
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
             return None
+        try:
+            user = self.get_user_by_login(username)
+        except (User.DoesNotExist, User.MultipleObjectsReturned):
+            # email没有唯一约束，只有大小写不同的邮箱可能属于多个账号，无法确定是哪一个，按登录失败处理
+            # 与ModelBackend一样，用户不存在时也计算一次哈希，响应时间不暴露用户是否存在
+            self.run_pooled(request, hashing_pool.make_password, password)
+            raise PermissionDenied
 
-        if user.check_password(password):
+        def setter(raw_password):
+            # 哈希算法、迭代次数升级后重新保存密码；线程池满时跳过，下次登录再升级
+            try:
+                user.password = hashing_pool.make_password(raw_password)
+            except HashingPoolFull:
+                return
+            user.save(update_fields=['password'])
+
+        # 校验密码放到有上限的哈希线程池中
+        if self.run_pooled(request, hashing_pool.check_password, password, user.password, setter):
             return user
+        raise PermissionDenied
+
+    @staticmethod
+    def get_user_by_login(username):
+        if is_email(username):
+            # 邮箱不区分大小写，LOWER(email)上有函数索引，只需一次索引查询
+            try:
+                return User.objects.alias(email_lower=Lower('email')).filter(email_lower=username.lower()).get()
+            except User.DoesNotExist:
+                # 用户名也可能是邮箱格式(原来由ModelBackend按用户名查询)
+                pass
+        return User.objects.get(username=username)
 
-        return None
+    @staticmethod
+    def run_pooled(request, func, *args):
+        try:
+            return func(*args)
+        except HashingPoolFull:
+            # DRF的请求(令牌登录、Basic认证)：HashingPoolFull即Throttled，返回429
+            # 其他请求(admin登录等)：PermissionDenied使authenticate()不再尝试其他后端并返回None，登录失败而不是500
+            if isinstance(request, Request):
+                raise
+            raise PermissionDenied
 
     def get_user(self, user_id):
+        user = user_cache.get(str(user_id))
+        if user is not None:
+            return user
         try:
-            return User.objects.get(pk=user_id)
+            user = User.objects.get(pk=user_id)
         except User.DoesNotExist:
             return None
+        user_cache.set(str(user_id), user)
+        return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance=None, **kwargs):
+    user_cache.delete(str(instance.pk))
@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import Throttled
+
+
+# 是DRF的Throttled：DRF视图中(令牌登录、Basic认证、注册)不论在哪里抛出都返回429
+class HashingPoolFull(Throttled):
+    default_detail = 'server is busy, retry later ...'
+
+
+# 密码哈希线程池
+# PBKDF2每次计算几十毫秒，登录/注册高峰时所有worker都在算哈希，其他请求排不上
+# 这里把哈希计算放进有上限的线程池(hashlib计算时释放GIL，线程可真正并行)，并限制排队数量：
+# 正在计算 + 排队的任务达到上限时直接抛出HashingPoolFull，返回429，而不是让请求无限堆积；等待超过timeout秒同样视为池满
+class HashingPool:
+    def __init__(self, max_workers=4, max_queue=32, timeout=10):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure(max_workers, max_queue, timeout)
+
+    def configure(self, max_workers, max_queue, timeout=10):
+        # 调整线程池大小，旧线程池中的任务执行完后自动退出
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self.max_workers = max_workers
+            self.max_queue = max_queue
+            self.timeout = timeout
+            self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='password-hashing')
+        return self._executor
+
+    def run(self, func, *args):
+        # max_workers为0时不使用线程池，直接在当前线程计算
+        if not self.max_workers:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolFull()
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # 还在排队的任务取消掉，不再占用线程
+            future.cancel()
+            raise HashingPoolFull()
+
+    def make_password(self, password):
+        return self.run(hashers.make_password, password)
+
+    def check_password(self, password, encoded, setter=None):
+        # 线程池中只做计算，只记录是否需要升级哈希(算法、迭代次数变化)；
+        # 需要时在调用线程中调用setter(password)，由setter重新计算哈希并写库
+        upgrade = []
+        valid = self.run(hashers.check_password, password, encoded, upgrade.append)
+        if valid and upgrade and setter is not None:
+            setter(password)
+        return valid
+
+
+pool_settings = getattr(settings, 'PASSWORD_HASHING_POOL', {})
+hashing_pool = HashingPool(
+    max_workers=pool_settings.get('MAX_WORKERS', 4),
+    max_queue=pool_settings.get('MAX_QUEUE', 32),
+    timeout=pool_settings.get('TIMEOUT', 10),
+)
@@ -0,0 +1,144 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from book.signals import post_bulk_write
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def add_error(errors, index, field, message):
+    # 同一行的多个错误合并返回，不互相覆盖
+    errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+
+# 批量写入
+# 逐条校验字段，唯一性和外键存在性按批次各一次查询；校验失败的数据按下标返回错误，其余数据分块在各自事务中
+# bulk_create/bulk_update写入，每块一条INSERT/UPDATE
+class BulkWriter:
+    def __init__(self, serializer_class, chunk_size=1000):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.chunk_size = chunk_size
+        fields = self.model._meta.concrete_fields
+        self.unique_fields = [f.attname for f in fields if f.unique and not f.primary_key]
+        self.foreign_keys = [(f.attname, f.name, f.related_model) for f in fields if f.is_relation]
+        self.foreign_key_attnames = {attname for attname, _, _ in self.foreign_keys}
+
+    def validate(self, rows, partial=False):
+        # 复用同一个序列化器对象校验每条数据，避免每条都重新构建字段
+        serializer = self.serializer_class(partial=partial, context={'bulk': True})
+        valid, errors = [], {}
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors[index] = {'non_field_errors': ['数据格式有误，需要对象']}
+                continue
+            try:
+                attrs = serializer.run_validation(row)
+            except ValidationError as exc:
+                errors[index] = exc.detail
+                continue
+            if partial:
+                try:
+                    attrs['id'] = int(row['id'])
+                except (KeyError, TypeError, ValueError):
+                    errors[index] = {'id': ['更新时需要提供id']}
+                    continue
+            valid.append((index, attrs))
+        return valid, errors
+
+    def check_constraints(self, items, errors):
+        # 唯一字段：批次内重复、与数据库中其他行重复
+        for field in self.unique_fields:
+            values = [attrs[field] for _, attrs in items if field in attrs]
+            existing = {}
+            for chunk in chunked(values, self.chunk_size):
+                # 唯一约束包括已逻辑删除的数据，使用不过滤的基础管理器
+                existing.update(self.model._base_manager.filter(**{field + '__in': chunk}).values_list(field, 'id'))
+            seen = set()
+            for index, attrs in items:
+                if field not in attrs:
+                    continue
+                value = attrs[field]
+                owner = existing.get(value)
+                if value in seen or (owner is not None and owner != attrs.get('id')):
+                    add_error(errors, index, field, '%s已存在' % value)
+                seen.add(value)
+
+        # 外键：关联的对象必须存在
+        for field, name, related_model in self.foreign_keys:
+            ids = {attrs[field] for _, attrs in items if attrs.get(field) is not None}
+            found = set()
+            for chunk in chunked(list(ids), self.chunk_size):
+                found.update(related_model.objects.filter(id__in=chunk).values_list('id', flat=True))
+            for index, attrs in items:
+                if attrs.get(field) is not None and attrs[field] not in found:
+                    add_error(errors, index, name, '关联对象%s不存在' % attrs[field])
+
+        return [(index, attrs) for index, attrs in items if index not in errors]
+
+    def create(self, rows):
+        items, errors = self.validate(rows)
+        items = self.check_constraints(items, errors)
+        created = 0
+        for chunk in chunked(items, self.chunk_size):
+            with transaction.atomic():
+                objs = self.model.objects.bulk_create([self.model(**attrs) for _, attrs in chunk])
+            created += len(chunk)
+            self.send_bulk_write(objs, None)
+        return {'created': created, 'errors': self.format_errors(errors)}
+
+    def update(self, rows):
+        items, errors = self.validate(rows, partial=True)
+        items = self.check_constraints(items, errors)
+        updated = 0
+        for chunk in chunked(items, self.chunk_size):
+            instances = self.model.objects.in_bulk([attrs['id'] for _, attrs in chunk])
+            objs, fields = [], {'updated_at'}
+            previous = defaultdict(set)
+            now = timezone.now()
+            for index, attrs in chunk:
+                instance = instances.get(attrs['id'])
+                if instance is None:
+                    errors[index] = {'id': ['%s不存在' % attrs['id']]}
+                    continue
+                for field, value in attrs.items():
+                    if field != 'id':
+                        if field in self.foreign_key_attnames and getattr(instance, field) != value:
+                            previous[field].add(getattr(instance, field))
+                        setattr(instance, field, value)
+                        fields.add(field)
+                instance.updated_at = now
+                objs.append(instance)
+            if objs:
+                with transaction.atomic():
+                    self.model.objects.bulk_update(objs, sorted(fields))
+                self.send_bulk_write(objs, sorted(fields), previous)
+            updated += len(objs)
+        return {'updated': updated, 'errors': self.format_errors(errors)}
+
+    def soft_delete(self, ids):
+        # 逻辑删除：每块一条 UPDATE ... SET is_delete = 1 WHERE id IN (...)
+        deleted = 0
+        for chunk in chunked(ids, self.chunk_size):
+            deleted += self.model.objects.filter(id__in=chunk, is_delete=False).soft_delete()
+            post_bulk_write.send(sender=self.model, pks=chunk, fields=['is_delete', 'updated_at'])
+        return {'deleted': deleted}
+
+    def send_bulk_write(self, objs, fields, previous=None):
+        pks = [obj.pk for obj in objs if obj.pk is not None]
+        if len(pks) < len(objs) and self.unique_fields:
+            # MySQL的bulk_create不回填主键，按唯一字段一次查询取回
+            field = self.unique_fields[0]
+            values = [getattr(obj, field) for obj in objs]
+            pks = list(self.model._base_manager.filter(**{field + '__in': values}).values_list('pk', flat=True))
+        post_bulk_write.send(sender=self.model, pks=pks, fields=fields, previous=previous or {})
+
+    @staticmethod
+    def format_errors(errors):
+        return [{'index': index, 'errors': errors[index]} for index in sorted(errors)]
@@ -0,0 +1,121 @@
+import hashlib
+
+from django.db.models import Max
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from book.signals import post_bulk_write
+
+
+# 条件GET：客户端带上次响应的ETag(If-None-Match)或Last-Modified(If-Modified-Since)再次请求，数据没变时返回304，
+# 不查询数据、不序列化、不渲染。是否变化只用一条很便宜的查询判断：
+#   详情：SELECT updated_at WHERE id = pk
+#   列表：SELECT MAX(updated_at)，包括已逻辑删除的行，走updated_at索引
+#        删除是逻辑删除并更新updated_at，所以修改、删除都会使MAX变化；不用COUNT(*)，它要扫描全部数据
+#        绕过接口直接物理删除的数据不会使ETag变化
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+# 详情的ETag：主键 + 更新时间，GET返回的与PUT时比较的必须一致
+def instance_etag(pk, updated_at):
+    return make_etag(str(pk), updated_at.isoformat())
+
+
+def conditional_response(request, etag, last_modified, handler, *args, **kwargs):
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = handler(request, *args, **kwargs)
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def latest(*values):
+    return max((value for value in values if value is not None), default=None)
+
+
+# 视图集/通用视图使用：list、retrieve支持条件GET，update支持If-Match和乐观锁
+# 响应还依赖其他表时(如带上人物、统计)，重写get_dependent_last_modified返回这些表的最后修改时间，参与ETag计算
+class ConditionalRequestMixin:
+    def list(self, request, *args, **kwargs):
+        # 与列表相同的过滤条件，但不排除已逻辑删除的行
+        queryset = self.filter_queryset(self.get_queryset().model._base_manager.all())
+        last_modified = latest(queryset.aggregate(last_modified=Max('updated_at'))['last_modified'],
+                               self.get_dependent_last_modified())
+        etag = make_etag(request.path, sorted(request.query_params.lists()),
+                         last_modified.isoformat() if last_modified else None)
+        return conditional_response(request, etag, last_modified, super().list, *args, **kwargs)
+
+    def get_dependent_last_modified(self):
+        return None
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        updated_at = (
+            self.filter_queryset(self.get_queryset())
+            .filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+            .values_list('updated_at', flat=True).first()
+        )
+        if updated_at is None:
+            # 不存在，交给get_object返回404
+            return super().retrieve(request, *args, **kwargs)
+        etag = instance_etag(kwargs[lookup_url_kwarg], updated_at)
+        dependent = self.get_dependent_last_modified()
+        if dependent is not None:
+            # 与PUT的If-Match比较的是不带依赖的ETag，依赖其他表的响应ETag不同
+            etag = make_etag(etag, dependent.isoformat())
+            updated_at = latest(updated_at, dependent)
+        return conditional_response(request, etag, updated_at, super().retrieve, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+        response = check_if_match(request, instance)
+        if response is not None:
+            return response
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        response = save_if_unmodified(instance, serializer.validated_data)
+        if response is not None:
+            return response
+        return Response(serializer.data, headers={'ETag': instance_etag(instance.pk, instance.updated_at)})
+
+    def perform_destroy(self, instance):
+        # 逻辑删除，同时更新updated_at，列表的ETag随之变化
+        instance.is_delete = True
+        instance.save(update_fields=['is_delete', 'updated_at'])
+
+
+# 乐观锁：请求带If-Match时必须与当前ETag一致，否则412
+def check_if_match(request, instance):
+    if not request.META.get('HTTP_IF_MATCH'):
+        return None
+    return get_conditional_response(request, etag=instance_etag(instance.pk, instance.updated_at),
+                                    last_modified=int(instance.updated_at.timestamp()))
+
+
+# 原来的做法是先查出对象、修改、再save()，两次请求并发修改时后保存的会覆盖先保存的(丢失更新)
+# 这里用 UPDATE ... WHERE id = pk AND updated_at = 读取时的值 写入，期间有其他写入时影响行数为0，返回412
+# update()不触发post_save，发送post_bulk_write通知搜索索引、响应缓存
+def save_if_unmodified(instance, validated_data):
+    model = type(instance)
+    now = timezone.now()
+    rows = model.objects.filter(pk=instance.pk, updated_at=instance.updated_at).update(updated_at=now, **validated_data)
+    if not rows:
+        return HttpResponse(status=status.HTTP_412_PRECONDITION_FAILED)
+    previous = {f.attname: {getattr(instance, f.attname)} for f in model._meta.concrete_fields
+                if f.is_relation and f.name in validated_data}
+    for field, value in validated_data.items():
+        setattr(instance, field, value)
+    instance.updated_at = now
+    post_bulk_write.send(sender=model, pks=[instance.pk], fields=sorted(validated_data) + ['updated_at'],
+                         previous=previous)
+    return None
@@ -0,0 +1,159 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from book.models import BookInfo
+from book.signals import counter_changed, post_bulk_write
+
+logger = logging.getLogger(__name__)
+
+
+# 阅读量/评论量计数器
+# 原来的做法是先查出对象、加一、再save()，并发时会丢失增量，而且save()会重写整行所有字段
+# 这里先在进程内缓冲增量，按批次合并成 UPDATE bookinfo SET read_count = read_count + n WHERE id IN (...)
+# 增量相同的书籍合并为一条UPDATE，每次刷新的语句数与书籍数无关
+class BookCounter:
+    fields = ('read_count', 'comment_count')
+
+    def __init__(self, flush_interval=5, flush_threshold=1000):
+        self.flush_interval = flush_interval        # 距上次刷新超过多少秒后自动刷新
+        self.flush_threshold = flush_threshold      # 缓冲的增量超过多少后立即刷新
+        self._lock = threading.Lock()
+        self._pending = defaultdict(Counter)        # {字段名: {书籍id: 增量}}
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._seq = 0                               # 每次增加的序号，随counter_changed发出
+        self._flushes_started = 0                   # 已开始、已完成(提交或失败)的刷新次数
+        self._flushes_done = 0
+
+    def incr(self, book_id, field='read_count', amount=1):
+        if field not in self.fields:
+            raise ValueError('不支持的计数字段: %s' % field)
+        with self._lock:
+            self._pending[field][int(book_id)] += amount
+            self._buffered += amount
+            self._seq += 1
+            seq = self._seq
+            should_flush = (self._buffered >= self.flush_threshold
+                            or time.monotonic() - self._last_flush >= self.flush_interval)
+        counter_changed.send(sender=BookInfo, pk=int(book_id), field=field, amount=amount, seq=seq)
+        if should_flush:
+            # 增量已经缓冲，刷新失败(增量已放回缓冲区)不影响本次调用
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing book counters failed')
+        else:
+            self._schedule()
+
+    def pending(self, book_id, field='read_count'):
+        # 尚未写入数据库的增量，用于展示时叠加到数据库中的值上
+        with self._lock:
+            return self._pending[field].get(int(book_id), 0)
+
+    def snapshot(self):
+        # 一次加锁取出：(尚未写入的增量, 最后一次增加的序号, 已开始的刷新次数, 已完成的刷新次数)
+        # 读取者(排行榜)据此判断哪些增加已包含在快照中、查询期间是否有刷新在写库
+        with self._lock:
+            pending = {field: dict(counts) for field, counts in self._pending.items()}
+            return pending, self._seq, self._flushes_started, self._flushes_done
+
+    def flushes_started(self):
+        with self._lock:
+            return self._flushes_started
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+            self._buffered = 0
+            self._last_flush = time.monotonic()
+            if not pending:
+                return 0
+            self._flushes_started += 1
+        try:
+            return self._write(pending)
+        finally:
+            with self._lock:
+                self._flushes_done += 1
+
+    def _write(self, pending):
+        updated = 0
+        try:
+            with transaction.atomic():
+                for field, counts in pending.items():
+                    # 按增量分组：同一增量的书籍一条UPDATE完成
+                    groups = defaultdict(list)
+                    for book_id, amount in counts.items():
+                        groups[amount].append(book_id)
+                    for amount, book_ids in groups.items():
+                        updated += BookInfo.objects.filter(id__in=book_ids).update(
+                            **{field: F(field) + amount, 'updated_at': timezone.now()})
+                    post_bulk_write.send(sender=BookInfo, pks=list(counts), fields=[field, 'updated_at'])
+        except OperationalError:
+            # 暂时性错误(连接断开、锁等待超时)：把增量放回缓冲区，下次再写，不丢计数
+            self._requeue(pending)
+            raise
+        except Exception:
+            # 其他错误(如id超出整数范围)重试也不会成功，整批放回会使之后的刷新一直失败；
+            # 逐个书籍重写，出错的增量记录日志后丢弃，其余正常写入
+            logger.exception('Flushing book counters failed, retrying one book at a time')
+            return self._write_each(pending)
+        return updated
+
+    def _write_each(self, pending):
+        updated = 0
+        for field, counts in pending.items():
+            written = []
+            for book_id, amount in counts.items():
+                try:
+                    with transaction.atomic():
+                        updated += BookInfo.objects.filter(id=book_id).update(
+                            **{field: F(field) + amount, 'updated_at': timezone.now()})
+                except OperationalError:
+                    self._requeue({field: {book_id: amount}})
+                    continue
+                except Exception:
+                    logger.exception('Dropping %s +%d for book %r: cannot be written', field, amount, book_id)
+                    continue
+                written.append(book_id)
+            if written:
+                post_bulk_write.send(sender=BookInfo, pks=written, fields=[field, 'updated_at'])
+        return updated
+
+    def _requeue(self, pending):
+        with self._lock:
+            for field, counts in pending.items():
+                self._pending[field].update(counts)
+                self._buffered += sum(counts.values())
+
+    def _schedule(self):
+        # 低流量时也能在flush_interval内落库
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # 定时线程使用的是自己的数据库连接，用完关闭
+            connections.close_all()
+
+
+counter_settings = getattr(settings, 'BOOK_COUNTER', {})
+book_counter = BookCounter(
+    flush_interval=counter_settings.get('FLUSH_INTERVAL', 5),
+    flush_threshold=counter_settings.get('FLUSH_THRESHOLD', 1000),
+)
+# 进程退出前写入剩余的增量
+atexit.register(book_counter.flush)
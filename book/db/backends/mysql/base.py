@@ -0,0 +1,10 @@
+from django.db.backends.mysql import base
+
+from book.db.pool import PooledDatabaseWrapperMixin
+
+
+# 带连接池的MySQL后端：ENGINE = 'book.db.backends.mysql'
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def ping_connection(self, conn):
+        # ping不执行SQL，只检查连接；PyMySQL默认reconnect=True，会悄悄重连，坏掉的连接就不会被丢弃
+        conn.ping(reconnect=False)
@@ -0,0 +1,9 @@
+from django.db.backends.sqlite3 import base
+
+from book.db.pool import PooledDatabaseWrapperMixin
+
+
+# 带连接池的SQLite后端：ENGINE = 'book.db.backends.sqlite3'，用于本地开发和测试连接池
+# 内存数据库Django不会关闭连接，不经过连接池
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,210 @@
+import collections
+import functools
+import threading
+import time
+
+from django.db.utils import OperationalError
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+# 数据库连接池
+# Django 3.2每个线程一个连接，CONN_MAX_AGE=0时每个请求结束都断开，下一个请求重新建立TCP连接、握手、认证
+# 连接池在进程内所有线程(WSGI工作线程、ASGI线程池)之间共享物理连接：请求结束时连接归还连接池，不断开
+#   max_size       常驻连接数，归还时空闲连接超过该数量的直接关闭
+#   max_overflow   高峰时允许临时多建的连接数，总连接数上限为max_size + max_overflow
+#   timeout        连接全部被占用时等待的秒数，超时抛出PoolTimeout
+#   idle_timeout   空闲超过该秒数的连接关闭，避免被MySQL的wait_timeout断开
+#   max_lifetime   连接建立超过该秒数后不再复用
+#   ping_interval  取出空闲超过该秒数的连接时先检查连接是否可用，不可用的丢弃并重新取
+class ConnectionPool:
+    def __init__(self, connect, ping=None, max_size=5, max_overflow=5, timeout=10,
+                 idle_timeout=300, max_lifetime=3600, ping_interval=30):
+        self.connect = connect
+        self.ping = ping
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._idle = collections.deque()         # [(连接, 建立时间, 归还时间)]，后进先出
+        self._created_at = {}                    # {id(连接): 建立时间}，包括使用中的连接
+        self._in_use = 0
+        self._connecting = 0                     # 正在建立的连接数
+        self.counters = collections.Counter()
+
+    @property
+    def size(self):
+        return len(self._created_at) + self._connecting
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, ping = self._take(deadline)
+            if conn is None:
+                break
+            # ping是一次网络往返，不持有锁：一个慢的或已断开的连接不阻塞其他线程取连接
+            if not ping or self._ping(conn):
+                with self._cond:
+                    self._checkout('reused')
+                return conn
+
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._connecting -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._connecting -= 1
+            self._created_at[id(conn)] = time.monotonic()
+            self._checkout('created')
+        return conn
+
+    def _take(self, deadline):
+        # 返回(空闲连接, 是否需要ping)；没有可用的空闲连接时占一个新建连接的位置，返回(None, False)
+        expired = []
+        try:
+            with self._cond:
+                while True:
+                    # 优先复用最近归还的连接
+                    while self._idle:
+                        conn, created_at, released_at = self._idle.pop()
+                        now = time.monotonic()
+                        if now - released_at > self.idle_timeout or now - created_at > self.max_lifetime:
+                            self._forget(conn, 'expired')
+                            expired.append(conn)
+                            continue
+                        return conn, self.ping is not None and now - released_at > self.ping_interval
+                    if self.size < self.max_size + self.max_overflow:
+                        # 先占位，建立连接期间不持有锁
+                        self._connecting += 1
+                        return None, False
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters['timeouts'] += 1
+                        raise PoolTimeout('数据库连接池已满(%d个连接)，等待%s秒超时' % (self.size, self.timeout))
+                    self.counters['waits'] += 1
+                    self._cond.wait(remaining)
+        finally:
+            # 关闭连接同样可能是网络往返，在锁外进行
+            for conn in expired:
+                self._close_quietly(conn)
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            self._in_use -= 1
+            created_at = self._created_at.get(id(conn))
+            if created_at is None:
+                return
+            # 损坏的连接、超出常驻数量的溢出连接直接关闭
+            if discard or len(self._idle) >= self.max_size:
+                self._discard(conn, 'closed')
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop()[0], 'closed')
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self.counters,
+                size=self.size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                overflow=max(self.size - self.max_size, 0),
+                max_size=self.max_size,
+                max_overflow=self.max_overflow,
+            )
+
+    def _checkout(self, counter):
+        self._in_use += 1
+        self.counters[counter] += 1
+        self.counters['max_in_use'] = max(self.counters['max_in_use'], self._in_use)
+
+    def _ping(self, conn):
+        # 在锁外调用；失败时丢弃连接并唤醒一个等待的线程(它可以新建连接)
+        try:
+            self.ping(conn)
+            return True
+        except Exception:
+            with self._cond:
+                self.counters['ping_failures'] += 1
+                self._forget(conn, 'closed')
+                self._cond.notify()
+            self._close_quietly(conn)
+            return False
+
+    def _discard(self, conn, counter):
+        self._forget(conn, counter)
+        self._close_quietly(conn)
+
+    def _forget(self, conn, counter):
+        self._created_at.pop(id(conn), None)
+        self.counters[counter] += 1
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# 每个数据库(别名 + 连接参数)一个连接池，进程内共享
+def get_pool(key, connect, ping=None, **options):
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(connect, ping, **options)
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {'%s:%s' % key[:2]: pool.stats() for key, pool in pools}
+
+
+# 数据库后端使用：在Django的DatabaseWrapper上替换建立、关闭物理连接的方法
+# 配置写在DATABASES的POOL中(键与ConnectionPool的参数相同，大写)，CONN_MAX_AGE保持0：请求结束即归还连接
+class PooledDatabaseWrapperMixin:
+    pool = None
+
+    def get_pool(self, conn_params):
+        options = {k.lower(): v for k, v in (self.settings_dict.get('POOL') or {}).items()}
+        key = (self.alias, self.settings_dict['NAME'], repr(sorted(conn_params.items())))
+        connect = functools.partial(super().get_new_connection, conn_params)
+        return get_pool(key, connect, self.ping_connection, **options)
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        return self.pool.acquire()
+
+    def ping_connection(self, conn):
+        conn.cursor().execute('SELECT 1')
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        # 归还前回滚未提交的事务；回滚失败或请求中出现过数据库错误的连接不再复用
+        discard = self.errors_occurred
+        try:
+            if not self.get_autocommit() or self.in_atomic_block:
+                self.connection.rollback()
+        except Exception:
+            discard = True
+        self.pool.release(self.connection, discard=discard)
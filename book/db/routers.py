@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import itertools
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.decorators import sync_and_async_middleware
+
+
+# 读写分离
+# GET/HEAD请求中book应用的查询发给只读副本，其余请求、写操作、事务中的查询都发给主库(default)
+# 读己之写：请求中有写操作(APP_LABELS中的模型)后，本请求之后的查询都走主库；响应中设置Cookie，之后一段时间内同一客户端的请求也都走主库，
+# 避免刚写入的数据因为复制延迟在副本上还查不到；这段时间不小于副本可能的最大延迟(pin_seconds)
+# 一个请求只选一次副本，请求中的查询都读同一个副本，不会因为各副本延迟不同读到前后不一致的数据
+# 副本健康检查：每个副本最多每CHECK_INTERVAL秒检查一次(连接 + 查询复制延迟)，连接失败或延迟超过MAX_LAG的暂时不用，
+# 全部不可用时回退到主库
+
+
+# 当前请求的路由状态，contextvars在线程和协程(sync_to_async)之间都能正确传递
+class RoutingState:
+    def __init__(self, use_replica=False):
+        self.use_replica = use_replica
+        self.wrote = False
+        self.replica = None                 # 本请求选定的副本(第一次读副本时选择)，没有可用副本时为主库
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def replica_lag(connection):
+    # 返回复制延迟(秒)；MySQL读取SHOW SLAVE STATUS，其他数据库(本地测试用的SQLite)只检查连接
+    with connection.cursor() as cursor:
+        if connection.vendor != 'mysql':
+            cursor.execute('SELECT 1')
+            return 0
+        cursor.execute('SHOW SLAVE STATUS')
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        status = dict(zip([c[0] for c in cursor.description], row))
+    lag = status.get('Seconds_Behind_Master')
+    # 复制线程停止时为NULL
+    return float('inf') if lag is None else lag
+
+
+class ReplicaSet:
+    def __init__(self, aliases=(), strategy='round_robin', max_lag=10, check_interval=5):
+        self.aliases = list(aliases)
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._health = {}                       # {别名: (是否可用, 延迟, 检查时间)}
+        self._cycle = itertools.count()
+        self.counters = {}
+
+    def _count(self, name):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def check(self, alias):
+        now = time.monotonic()
+        health = self._health.get(alias)
+        if health is not None and now - health[2] < self.check_interval:
+            return health
+        try:
+            lag = replica_lag(connections[alias])
+            healthy = lag <= self.max_lag
+        except DatabaseError:
+            lag, healthy = None, False
+        if not healthy:
+            self._count('unhealthy_checks')
+        health = self._health[alias] = (healthy, lag, now)
+        return health
+
+    def choose(self):
+        healthy = [(alias, health[1]) for alias, health in ((a, self.check(a)) for a in self.aliases) if health[0]]
+        if not healthy:
+            self._count('fallback')
+            return None
+        if self.strategy == 'least_lag':
+            alias = min(healthy, key=lambda item: item[1])[0]
+        else:
+            alias = healthy[next(self._cycle) % len(healthy)][0]
+        self._count(alias)
+        return alias
+
+    def stats(self):
+        return {
+            'strategy': self.strategy,
+            'replicas': {
+                alias: {'healthy': health[0], 'lag': health[1]}
+                for alias, health in self._health.items()
+            },
+            'reads': dict(self.counters),
+        }
+
+
+replicas = ReplicaSet(
+    aliases=settings.DATABASE_REPLICAS['ALIASES'],
+    strategy=settings.DATABASE_REPLICAS['STRATEGY'],
+    max_lag=settings.DATABASE_REPLICAS['MAX_LAG'],
+    check_interval=settings.DATABASE_REPLICAS['CHECK_INTERVAL'],
+)
+
+
+# DATABASE_ROUTERS = ['book.db.routers.ReplicaRouter']
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if model._meta.app_label not in settings.DATABASE_REPLICAS['APP_LABELS']:
+            return DEFAULT_DB_ALIAS
+        # 主库事务中的查询要看到事务内的修改
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = replicas.choose() or DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        # 必须明确返回主库：从副本查出的对象save()时，Django默认会写回它来源的数据库
+        # 只有读副本的应用的写操作才需要读己之写(会话、令牌等其他应用的写入不影响读哪个库)
+        state = _state.get()
+        if state is not None and model._meta.app_label in settings.DATABASE_REPLICAS['APP_LABELS']:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 主库和副本是同一份数据
+        databases = {DEFAULT_DB_ALIAS, *replicas.aliases}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas.aliases:
+            return False
+        return None
+
+
+def pin_seconds():
+    # 副本的延迟在检查时不超过MAX_LAG，到下次检查(CHECK_INTERVAL秒)之前最多再增加这么多；
+    # 写操作之后读主库的时间不能比这更短，否则过期后仍可能读到还没有复制过去的副本
+    options = settings.DATABASE_REPLICAS
+    return max(options['PIN_SECONDS'], options['MAX_LAG'] + options['CHECK_INTERVAL'])
+
+
+# 放在MIDDLEWARE中(会话、认证中间件之前，它们也会查询)：标记当前请求能否读副本，有写操作时设置读主库的Cookie
+# 同时支持同步、异步(ASGI下同步的中间件会使异步视图串行执行，见BookLib.utils.perfMiddleware)
+@sync_and_async_middleware
+class ReplicaRoutingMiddleware:
+    safe_methods = ('GET', 'HEAD')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # 让Django把该中间件当作协程函数
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    def start(self, request):
+        cookie = settings.DATABASE_REPLICAS['PIN_COOKIE']
+        try:
+            pinned = float(request.COOKIES.get(cookie, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return RoutingState(use_replica=request.method in self.safe_methods and not pinned)
+
+    def finish(self, state, response):
+        if state.wrote:
+            seconds = pin_seconds()
+            response.set_cookie(settings.DATABASE_REPLICAS['PIN_COOKIE'], str(time.time() + seconds),
+                                max_age=seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,100 @@
+import hashlib
+
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from BookLib.utils.customDRFRenderer import FastJSONRenderer
+from book.bulk import chunked
+from book.compiled_serializer import compile_serializer
+from book.models import BookDocument, BookInfo, PersonInfo
+from book.serializer import BookInfoModelSerializer, PersonInfoModelSerializer
+from book.signals import post_bulk_write
+
+
+# 书籍详情文档：每本书预先渲染好一份JSON(书籍字段 + personinfo_set人物列表)，存在book_document表中
+# 内容与 GET /book/books/{pk}/?expand=personinfo_set 相同，按书重建：书籍一次查询、人物一次查询，用编译的序列化器构造
+# 书籍、人物的任何写入都在事务提交后重建对应书籍的文档(计数器落库也会，按批次)；书籍逻辑删除后删除它的文档
+# 接口用游标直接读取body返回，不构造模型对象、不序列化、不渲染
+def render_documents(book_ids):
+    # 返回{书籍id: JSON字节}，只包括未删除的书籍
+    book_serializer = compile_serializer(BookInfoModelSerializer)
+    person_serializer = compile_serializer(PersonInfoModelSerializer)
+    documents = {}
+    for row in BookInfo.objects.filter(id__in=book_ids).values(*book_serializer.columns):
+        documents[row['id']] = dict(book_serializer.row(row), personinfo_set=[])
+    persons = (PersonInfo.objects.filter(book_id__in=list(documents)).order_by('id')
+               .values(*person_serializer.columns))
+    for row in persons:
+        documents[row['book_id_id']]['personinfo_set'].append(person_serializer.row(row))
+    renderer = FastJSONRenderer()
+    return {book_id: renderer.render(document) for book_id, document in documents.items()}
+
+
+def document_etag(body):
+    return hashlib.md5(body).hexdigest()
+
+
+def build_documents(book_ids, chunk_size=500):
+    # 重建这些书籍的文档，返回{书籍id: JSON字节}
+    book_ids = sorted({book_id for book_id in book_ids if book_id is not None})
+    bodies = {}
+    for chunk in chunked(book_ids, chunk_size):
+        rendered = render_documents(chunk)
+        now = timezone.now()
+        objs = [BookDocument(book_id_id=book_id, body=body, etag=document_etag(body), updated_at=now)
+                for book_id, body in rendered.items()]
+        with transaction.atomic():
+            BookDocument.objects.filter(book_id__in=set(chunk) - set(rendered)).delete()
+            existing = set(BookDocument.objects.filter(book_id__in=list(rendered)).values_list('book_id', flat=True))
+            # 并发重建同一本书时，后插入的忽略冲突即可
+            BookDocument.objects.bulk_create([obj for obj in objs if obj.book_id_id not in existing],
+                                             ignore_conflicts=True)
+            BookDocument.objects.bulk_update([obj for obj in objs if obj.book_id_id in existing],
+                                             ['body', 'etag', 'updated_at'])
+        bodies.update(rendered)
+    return bodies
+
+
+def fetch_document(book_id):
+    # 返回(JSON字节, etag)，没有文档时返回(None, None)
+    connection = connections[router.db_for_read(BookDocument)]
+    quote = connection.ops.quote_name
+    sql = 'SELECT %s, %s FROM %s WHERE %s = %%s' % (
+        quote('body'), quote('etag'), quote(BookDocument._meta.db_table), quote('book_id'))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [book_id])
+        row = cursor.fetchone()
+    if row is None:
+        return None, None
+    return bytes(row[0]), row[1]
+
+
+def build_on_commit(book_ids):
+    book_ids = [book_id for book_id in book_ids if book_id is not None]
+    if book_ids:
+        transaction.on_commit(lambda: build_documents(book_ids))
+
+
+@receiver(post_save, sender=BookInfo)
+def book_saved(sender, instance=None, **kwargs):
+    build_on_commit([instance.pk])
+
+
+@receiver(post_bulk_write, sender=BookInfo)
+def books_written(sender, pks=None, **kwargs):
+    build_on_commit(pks or [])
+
+
+@receiver(post_save, sender=PersonInfo)
+@receiver(post_delete, sender=PersonInfo)
+def person_changed(sender, instance=None, **kwargs):
+    build_on_commit([instance.book_id_id, getattr(instance, '_old_book_id', None)])
+
+
+@receiver(post_bulk_write, sender=PersonInfo)
+def persons_written(sender, pks=None, previous=None, **kwargs):
+    book_ids = set(PersonInfo.all_objects.filter(id__in=pks or []).values_list('book_id', flat=True))
+    book_ids.update((previous or {}).get('book_id_id', ()))
+    build_on_commit(book_ids)
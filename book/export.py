@@ -0,0 +1,59 @@
+import csv
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from book.models import BookInfo, PersonInfo
+
+
+BOOK_FIELDS = ('id', 'name', 'pub_date', 'read_count', 'comment_count', 'is_delete')
+PERSON_FIELDS = ('id', 'name', 'gender', 'description', 'is_delete')
+
+
+# 按主键分批读取：WHERE id > 上一批最大id LIMIT n，只取需要的列(values)，不实例化模型对象
+# 每批书籍的人物用一条 book_id IN (...) 查询补齐，内存占用只与批大小有关
+def iter_books(with_persons=False, chunk_size=2000):
+    last_id = 0
+    while True:
+        books = list(BookInfo.objects.filter(id__gt=last_id).order_by('id').values(*BOOK_FIELDS)[:chunk_size])
+        if not books:
+            return
+        if with_persons:
+            persons = defaultdict(list)
+            queryset = PersonInfo.objects.filter(book_id__in=[book['id'] for book in books])
+            for person in queryset.order_by('id').values('book_id', *PERSON_FIELDS):
+                persons[person.pop('book_id')].append(person)
+            for book in books:
+                book['persons'] = persons.get(book['id'], [])
+        yield from books
+        if len(books) < chunk_size:
+            return
+        last_id = books[-1]['id']
+
+
+def iter_ndjson(books):
+    for book in books:
+        yield json.dumps(book, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+# csv.writer需要一个有write方法的对象，这里直接返回写入的内容，交给StreamingHttpResponse
+class Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(books, with_persons=False):
+    writer = csv.writer(Echo())
+    header = list(BOOK_FIELDS)
+    if with_persons:
+        header += ['person_' + field for field in PERSON_FIELDS]
+    yield writer.writerow(header)
+    for book in books:
+        row = [book[field] for field in BOOK_FIELDS]
+        if not with_persons:
+            yield writer.writerow(row)
+            continue
+        # 每个人物一行，没有人物的书籍也输出一行
+        for person in book['persons'] or [dict.fromkeys(PERSON_FIELDS, '')]:
+            yield writer.writerow(row + [person[field] for field in PERSON_FIELDS])
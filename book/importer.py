@@ -0,0 +1,235 @@
+import csv
+import json
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from book.models import BookInfo, PersonInfo
+from book.serializer import BookInfoModelSerializer, PersonInfoModelSerializer
+from book.signals import post_bulk_write
+
+
+# 文件本身无法读取(编码错误、CSV格式错误)：不是某一行数据有误，无法继续读取后面的行，停止导入
+class ImportFileError(ValueError):
+    def __init__(self, line_no, message):
+        super().__init__('第%d行: %s' % (line_no, message))
+        self.line_no = line_no
+
+
+# 二进制流逐行解码：TextIOWrapper按块解码，编码错误只能定位到块，逐行解码可以给出出错的行
+def decode_lines(stream, encoding='utf-8'):
+    for line_no, line in enumerate(stream, 1):
+        try:
+            yield line.decode(encoding)
+        except UnicodeDecodeError as exc:
+            raise ImportFileError(line_no, '不是%s编码' % encoding) from exc
+
+
+# 逐行读取NDJSON，每行一个对象
+def read_ndjson(stream):
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, None
+
+
+# 逐行读取CSV，空字符串视为未提供；导出格式中的person_*列拆成嵌套的persons
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    rows = enumerate(reader, 2)
+    while True:
+        try:
+            line_no, row = next(rows)
+        except StopIteration:
+            return
+        except csv.Error as exc:
+            # 引号不匹配、字段超长等；DictReader.line_num只在成功读取一行后更新，取底层reader已读取的物理行数
+            raise ImportFileError(reader.reader.line_num, 'CSV格式有误(%s)' % exc) from exc
+        record = {k: v for k, v in row.items() if k and v not in ('', None)}
+        person = {k[len('person_'):]: record.pop(k) for k in list(record) if k.startswith('person_')}
+        if person:
+            record['persons'] = [person]
+        yield line_no, record
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+# 书籍、人物流式导入
+# 按书名/人物名upsert：已存在的bulk_update，不存在的bulk_create，每批一个事务
+# 书名到id的映射缓存在内存中，一批数据只查一次库，不再逐行查询
+# 名称唯一约束包括已逻辑删除的数据，这里统一使用all_objects
+class BookImporter:
+    def __init__(self, batch_size=1000, max_rejected=1000):
+        self.batch_size = batch_size
+        self.max_rejected = max_rejected       # 最多保留多少条被拒绝数据的详情
+        self.book_ids = {}            # {书名: id}
+        self.known_book_ids = set()   # 已确认存在的书籍id
+        self.books = []               # [(行号, 数据)]
+        self.persons = []
+        self.rejected = []            # [{'line': 行号, 'errors': ...}]
+        self.rejected_count = 0
+        self.stats = {'rows': 0, 'books_created': 0, 'books_updated': 0, 'persons_created': 0, 'persons_updated': 0}
+        self.started = time.perf_counter()
+
+    def run(self, records):
+        try:
+            for line_no, record in records:
+                self.feed(line_no, record)
+        except ImportFileError:
+            # 文件读取出错时，出错行之前的数据也写入(之前的批次已经提交)
+            self.flush()
+            raise
+        self.flush()
+        return self.report()
+
+    def feed(self, line_no, record):
+        self.stats['rows'] += 1
+        if not isinstance(record, dict):
+            self.reject(line_no, {'non_field_errors': ['数据格式有误']})
+            return
+        record.pop('id', None)
+        persons = record.pop('persons', None) or []
+        record_type = record.pop('type', None)
+        if record_type == 'person' or 'book' in record or 'book_id' in record:
+            self.persons.append((line_no, record))
+        else:
+            self.books.append((line_no, record))
+        # 嵌套的人物属于当前书籍
+        for person in persons:
+            if isinstance(person, dict):
+                person.pop('id', None)
+                person.setdefault('book', record.get('name'))
+            self.persons.append((line_no, person))
+
+        if len(self.books) >= self.batch_size or len(self.persons) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # 人物依赖书籍id，先写书籍
+        books, self.books = self.books, []
+        persons, self.persons = self.persons, []
+        if books:
+            self.upsert(BookInfo, BookInfoModelSerializer, books, 'books')
+        if persons:
+            persons = self.resolve_books(persons)
+            self.upsert(PersonInfo, PersonInfoModelSerializer, persons, 'persons')
+
+    def resolve_books(self, persons):
+        # 书名 -> id：内存中没有的书名一次查询补齐
+        names = {p['book'] for _, p in persons if isinstance(p, dict) and p.get('book') is not None}
+        missing = [name for name in names if name not in self.book_ids]
+        if missing:
+            self.book_ids.update(BookInfo.all_objects.filter(name__in=missing).values_list('name', 'id'))
+        ids = set()
+        resolved = []
+        for line_no, person in persons:
+            if not isinstance(person, dict):
+                self.reject(line_no, {'non_field_errors': ['数据格式有误']})
+                continue
+            name = person.pop('book', None)
+            if name is not None:
+                if name not in self.book_ids:
+                    self.reject(line_no, {'book': ['书籍%s不存在' % name]})
+                    continue
+                person['book_id'] = self.book_ids[name]
+            try:
+                ids.add(int(person['book_id']))
+            except (KeyError, TypeError, ValueError):
+                pass
+            resolved.append((line_no, person))
+
+        # 直接给出book_id的，一次查询确认存在
+        unknown = ids - self.known_book_ids
+        if unknown:
+            self.known_book_ids.update(BookInfo.all_objects.filter(id__in=unknown).values_list('id', flat=True))
+        return resolved
+
+    def upsert(self, model, serializer_class, rows, label):
+        serializer = serializer_class(partial=True, context={'bulk': True})
+        book_ids = self.known_book_ids | set(self.book_ids.values())
+        valid = {}
+        for line_no, row in rows:
+            try:
+                attrs = serializer.run_validation(row)
+            except ValidationError as exc:
+                self.reject(line_no, exc.detail)
+                continue
+            if not attrs.get('name'):
+                self.reject(line_no, {'name': ['必须提供']})
+                continue
+            if 'book_id_id' in attrs and attrs['book_id_id'] not in book_ids:
+                self.reject(line_no, {'book_id': ['关联书籍%s不存在' % attrs['book_id_id']]})
+                continue
+            # 同一批内名称重复时以最后一行为准
+            valid[attrs['name']] = (line_no, attrs)
+
+        if not valid:
+            return
+        existing = model.all_objects.in_bulk(list(valid), field_name='name')
+        created = []
+        for name, (line_no, attrs) in valid.items():
+            if name in existing:
+                continue
+            # 新建人物必须关联书籍
+            if model is PersonInfo and 'book_id_id' not in attrs:
+                self.reject(line_no, {'book_id': ['必须提供book或book_id']})
+                continue
+            created.append(model(**attrs))
+        fields = set()
+        previous = defaultdict(set)
+        foreign_keys = {f.attname for f in model._meta.concrete_fields if f.is_relation}
+        now = timezone.now()
+        for name, instance in existing.items():
+            for field, value in valid[name][1].items():
+                if field in foreign_keys and getattr(instance, field) != value:
+                    previous[field].add(getattr(instance, field))
+                setattr(instance, field, value)
+                fields.add(field)
+            instance.updated_at = now
+        fields.discard('name')
+
+        with transaction.atomic():
+            if created:
+                model.objects.bulk_create(created)
+            if existing and fields:
+                model.objects.bulk_update(list(existing.values()), sorted(fields | {'updated_at'}))
+        self.stats[label + '_created'] += len(created)
+        self.stats[label + '_updated'] += len(existing)
+
+        pks = [instance.pk for instance in existing.values()]
+        names = [instance.name for instance in created]
+        if names:
+            # MySQL的bulk_create不回填主键，按名称一次查询取回
+            created_ids = dict(model.all_objects.filter(name__in=names).values_list('name', 'id'))
+            pks.extend(created_ids.values())
+            if model is BookInfo:
+                # 新建书籍的id回填到内存映射中，供后续人物使用
+                self.book_ids.update(created_ids)
+        if model is BookInfo:
+            self.book_ids.update((name, instance.id) for name, instance in existing.items())
+        post_bulk_write.send(sender=model, pks=pks, fields=None, previous=previous)
+
+    def reject(self, line_no, errors):
+        self.rejected_count += 1
+        if len(self.rejected) < self.max_rejected:
+            self.rejected.append({'line': line_no, 'errors': errors})
+
+    def report(self):
+        seconds = time.perf_counter() - self.started
+        return dict(
+            self.stats,
+            rejected=self.rejected_count,
+            seconds=round(seconds, 3),
+            rows_per_sec=round(self.stats['rows'] / seconds, 1) if seconds else 0,
+        )
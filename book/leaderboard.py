@@ -0,0 +1,213 @@
+import bisect
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from book.counters import book_counter
+from book.models import BookInfo
+from book.signals import counter_changed, post_bulk_write
+
+
+# 排行榜：按阅读量、评论量或加权分数的前K名书籍，可按出版年份
+# 原来按read_count排序要对整张表排序；这里每个进程在内存中为每个榜单保留前depth名，请求时直接切片返回，不查询数据库
+#   增量：计数器每次增加(counter_changed)时调整榜上书籍的分数和位置，分数包括尚未落库的增量
+#   榜外的书籍：加载时分数不超过最后一名(floor)，累计增量后可能超过当前最后一名时，该榜单标记为过期
+#   对账：过期或超过reconcile_interval的榜单在下次请求时重新加载(ORDER BY ... LIMIT depth，有未落库增量的书籍再按id查一次)，
+#        其他进程的计数、直接修改的阅读量(PUT、批量修改)在对账后体现
+#   加载不持有锁：先取计数器的快照(未落库的增量 + 序号)再查询；加载期间到达的增加(序号大于快照)记下来，装上榜单时补上；
+#        加载期间有刷新在写库时，无法确定增量是否已在查询结果中(可能漏算或重复)，装上的榜单标记为过期，下次请求再加载
+#   书名、出版日期、逻辑删除变化时全部榜单过期(事务提交后，避免提交前重新加载到旧数据)
+BOOK_FIELDS = {'name', 'pub_date', 'is_delete'}
+
+
+class Board:
+    def __init__(self, rows, full):
+        self.order = sorted((-score, book_id) for book_id, score in rows.items())     # 分数从高到低
+        self.scores = rows
+        self.full = full                        # 不满时所有符合条件的书籍都在榜上
+        self.floor = -self.order[-1][0] if self.order else 0
+        self.outside = Counter()                # 榜外书籍加载之后的分数增量
+        self.loaded_at = time.monotonic()
+        self.stale = False
+
+    def add(self, book_id, delta):
+        score = self.scores.get(book_id)
+        if score is None:
+            self.outside[book_id] += delta
+            if self.full and self.floor + self.outside[book_id] > -self.order[-1][0]:
+                self.stale = True
+            return
+        del self.order[bisect.bisect_left(self.order, (-score, book_id))]
+        self.scores[book_id] = score + delta
+        bisect.insort(self.order, (-(score + delta), book_id))
+
+
+class Leaderboard:
+    metrics = ('read_count', 'comment_count', 'score')
+    book_fields = ('id', 'name', 'pub_date', 'read_count', 'comment_count')
+
+    def __init__(self, depth=200, reconcile_interval=60, max_boards=64, score_weights=None, counter=None):
+        self.depth = depth
+        self.reconcile_interval = reconcile_interval
+        self.max_boards = max_boards
+        # 每个榜单的分数 = 各计数字段 * 权重
+        self.weights = {
+            'read_count': {'read_count': 1},
+            'comment_count': {'comment_count': 1},
+            'score': dict(score_weights or {'read_count': 1, 'comment_count': 10}),
+        }
+        self.counter = counter or book_counter
+        self._lock = threading.Lock()
+        self._boards = OrderedDict()        # {(metric, year): Board}，按最近使用排序
+        self._books = {}                    # 榜上书籍的信息，各榜单共用
+        self._logs = []                     # 正在加载的榜单各自记录加载期间的增加
+
+    def top(self, metric='read_count', year=None, limit=10):
+        key = (metric, year)
+        log = []                            # 加载期间到达的增加 [(序号, 书籍id, 字段, 增量)]
+        with self._lock:
+            board = self._boards.get(key)
+            if board is not None:
+                self._boards.move_to_end(key)
+                fresh = not board.stale and time.monotonic() - board.loaded_at < self.reconcile_interval
+                if fresh:
+                    return self.rows(board, limit)
+            self._logs.append(log)
+        # 查询不持有锁，加载期间计数器的增加不被阻塞
+        try:
+            rows, seq, overlapped = self.load(metric, year)
+        except Exception:
+            with self._lock:
+                self._logs.remove(log)
+            raise
+        scores = sorted(((self.score(metric, book), book) for book in rows), key=lambda item: (-item[0], item[1]['id']))
+        with self._lock:
+            self._logs.remove(log)
+            for score, book in scores[:self.depth]:
+                self._books[book['id']] = book
+            board = self._boards[key] = Board({book['id']: score for score, book in scores[:self.depth]},
+                                              full=len(scores) >= self.depth)
+            # 快照之后的增加：其他榜单已经实时计入，这里补到新榜单和它的书籍上
+            for entry_seq, book_id, field, amount in log:
+                if entry_seq is None or entry_seq > seq:
+                    book = self._books.get(book_id)
+                    if book_id in board.scores:
+                        # 刚加载的书籍信息还不包括这次增加；其他书籍的信息已经实时计入
+                        book[field] += amount
+                    self.apply(board, metric, year, book, book_id, field, amount)
+            board.stale = board.stale or overlapped
+            while len(self._boards) > self.max_boards:
+                self._boards.popitem(last=False)
+            self.prune()
+            return self.rows(board, limit)
+
+    def load(self, metric, year):
+        # 返回(书籍行, 快照序号, 加载期间是否有刷新在写库)
+        pending, seq, started, done = self.counter.snapshot()
+        queryset = BookInfo.objects.all()
+        if year is not None:
+            queryset = queryset.filter(pub_date__year=year)
+        if metric == 'score':
+            expression = sum(F(field) * weight for field, weight in self.weights[metric].items())
+            queryset = queryset.annotate(leaderboard_score=expression).order_by('-leaderboard_score', '-id')
+        else:
+            # 走(is_delete, read_count)等索引，倒序扫描depth行即可
+            queryset = queryset.order_by('-' + metric, '-id')
+        rows = list(queryset.values(*self.book_fields)[:self.depth])
+        # 加上本进程尚未落库的增量；有增量的书籍数据库中的值可能排不进前depth名，按id再查一次作为候选
+        ids = set().union(*pending.values()) - {book['id'] for book in rows}
+        if ids:
+            rows.extend(queryset.filter(id__in=ids).values(*self.book_fields))
+        for book in rows:
+            for field, counts in pending.items():
+                book[field] += counts.get(book['id'], 0)
+        # 快照时有未完成的刷新(增量已移出缓冲区，可能还没提交)，或快照之后开始了刷新(增量可能既在快照中又已写入库)
+        overlapped = started != done or self.counter.flushes_started() != started
+        return rows, seq, overlapped
+
+    def score(self, metric, book):
+        return sum(book[field] * weight for field, weight in self.weights[metric].items())
+
+    def rows(self, board, limit):
+        return [dict(self._books[book_id], score=-score) for score, book_id in board.order[:limit]]
+
+    def prune(self):
+        # 只保留还在某个榜单上的书籍信息
+        ids = set()
+        for board in self._boards.values():
+            ids.update(board.scores)
+        for book_id in set(self._books) - ids:
+            del self._books[book_id]
+
+    def incr(self, book_id, field, amount, seq=None):
+        with self._lock:
+            for log in self._logs:
+                log.append((seq, book_id, field, amount))
+            book = self._books.get(book_id)
+            if book is not None:
+                book[field] += amount
+            for (metric, year), board in self._boards.items():
+                self.apply(board, metric, year, book, book_id, field, amount)
+
+    def apply(self, board, metric, year, book, book_id, field, amount):
+        weight = self.weights[metric].get(field)
+        if not weight:
+            return
+        # 已知出版年份且不属于该年份的书籍跳过；不知道年份的榜外书籍按可能属于处理
+        if year is not None and book is not None and (book['pub_date'] is None or book['pub_date'].year != year):
+            return
+        board.add(book_id, amount * weight)
+
+    def invalidate(self, only_partial=False):
+        # only_partial：只使不满的榜单过期(新增书籍只可能出现在这些榜单上)
+        with self._lock:
+            for board in self._boards.values():
+                if not only_partial or not board.full:
+                    board.stale = True
+
+    def clear(self):
+        with self._lock:
+            self._boards.clear()
+            self._books.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'boards': len(self._boards),
+                'books': len(self._books),
+                'stale': sum(1 for board in self._boards.values() if board.stale),
+            }
+
+
+leaderboard = Leaderboard(
+    depth=settings.LEADERBOARD['DEPTH'],
+    reconcile_interval=settings.LEADERBOARD['RECONCILE_INTERVAL'],
+    max_boards=settings.LEADERBOARD['MAX_BOARDS'],
+    score_weights=settings.LEADERBOARD['SCORE_WEIGHTS'],
+)
+
+
+@receiver(counter_changed, sender=BookInfo)
+def leaderboard_counter_changed(sender, pk=None, field=None, amount=0, seq=None, **kwargs):
+    leaderboard.incr(pk, field, amount, seq)
+
+
+@receiver(post_save, sender=BookInfo)
+def leaderboard_book_saved(sender, created=False, update_fields=None, **kwargs):
+    if created:
+        transaction.on_commit(lambda: leaderboard.invalidate(only_partial=True))
+    elif update_fields is None or set(update_fields) & BOOK_FIELDS:
+        transaction.on_commit(leaderboard.invalidate)
+
+
+@receiver(post_bulk_write, sender=BookInfo)
+def leaderboard_bulk_write(sender, fields=None, **kwargs):
+    # 计数器落库(只有read_count/comment_count)不需要处理：增量已经通过counter_changed计入
+    if fields is None or set(fields) & BOOK_FIELDS:
+        transaction.on_commit(leaderboard.invalidate)
@@ -0,0 +1,270 @@
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from rest_framework.test import APIRequestFactory
+
+from book.leaderboard import leaderboard
+from book.models import BookInfo, PersonInfo, User
+from book.serializer import BookInfoModelSerializer
+from book.viewsBasics import BookListView2
+
+from .seed_bench_data import Command as SeedCommand
+
+
+# BookListView2的BookInfoSerializer是演示用的(exclude了不存在的image字段、多一个必填的sms_code)，不能序列化；
+# 压测时换成BookInfoModelSerializer，排序后端、条件GET、响应缓存等保持不变
+class UnpagedBookListView(BookListView2):
+    serializer_class = BookInfoModelSerializer
+
+
+# 书籍接口压测：先用seed_bench_data生成数据，再在进程内通过WSGI应用(包括全部中间件)调用各接口
+#   list_paged    键集分页列表 /book/books/，BookListView2.ordering_fields的每个字段正序、倒序
+#   list_unpaged  不分页列表 BookListView2(没有路由，直接调用视图)，每个排序字段正序、倒序
+#   top           排行榜 /book/books/top/，每个排序指标
+#   retrieve、create、update(修改create创建的书籍)、login(token登录)、register
+# 结果为JSON，包括当前提交、环境、数据量；--compare与之前保存的结果比较p50延迟，超过--threshold的列为退步
+# create、register生成的数据在结束时删除，响应缓存在压测期间关闭(--with-cache保留)
+# python manage.py bench_api --requests 200 --output bench.json
+# python manage.py bench_api --compare bench.json --fail-on-regression
+class Command(BaseCommand):
+    help = 'Benchmark book API endpoints and emit machine-readable results'
+
+    host = 'localhost'
+    created_prefix = 'bn'
+    register_prefix = 'bench_reg_'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+        parser.add_argument('--unpaged-requests', type=int, default=5, help='不分页列表每个场景的请求数')
+        parser.add_argument('--auth-requests', type=int, default=20, help='登录、注册的请求数(密码哈希很慢)')
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--scenarios', nargs='+', help='只运行这些场景，如list_paged retrieve')
+        parser.add_argument('--with-cache', action='store_true', help='不关闭响应缓存')
+        parser.add_argument('--output', help='结果同时写入该文件')
+        parser.add_argument('--compare', help='与之前保存的结果比较')
+        parser.add_argument('--threshold', type=float, default=0.2, help='p50延迟增加超过该比例视为退步')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        book_ids = list(BookInfo.objects.values_list('id', flat=True))
+        if not book_ids or not User.objects.filter(username=SeedCommand.user_prefix + '0000000').exists():
+            raise CommandError('没有压测数据，先运行seed_bench_data')
+
+        self.app = get_wsgi_application()
+        self.rng = random.Random(options['seed'])
+        self.book_ids = book_ids
+        self.created = []
+        self.counter = iter(range(10 ** 7))
+        self.lock = threading.Lock()
+
+        enabled = settings.RESPONSE_CACHE['ENABLED']
+        settings.RESPONSE_CACHE['ENABLED'] = options['with_cache']
+        try:
+            results = []
+            for name, variant, func, requests in self.scenarios(options):
+                if options['scenarios'] and name not in options['scenarios']:
+                    continue
+                result = self.run(func, requests, options['concurrency'])
+                result = dict(scenario=name, variant=variant, **result)
+                self.stderr.write('%(scenario)s %(variant)s: %(requests_per_sec)s req/s, p50 %(p50_ms)s ms' % result)
+                results.append(result)
+        finally:
+            settings.RESPONSE_CACHE['ENABLED'] = enabled
+            BookInfo.all_objects.filter(name__startswith=self.created_prefix).delete()
+            User.all_objects.filter(username__startswith=self.register_prefix).delete()
+
+        report = {'meta': self.meta(options), 'results': results}
+        if options['compare']:
+            report['comparison'] = self.compare(options['compare'], results, options['threshold'])
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+        regressions = [c for c in report.get('comparison', ()) if c['regression']]
+        if regressions and options['fail_on_regression']:
+            raise CommandError('%d个场景退步: %s' % (
+                len(regressions), ', '.join('%(scenario)s %(variant)s' % c for c in regressions)))
+
+    def scenarios(self, options):
+        page_size = options['page_size']
+        unpaged_view = UnpagedBookListView.as_view()
+        factory = APIRequestFactory()
+        for field in BookListView2.ordering_fields:
+            for ordering in (field, '-' + field):
+                yield ('list_paged', ordering,
+                       lambda o=ordering: self.call('GET', '/book/books/', 'ordering=%s&page_size=%d' % (o, page_size)),
+                       options['requests'])
+        for field in BookListView2.ordering_fields:
+            for ordering in (field, '-' + field):
+                yield ('list_unpaged', ordering,
+                       lambda o=ordering: self.call_view(unpaged_view, factory.get('/', {'ordering': o})),
+                       options['unpaged_requests'])
+        for metric in leaderboard.metrics:
+            yield ('top', metric,
+                   lambda m=metric: self.call('GET', '/book/books/top/', 'by=%s&limit=%d' % (m, page_size)),
+                   options['requests'])
+        yield 'retrieve', '', self.retrieve, options['requests']
+        yield 'create', '', self.create, options['requests']
+        yield 'update', '', self.update, options['requests']
+        yield 'login', '', self.login, options['auth_requests']
+        yield 'register', '', self.register, options['auth_requests']
+
+    def run(self, func, requests, concurrency):
+        # 预热，不计入结果
+        for _ in range(min(5, requests)):
+            func()
+        statuses, latencies = [], []
+        remaining = iter(range(requests))
+
+        def worker():
+            while True:
+                with self.lock:
+                    if next(remaining, None) is None:
+                        break
+                start = time.perf_counter()
+                status = func()
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    statuses.append(status)
+                    latencies.append(elapsed)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        return {
+            'requests': len(statuses),
+            'ok': sum(1 for s in statuses if 200 <= s < 300),
+            'requests_per_sec': round(len(statuses) / elapsed, 1),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+            'p95_ms': round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 3),
+            'p99_ms': round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 3),
+        }
+
+    def retrieve(self):
+        with self.lock:
+            pk = self.rng.choice(self.book_ids)
+        return self.call('GET', '/book/books/%d/' % pk)
+
+    def create(self):
+        with self.lock:
+            name = '%s%07d' % (self.created_prefix, next(self.counter))
+        body = json.dumps({'name': name, 'pub_date': '2000-01-01'}).encode()
+        status, content = self.call('POST', '/book/books/', body=body, content_type='application/json', content=True)
+        if status == 201:
+            with self.lock:
+                self.created.append(json.loads(content))
+        return status
+
+    def update(self):
+        # 只修改压测中创建的书籍，不改动生成的数据
+        if not self.created:
+            self.create()
+        with self.lock:
+            book = self.rng.choice(self.created)
+            read_count = self.rng.randrange(100000)
+        body = json.dumps({'name': book['name'], 'pub_date': book['pub_date'], 'read_count': read_count}).encode()
+        return self.call('PUT', '/book/books/%d/' % book['id'], body=body, content_type='application/json')
+
+    def login(self):
+        body = json.dumps({'username': SeedCommand.user_prefix + '0000000', 'password': SeedCommand.password}).encode()
+        return self.call('POST', '/book/custom-drf-token-auth/', body=body, content_type='application/json')
+
+    def register(self):
+        with self.lock:
+            username = '%s%07d' % (self.register_prefix, next(self.counter))
+        body = ('username=%s&password=%s' % (username, SeedCommand.password)).encode()
+        return self.call('POST', '/book/register/', body=body, content_type='application/x-www-form-urlencoded')
+
+    def call(self, method, path, query='', body=b'', content_type='', content=False):
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        response = self.app(environ, lambda s, headers, exc_info=None: status.append(int(s.split()[0])))
+        data = b''.join(response)
+        response.close()
+        return (status[0], data) if content else status[0]
+
+    def call_view(self, view, request):
+        response = view(request)
+        response.render()
+        return response.status_code
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                                    text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'books': len(self.book_ids),
+            'persons': PersonInfo.objects.count(),
+            'users': User.objects.count(),
+            'concurrency': options['concurrency'],
+            'page_size': options['page_size'],
+            'response_cache': options['with_cache'],
+        }
+
+    def compare(self, path, results, threshold):
+        try:
+            with open(path) as f:
+                baseline = {(r['scenario'], r['variant']): r for r in json.load(f)['results']}
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError('无法读取比较的结果%s: %s' % (path, exc))
+        comparison = []
+        for result in results:
+            base = baseline.get((result['scenario'], result['variant']))
+            if base is None:
+                continue
+            change = (result['p50_ms'] - base['p50_ms']) / base['p50_ms'] if base['p50_ms'] else 0
+            comparison.append({
+                'scenario': result['scenario'],
+                'variant': result['variant'],
+                'baseline_p50_ms': base['p50_ms'],
+                'p50_ms': result['p50_ms'],
+                'change': round(change, 3),
+                'regression': change > threshold,
+            })
+        return comparison
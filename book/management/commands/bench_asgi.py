@@ -0,0 +1,157 @@
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+
+
+# ASGI/WSGI压测：在进程内直接调用WSGI、ASGI应用(不经过网络和服务器)，--connections个客户端各自循环发请求
+#   wsgi        同步DRF接口，WSGI应用 + --threads个工作线程(相当于gunicorn gthread)，超出的连接排队
+#   asgi_sync   同步DRF接口，ASGI应用：视图被放进同一个线程串行执行
+#   asgi_async  异步接口，ASGI应用：查询在--threads个线程的线程池中并行，其余在事件循环上
+# 延迟包括排队时间；响应缓存在压测期间关闭
+# 本地SQLite的查询是纯CPU开销，受GIL限制，三种方式差别不大；--db-latency给每条SQL加上等待时间，模拟MySQL的网络往返
+# python manage.py bench_asgi --connections 500 --requests 5000 --threads 32 --db-latency 5
+class Command(BaseCommand):
+    help = 'Load test sync (WSGI/ASGI) and async (ASGI) book read endpoints in-process'
+
+    host = 'localhost'
+    targets = {
+        'wsgi': '/book/books/',
+        'asgi_sync': '/book/books/',
+        'asgi_async': '/book/async/books/',
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=32, help='WSGI工作线程数，也是异步接口的查询线程池大小')
+        parser.add_argument('--query', default='ordering=-read_count&page_size=20')
+        parser.add_argument('--modes', nargs='+', choices=sorted(self.targets), default=list(self.targets))
+        parser.add_argument('--db-latency', type=float, default=0, help='每条SQL额外等待的毫秒数')
+
+    def handle(self, *args, **options):
+        enabled = settings.RESPONSE_CACHE['ENABLED']
+        settings.RESPONSE_CACHE['ENABLED'] = False
+        latency = options['db_latency'] / 1000
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            # 连接池复用连接对象时会再次触发
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        if latency:
+            connection_created.connect(add_delay)
+        try:
+            results = [asyncio.run(self.run(mode, options)) for mode in options['modes']]
+        finally:
+            settings.RESPONSE_CACHE['ENABLED'] = enabled
+            connection_created.disconnect(add_delay)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    async def run(self, mode, options):
+        path, query = self.targets[mode], options['query']
+        pool = ThreadPoolExecutor(max_workers=options['threads'])
+        loop = asyncio.get_running_loop()
+        if mode == 'wsgi':
+            app = get_wsgi_application()
+
+            async def request():
+                return await loop.run_in_executor(pool, self.call_wsgi, app, path, query)
+        else:
+            # 异步接口thread_sensitive=False的查询在事件循环的默认线程池中执行
+            loop.set_default_executor(pool)
+            app = get_asgi_application()
+
+            async def request():
+                return await self.call_asgi(app, path, query)
+
+        remaining = iter(range(options['requests']))
+        statuses, latencies = [], []
+
+        async def client():
+            while next(remaining, None) is not None:
+                start = time.perf_counter()
+                status = await request()
+                latencies.append(time.perf_counter() - start)
+                statuses.append(status)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['connections'])))
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+
+        latencies.sort()
+        return {
+            'mode': mode,
+            'path': path,
+            'connections': options['connections'],
+            'threads': options['threads'],
+            'db_latency_ms': options['db_latency'],
+            'requests': len(statuses),
+            'ok': statuses.count(200),
+            'seconds': round(elapsed, 3),
+            'requests_per_sec': round(len(statuses) / elapsed, 1),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        }
+
+    def call_wsgi(self, app, path, query):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host,
+            'wsgi.input': io.BytesIO(b''),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        body = app(environ, lambda s, headers, exc_info=None: status.append(int(s.split()[0])))
+        b''.join(body)
+        body.close()
+        return status[0]
+
+    async def call_asgi(self, app, path, query):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', self.host.encode())],
+            'client': ('127.0.0.1', 50000),
+            'server': (self.host, 80),
+        }
+        status = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await app(scope, receive, send)
+        return status[0]
@@ -0,0 +1,112 @@
+import importlib
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from book.db.pool import PooledDatabaseWrapperMixin
+from book.models import BookInfo
+
+
+# 连接池压测：--threads个线程模拟请求，每个请求 建立连接 -> 一次主键查询 -> 关闭连接(CONN_MAX_AGE=0时Django请求结束的行为)
+#   unpooled  Django原来的后端，每个请求都新建物理连接
+#   pooled    book.db.backends下带连接池的后端，请求结束连接归还连接池
+# 本地SQLite建立连接只需要打开文件，--connect-latency给每次新建连接加上等待时间，模拟MySQL的TCP握手和认证
+# python manage.py bench_db_pool --threads 16 --requests 20000 --connect-latency 5
+class Command(BaseCommand):
+    help = 'Compare per-request latency with and without the database connection pool'
+
+    backends = {
+        'django.db.backends.sqlite3': 'book.db.backends.sqlite3',
+        'django.db.backends.mysql': 'book.db.backends.mysql',
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 16])
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--connect-latency', type=float, default=0, help='每次新建连接额外等待的毫秒数')
+        parser.add_argument('--max-size', type=int, default=8)
+        parser.add_argument('--max-overflow', type=int, default=8)
+
+    def handle(self, *args, **options):
+        settings_dict = dict(connections[options['database']].settings_dict)
+        engine = settings_dict['ENGINE']
+        unpooled_engine = next((k for k, v in self.backends.items() if v == engine), engine)
+        pooled_engine = self.backends[unpooled_engine]
+        latency = options['connect_latency'] / 1000
+
+        unpooled = importlib.import_module(unpooled_engine + '.base').DatabaseWrapper
+        pooled = importlib.import_module(pooled_engine + '.base').DatabaseWrapper
+        if latency:
+            class SlowConnect(unpooled):
+                def get_new_connection(self, conn_params):
+                    time.sleep(latency)
+                    return super().get_new_connection(conn_params)
+            # 延迟加在连接池之下：只有真正新建连接时才等待
+            unpooled = SlowConnect
+            pooled = type('DatabaseWrapper', (PooledDatabaseWrapperMixin, SlowConnect), {
+                'ping_connection': pooled.ping_connection,
+            })
+
+        settings_dict['CONN_MAX_AGE'] = 0
+        settings_dict['POOL'] = {
+            'MAX_SIZE': options['max_size'],
+            'MAX_OVERFLOW': options['max_overflow'],
+            'TIMEOUT': 30,
+        }
+        results = []
+        for threads in options['threads']:
+            for mode, wrapper_class in (('unpooled', unpooled), ('pooled', pooled)):
+                # 每轮使用新的别名，连接池从空开始
+                alias = 'bench_%s_%d' % (mode, threads)
+                results.append(self.run(mode, wrapper_class, settings_dict, alias, threads, options['requests']))
+                results[-1]['connect_latency_ms'] = options['connect_latency']
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, mode, wrapper_class, settings_dict, alias, threads, requests):
+        sql = 'SELECT id, name FROM %s WHERE id = %%s' % BookInfo._meta.db_table
+        remaining = iter(range(requests))
+        latencies = []
+        wrappers = []
+
+        def worker():
+            wrapper = wrapper_class(settings_dict, alias)
+            wrappers.append(wrapper)
+            while True:
+                i = next(remaining, None)
+                if i is None:
+                    break
+                start = time.perf_counter()
+                wrapper.ensure_connection()
+                with wrapper.cursor() as cursor:
+                    cursor.execute(sql, [i % 1000 + 1])
+                    cursor.fetchall()
+                wrapper.close()
+                latencies.append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        result = {
+            'mode': mode,
+            'threads': threads,
+            'requests': len(latencies),
+            'requests_per_sec': round(len(latencies) / elapsed, 1),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        }
+        pool = getattr(wrappers[0], 'pool', None) if wrappers else None
+        if pool is not None:
+            result['pool'] = pool.stats()
+            pool.close_all()
+        return result
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rest_framework.test import APIRequestFactory
+
+from book.auth.hashing import hashing_pool
+from book.models import User
+from book.viewsAuth import CustomDRFObtainAuthToken
+
+
+# 登录压测：同一批并发请求分别在“请求线程内直接哈希”和“哈希线程池”两种方式下跑一遍
+# python manage.py bench_login --requests 200 --concurrency 32
+class Command(BaseCommand):
+    help = 'Benchmark token login throughput with and without the password hashing pool'
+
+    username = 'bench_login_user'
+    password = 'bench-password-123'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--workers', type=int, default=4, help='哈希线程池大小')
+        parser.add_argument('--queue', type=int, default=32, help='哈希线程池排队上限')
+
+    def handle(self, *args, **options):
+        User.objects.filter(username=self.username).delete()
+        User.objects.create_user(username=self.username, password=self.password)
+        original = (hashing_pool.max_workers, hashing_pool.max_queue, hashing_pool.timeout)
+        try:
+            hashing_pool.configure(0, 0)
+            results = [self.run('inline', options)]
+            hashing_pool.configure(options['workers'], options['queue'])
+            results.append(self.run('pool', options))
+        finally:
+            hashing_pool.configure(*original)
+            User.objects.filter(username=self.username).delete()
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, name, options):
+        view = CustomDRFObtainAuthToken.as_view()
+        factory = APIRequestFactory()
+        statuses = []
+        latencies = []
+        lock = threading.Lock()
+        remaining = iter(range(options['requests']))
+
+        def worker():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                request = factory.post('/book/custom-drf-token-auth/',
+                                       {'username': self.username, 'password': self.password}, format='json')
+                start = time.perf_counter()
+                response = view(request)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    statuses.append(response.status_code)
+                    latencies.append(elapsed)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        # requests_per_sec包括被拒绝(429)的请求，比较吞吐量看logins_per_sec(成功登录)
+        ok_latencies = sorted(latency for status, latency in zip(statuses, latencies) if status == 200)
+        latencies.sort()
+        return {
+            'mode': name,
+            'requests': len(statuses),
+            'concurrency': options['concurrency'],
+            'seconds': round(elapsed, 3),
+            'requests_per_sec': round(len(statuses) / elapsed, 1),
+            'logins_per_sec': round(len(ok_latencies) / elapsed, 1),
+            'ok': len(ok_latencies),
+            'rejected_429': statuses.count(429),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+            'ok_p50_ms': round(ok_latencies[len(ok_latencies) // 2] * 1000, 2) if ok_latencies else None,
+        }
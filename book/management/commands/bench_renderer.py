@@ -0,0 +1,75 @@
+import datetime
+import decimal
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from BookLib.utils.customDRFRenderer import JSON_BACKENDS, CustomRenderer
+from book.models import BookInfo
+from book.serializer import BookInfoModelSerializer
+
+
+# 原来的CustomRenderer：拼装响应格式后交给DRF的JSONRenderer(标准库json + DRF编码器)
+class LegacyCustomRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        data = dict(data)
+        msg = data.pop('msg', 'success')
+        code = data.pop('code', 200)
+        ret = {'msg': msg, 'code': code, 'data': {'list': data, 'total': len(data)}}
+        return super().render(ret, accepted_media_type, renderer_context)
+
+
+# 渲染器压测：同一份数据分别用原渲染器和各JSON后端渲染，比较每秒输出字节数
+# python manage.py bench_renderer --rows 10000 --repeat 20
+class Command(BaseCommand):
+    help = 'Compare CustomRenderer throughput (bytes/sec) across JSON backends and the legacy renderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        now = datetime.datetime.now(datetime.timezone.utc)
+        books = [
+            BookInfo(id=i, name='书籍%d' % i, pub_date=datetime.date(2000, 1, 1) + datetime.timedelta(days=i % 5000),
+                     read_count=i * 3, comment_count=i, updated_at=now)
+            for i in range(rows)
+        ]
+        payloads = {
+            # 序列化器输出：日期已是字符串
+            'serialized': {'msg': 'success', 'code': 200, 'results': BookInfoModelSerializer(books, many=True).data},
+            # values()等原始数据：date/datetime/Decimal/UUID交给渲染器处理
+            'raw': {'msg': 'success', 'code': 200, 'results': [
+                {'id': i, 'name': '书籍%d' % i, 'pub_date': datetime.date(2000, 1, 1), 'updated_at': now,
+                 'price': decimal.Decimal('12.50'), 'uuid': uuid.UUID(int=i)}
+                for i in range(rows)
+            ]},
+        }
+        context = {'view': None, 'request': None, 'response': None}
+
+        renderers = {'legacy': LegacyCustomRenderer()}
+        for backend in JSON_BACKENDS:
+            renderer = CustomRenderer()
+            renderer.json_backend = backend
+            renderers[backend] = renderer
+
+        results = []
+        for payload_name, payload in payloads.items():
+            for name, renderer in renderers.items():
+                size = len(renderer.render(payload, 'application/json', context))
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    renderer.render(payload, 'application/json', context)
+                elapsed = time.perf_counter() - start
+                results.append({
+                    'payload': payload_name,
+                    'renderer': name,
+                    'bytes': size,
+                    'ms_per_render': round(elapsed / options['repeat'] * 1000, 2),
+                    'mb_per_sec': round(size * options['repeat'] / elapsed / 1e6, 1),
+                })
+        self.stdout.write(json.dumps(results, indent=2))
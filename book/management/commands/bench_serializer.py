@@ -0,0 +1,50 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from book.compiled_serializer import compile_serializer
+from book.models import BookInfo, PersonInfo
+from book.serializer import BookInfoModelSerializer, PersonInfoModelSerializer
+
+
+# 序列化压测：同样的数据分别用DRF序列化器(查询模型对象)和编译的函数(values()查询)序列化
+# 分别统计“查询 + 序列化”和“只序列化”的耗时
+# python manage.py bench_serializer --sizes 20 1000 10000 --repeat 5
+class Command(BaseCommand):
+    help = 'Compare DRF ModelSerializer and compiled serializer throughput on book/person list pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        results = []
+        for model, serializer_class in ((BookInfo, BookInfoModelSerializer), (PersonInfo, PersonInfoModelSerializer)):
+            compiled = compile_serializer(serializer_class)
+            for size in options['sizes']:
+                queryset = model.objects.order_by('id')[:size]
+                values = queryset.values(*compiled.columns)
+                instances = list(queryset)
+                rows = list(values)
+                # 输出一致才有比较的意义
+                assert json.dumps(compiled.many(rows), default=str) == \
+                    json.dumps(serializer_class(instances, many=True).data, default=str)
+
+                timings = {
+                    # .all()复制查询集，每次都重新查询
+                    'drf_total': lambda: serializer_class(list(queryset.all()), many=True).data,
+                    'compiled_total': lambda: compiled.many(values.all()),
+                    'drf_serialize': lambda: serializer_class(instances, many=True).data,
+                    'compiled_serialize': lambda: compiled.many(rows),
+                }
+                result = {'model': model.__name__, 'rows': len(rows)}
+                for name, func in timings.items():
+                    start = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        func()
+                    result[name + '_ms'] = round((time.perf_counter() - start) / options['repeat'] * 1000, 2)
+                result['speedup_total'] = round(result['drf_total_ms'] / result['compiled_total_ms'], 1)
+                result['speedup_serialize'] = round(result['drf_serialize_ms'] / result['compiled_serialize_ms'], 1)
+                results.append(result)
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,102 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from rest_framework.throttling import SimpleRateThrottle
+
+from book.throttling import ThrottleStore, TokenBucketRateThrottle
+
+
+# 限流压测
+#   开销：每次检查的耗时(包括实例化限流类，与DRF每个请求一样)，drf为自带的限流(默认缓存中的请求时间列表)，bucket为令牌桶
+#         --rate限额很大时一直放行，DRF的列表越来越长，每次检查越来越慢；令牌桶与限额无关
+#   准确性：--processes个进程同时请求同一个key，统计总共放行的次数；locmem缓存每个进程各自计数，放行次数是限额的进程数倍
+# python manage.py bench_throttle --requests 20000 --rate 100000/day --keys 1 100 --processes 4
+class Command(BaseCommand):
+    help = 'Measure throttle overhead and cross-process accuracy for the DRF cache throttle and the token bucket store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--rate', default='100000/day', help='测开销时的限额，足够大使请求都被放行')
+        parser.add_argument('--keys', type=int, nargs='+', default=[1, 100], help='请求平均分布到的key数')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--limit-rate', default='100/hour', help='测准确性时的限额')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ThrottleStore(os.path.join(tmp, 'throttle.sqlite3'))
+            results = []
+            for keys in options['keys']:
+                for mode in ('drf', 'bucket'):
+                    results.append(self.overhead(mode, store, options['rate'], keys, options['requests']))
+            for mode in ('drf', 'bucket'):
+                results.append(self.accuracy(mode, store, options['limit_rate'], options['processes']))
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def throttle_class(self, mode, store, rate):
+        # 用请求对象本身作为key
+        attrs = {'rate': rate, 'get_cache_key': lambda self, request, view: request}
+        if mode == 'drf':
+            return type('DRFThrottle', (SimpleRateThrottle,), attrs)
+        return type('BucketThrottle', (TokenBucketRateThrottle,), dict(attrs, store=store))
+
+    def overhead(self, mode, store, rate, keys, requests):
+        cache.clear()
+        store.reset()
+        throttle_class = self.throttle_class(mode, store, rate)
+        key_names = ['bench_throttle_%d' % i for i in range(keys)]
+        latencies = []
+        allowed = 0
+        start = time.perf_counter()
+        for i in range(requests):
+            t = time.perf_counter()
+            allowed += throttle_class().allow_request(key_names[i % keys], None)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+        # 最后1000次的耗时：DRF的请求时间列表此时最长
+        tail = sorted(latencies[-1000:])
+        latencies.sort()
+        return {
+            'test': 'overhead',
+            'mode': mode,
+            'rate': rate,
+            'keys': keys,
+            'requests': requests,
+            'allowed': allowed,
+            'checks_per_sec': round(requests / elapsed, 1),
+            'p50_us': round(latencies[len(latencies) // 2] * 1e6, 1),
+            'p99_us': round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+            'last_1000_p50_us': round(tail[len(tail) // 2] * 1e6, 1),
+        }
+
+    def accuracy(self, mode, store, rate, processes):
+        cache.clear()
+        store.reset()
+        limit = SimpleRateThrottle.parse_rate(None, rate)[0]
+        throttle_class = self.throttle_class(mode, store, rate)
+        # fork：子进程继承同样的配置(参数不需要序列化)；locmem缓存在每个子进程中各自一份，与多worker部署相同
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [context.Process(target=_attempt, args=(throttle_class, limit * 2, queue)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        allowed = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        return {
+            'test': 'accuracy',
+            'mode': mode,
+            'rate': rate,
+            'processes': processes,
+            'attempts': limit * 2 * processes,
+            'allowed': sum(allowed),
+            'expected': limit,
+        }
+
+
+def _attempt(throttle_class, attempts, queue):
+    queue.put(sum(throttle_class().allow_request('bench_throttle_shared', None) for _ in range(attempts)))
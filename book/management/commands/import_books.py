@@ -0,0 +1,44 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from book.importer import READERS, BookImporter, ImportFileError, decode_lines
+
+
+# 从文件或标准输入流式导入书籍和人物
+# python manage.py import_books books.ndjson --batch-size 2000
+# cat books.csv | python manage.py import_books - --format csv
+class Command(BaseCommand):
+    help = 'Stream books and characters from an NDJSON or CSV file (or stdin) into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='文件路径，- 表示标准输入')
+        parser.add_argument('--format', choices=sorted(READERS), help='默认根据文件扩展名判断，标准输入默认ndjson')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--encoding', default='utf-8')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        # 以二进制读取、逐行解码，编码错误可以定位到行
+        if path == '-':
+            stream = sys.stdin.buffer
+        else:
+            try:
+                stream = open(path, 'rb')
+            except OSError as exc:
+                raise CommandError(exc)
+
+        importer = BookImporter(batch_size=options['batch_size'])
+        try:
+            report = importer.run(READERS[file_format](decode_lines(stream, options['encoding'])))
+        except ImportFileError as exc:
+            raise CommandError('%s (rows before it were imported: %s)' % (exc, json.dumps(importer.report())))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        for rejected in importer.rejected:
+            self.stderr.write('line %(line)s rejected: %(errors)s' % rejected)
+        self.stdout.write(json.dumps(report, indent=2))
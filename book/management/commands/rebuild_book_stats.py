@@ -0,0 +1,33 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from book.models import BookInfo, BookStats
+from book.stats import refresh_book_stats
+
+
+# 全量重建书籍统计：按主键分批读取书籍(包括已逻辑删除的，删除它们残留的统计行)，每批一次GROUP BY重新统计
+# 部署book_stats表之后、或绕过接口直接修改了人物数据之后运行
+# python manage.py rebuild_book_stats --batch-size 2000
+class Command(BaseCommand):
+    help = 'Rebuild per-book character counts (book_stats) from personinfo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        books = rows = 0
+        last_id = 0
+        while True:
+            ids = list(BookInfo.all_objects.filter(id__gt=last_id).order_by('id')
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            rows += refresh_book_stats(ids, chunk_size=options['batch_size'])
+            books += len(ids)
+            last_id = ids[-1]
+        seconds = time.perf_counter() - started
+        self.stdout.write(json.dumps({'books': books, 'stats': rows, 'total': BookStats.objects.count(),
+                                      'seconds': round(seconds, 3)}, indent=2))
@@ -0,0 +1,33 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from book.models import BookInfo, BookSearchToken
+from book.search import index_books
+
+
+# 全量重建搜索索引：按主键分批读取书籍，每批一次重建
+# python manage.py rebuild_search_index --batch-size 2000
+class Command(BaseCommand):
+    help = 'Rebuild the book search index from book names and character names/descriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # 先清空，之后每批只插入，不再逐批删除
+        BookSearchToken.objects.all().delete()
+        books = tokens = 0
+        last_id = 0
+        while True:
+            ids = list(BookInfo.objects.filter(id__gt=last_id).order_by('id')
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            tokens += index_books(ids, delete=False)
+            books += len(ids)
+            last_id = ids[-1]
+        seconds = time.perf_counter() - started
+        self.stdout.write(json.dumps({'books': books, 'tokens': tokens, 'seconds': round(seconds, 3)}, indent=2))
@@ -0,0 +1,107 @@
+import datetime
+import random
+import sys
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from book.models import BookInfo, BookSearchToken, BookStats, PersonInfo, User
+
+
+# 压测数据：按固定随机种子生成书籍、人物、用户，相同参数生成的数据完全相同，不同提交之间的压测结果才能比较
+# 只在SQLite上运行(本地压测库)，--clear清空书籍、人物、书籍统计、搜索索引表和压测用户
+# 所有压测用户的密码都是password，只哈希一次
+# python manage.py seed_bench_data --books 100000 --persons-per-book 2 --users 10000 --clear
+class Command(BaseCommand):
+    help = 'Seed bookinfo/personinfo/tb_user with reproducible benchmark data (SQLite only)'
+
+    password = 'bench-password-123'
+    user_prefix = 'bench_user_'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10000, help='书籍数量，1万到100万')
+        parser.add_argument('--persons-per-book', type=int, default=2)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='先清空已有数据')
+        parser.add_argument('--search-index', action='store_true', help='生成后重建搜索索引')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('seed_bench_data只用于本地SQLite压测库，当前数据库为%s' % connection.vendor)
+        if options['clear']:
+            self.clear()
+        elif BookInfo.all_objects.exists() or User.all_objects.filter(username__startswith=self.user_prefix).exists():
+            raise CommandError('数据库中已有数据，使用--clear清空后再生成')
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        self.insert(BookInfo, self.books(rng, options['books']), batch_size)
+        book_ids = list(BookInfo.all_objects.order_by('id').values_list('id', flat=True))
+        self.insert(PersonInfo, self.persons(rng, book_ids, options['persons_per_book']), batch_size)
+        self.insert(User, self.users(options['users']), batch_size)
+        # bulk_create不发送信号，书籍统计一次重建
+        call_command('rebuild_book_stats', batch_size=batch_size, stdout=self.stderr)
+        if options['search_index']:
+            call_command('rebuild_search_index', stdout=self.stderr)
+
+        self.stdout.write('seeded %d books, %d persons, %d users in %.1fs' % (
+            BookInfo.all_objects.count(), PersonInfo.all_objects.count(),
+            User.all_objects.filter(username__startswith=self.user_prefix).count(), time.perf_counter() - start))
+
+    def clear(self):
+        # 直接DELETE，不经过ORM逐行收集级联对象(百万行时很慢)
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in (BookSearchToken, BookStats, PersonInfo, BookInfo):
+                cursor.execute('DELETE FROM %s' % connection.ops.quote_name(model._meta.db_table))
+        User.all_objects.filter(username__startswith=self.user_prefix).delete()
+
+    def insert(self, model, objs, batch_size):
+        batch = []
+        count = 0
+        for obj in objs:
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                count += self.flush(model, batch)
+                sys.stderr.write('\r%s: %d' % (model._meta.db_table, count))
+        count += self.flush(model, batch)
+        sys.stderr.write('\r%s: %d\n' % (model._meta.db_table, count))
+
+    def flush(self, model, batch):
+        with transaction.atomic():
+            model.all_objects.bulk_create(batch)
+        count = len(batch)
+        batch.clear()
+        return count
+
+    def books(self, rng, count):
+        start = datetime.date(1950, 1, 1)
+        for i in range(count):
+            yield BookInfo(
+                name='bk%07d' % i,
+                pub_date=start + datetime.timedelta(days=rng.randrange(27000)),
+                read_count=rng.randrange(100000),
+                comment_count=rng.randrange(5000),
+            )
+
+    def persons(self, rng, book_ids, per_book):
+        i = 0
+        for book_id in book_ids:
+            for _ in range(per_book):
+                yield PersonInfo(
+                    name='ps%08d' % i,
+                    gender=rng.randrange(2),
+                    book_id_id=book_id,
+                    description='人物描述%d' % rng.randrange(1000),
+                )
+                i += 1
+
+    def users(self, count):
+        encoded = make_password(self.password)
+        for i in range(count):
+            yield User(username='%s%07d' % (self.user_prefix, i), password=encoded)
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:07
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='tb_user_email_lower_idx'),
+        ),
+    ]
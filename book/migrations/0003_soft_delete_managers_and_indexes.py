@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:13
+
+import book.models
+import django.contrib.auth.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0002_user_email_lower_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', book.models.SoftDeleteUserManager()),
+                ('all_objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bookinfo',
+            index=models.Index(fields=['is_delete', 'id'], name='bookinfo_live_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinfo',
+            index=models.Index(fields=['is_delete', 'pub_date'], name='bookinfo_live_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinfo',
+            index=models.Index(fields=['is_delete', 'read_count'], name='bookinfo_live_read_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personinfo',
+            index=models.Index(fields=['book_id', 'is_delete'], name='personinfo_book_live_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0003_soft_delete_managers_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=20, verbose_name='词项')),
+                ('weight', models.IntegerField(verbose_name='权重')),
+                ('book_id', models.ForeignKey(db_column='book_id', on_delete=django.db.models.deletion.CASCADE, to='book.bookinfo', verbose_name='书籍id')),
+            ],
+            options={
+                'verbose_name': '搜索词项',
+                'db_table': 'book_search_token',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='booksearchtoken',
+            index=models.Index(fields=['token', 'book_id', 'weight'], name='search_token_book_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0004_book_search_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookinfo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+        migrations.AddField(
+            model_name='personinfo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinfo',
+            index=models.Index(fields=['updated_at'], name='bookinfo_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personinfo',
+            index=models.Index(fields=['updated_at'], name='personinfo_updated_idx'),
+        ),
+    ]
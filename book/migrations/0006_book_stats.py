@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookStats',
+            fields=[
+                ('book_id', models.OneToOneField(db_column='book_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='book.bookinfo', verbose_name='书籍id')),
+                ('character_count', models.IntegerField(default=0, verbose_name='人物数')),
+                ('male_count', models.IntegerField(default=0, verbose_name='男性人物数')),
+                ('female_count', models.IntegerField(default=0, verbose_name='女性人物数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '书籍统计',
+                'db_table': 'book_stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bookstats',
+            index=models.Index(fields=['character_count', 'book_id'], name='book_stats_characters_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookstats',
+            index=models.Index(fields=['male_count', 'book_id'], name='book_stats_male_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookstats',
+            index=models.Index(fields=['female_count', 'book_id'], name='book_stats_female_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookstats',
+            index=models.Index(fields=['updated_at'], name='book_stats_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0006_book_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookDocument',
+            fields=[
+                ('book_id', models.OneToOneField(db_column='book_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='book.bookinfo', verbose_name='书籍id')),
+                ('body', models.BinaryField(verbose_name='JSON文档')),
+                ('etag', models.CharField(max_length=32, verbose_name='文档摘要')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '书籍详情文档',
+                'db_table': 'book_document',
+            },
+        ),
+    ]
@@ -1,16 +1,44 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db.models import Value
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
 
+# 逻辑删除：默认管理器只返回未删除的数据，配合(is_delete, ...)复合索引，查询未删除数据时走索引
+# 需要包含已删除数据时(如唯一性校验、导入)使用all_objects
+# update()/bulk_update()不会自动更新auto_now字段，需要显式写入updated_at
+class SoftDeleteQuerySet(models.QuerySet):
+    def soft_delete(self):
+        return self.update(is_delete=True, updated_at=timezone.now())
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    def get_queryset(self):
+        # 不能写成is_delete=False：Django会生成 WHERE NOT is_delete，数据库无法使用索引
+        # 用Value包装后生成 WHERE is_delete = false，可以走(is_delete, ...)复合索引
+        return super().get_queryset().filter(is_delete=Value(False))
+
+
+class SoftDeleteUserManager(UserManager):
+    def get_queryset(self):
+        # User的is_delete可为空，空值视为未删除
+        return super().get_queryset().exclude(is_delete=True)
+
+
 class BookInfo(models.Model):
     name = models.CharField(max_length=10, unique=True, verbose_name='书籍名')
     pub_date = models.DateField(null=True, verbose_name='发表日期')
     read_count = models.IntegerField(default=0, verbose_name='阅读量')
     comment_count = models.IntegerField(default=0, verbose_name='评论量')
     is_delete = models.BooleanField(default=False, verbose_name='逻辑删除')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')      # 条件GET(ETag/Last-Modified)、乐观锁
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.name
@@ -18,6 +46,14 @@ class BookInfo(models.Model):
     class Meta:
         db_table = 'bookinfo'        # 修改表名
         verbose_name = '书籍信息'
+        indexes = [
+            # 未删除数据按id、发表日期、阅读量排序/分页
+            models.Index(fields=['is_delete', 'id'], name='bookinfo_live_id_idx'),
+            models.Index(fields=['is_delete', 'pub_date'], name='bookinfo_live_pub_date_idx'),
+            models.Index(fields=['is_delete', 'read_count'], name='bookinfo_live_read_count_idx'),
+            # 条件GET：MAX(updated_at)，包括已逻辑删除的数据
+            models.Index(fields=['updated_at'], name='bookinfo_updated_idx'),
+        ]
 
 
 class PersonInfo(models.Model):
@@ -30,20 +66,97 @@ class PersonInfo(models.Model):
     book_id = models.ForeignKey(BookInfo, on_delete=models.CASCADE, verbose_name='书籍id', db_column='book_id')
     description = models.CharField(max_length=200, null=True, verbose_name='描述')
     is_delete = models.BooleanField(default=False, verbose_name='逻辑删除')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
 
     class Meta:
         db_table = 'personinfo'
         verbose_name = '人物信息'
+        indexes = [
+            # 查询某本书未删除的人物
+            models.Index(fields=['book_id', 'is_delete'], name='personinfo_book_live_idx'),
+            models.Index(fields=['updated_at'], name='personinfo_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+# 全文搜索倒排索引：书名、人物名和人物描述分词后的词项 -> 书籍
+# 以书籍为单位由book.search增量维护：书籍或其人物变化时重建该书的全部词项
+class BookSearchToken(models.Model):
+    token = models.CharField(max_length=20, verbose_name='词项')
+    book_id = models.ForeignKey(BookInfo, on_delete=models.CASCADE, verbose_name='书籍id', db_column='book_id')
+    weight = models.IntegerField(verbose_name='权重')
+
+    class Meta:
+        db_table = 'book_search_token'
+        verbose_name = '搜索词项'
+        indexes = [
+            # 按词项查找书籍并累加权重，索引覆盖查询不回表
+            models.Index(fields=['token', 'book_id', 'weight'], name='search_token_book_idx'),
+        ]
+
+
+# 书籍统计：每本书未删除人物的数量(总数、按性别)，由book.stats增量维护，rebuild_book_stats全量重建
+# 只保存未删除书籍的统计，按人物数排序、筛选时直接查本表，不需要连接personinfo再GROUP BY
+class BookStats(models.Model):
+    book_id = models.OneToOneField(BookInfo, on_delete=models.CASCADE, primary_key=True, related_name='stats',
+                                   verbose_name='书籍id', db_column='book_id')
+    character_count = models.IntegerField(default=0, verbose_name='人物数')
+    male_count = models.IntegerField(default=0, verbose_name='男性人物数')
+    female_count = models.IntegerField(default=0, verbose_name='女性人物数')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'book_stats'
+        verbose_name = '书籍统计'
+        indexes = [
+            # 按人物数排序/筛选，book_id作为键集分页的第二排序键
+            models.Index(fields=['character_count', 'book_id'], name='book_stats_characters_idx'),
+            models.Index(fields=['male_count', 'book_id'], name='book_stats_male_idx'),
+            models.Index(fields=['female_count', 'book_id'], name='book_stats_female_idx'),
+            # 条件GET：MAX(updated_at)
+            models.Index(fields=['updated_at'], name='book_stats_updated_idx'),
+        ]
+
+
+# 书籍详情文档(物化的读模型)：书籍字段 + 人物列表，预先渲染好的JSON
+# 由book.documents在书籍、人物变化后增量重建，详情文档接口直接返回body，不经过ORM和序列化器
+class BookDocument(models.Model):
+    book_id = models.OneToOneField(BookInfo, on_delete=models.CASCADE, primary_key=True, related_name='document',
+                                   verbose_name='书籍id', db_column='book_id')
+    body = models.BinaryField(verbose_name='JSON文档')
+    etag = models.CharField(max_length=32, verbose_name='文档摘要')         # body的MD5，条件GET使用
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'book_document'
+        verbose_name = '书籍详情文档'
+
+
 class User(AbstractUser):
     is_delete = models.BooleanField(null=True, blank=True, verbose_name='是否删除')
 
+    objects = SoftDeleteUserManager()
+    all_objects = UserManager()
+
     class Meta:
         db_table = 'tb_user'
+        indexes = [
+            # 邮箱登录按LOWER(email)查询，函数索引避免全表扫描
+            models.Index(Lower('email'), name='tb_user_email_lower_idx'),
+        ]
+
+
+# 人物修改前所属的书籍：人物换了书籍时，搜索索引、书籍统计、详情文档都要同时处理原书籍
+# 各处共用这一次查询，保存后通过instance._old_book_id读取
+@receiver(pre_save, sender=PersonInfo)
+def remember_person_book(sender, instance=None, update_fields=None, **kwargs):
+    if instance.pk and (update_fields is None or 'book_id' in update_fields):
+        instance._old_book_id = PersonInfo.all_objects.filter(pk=instance.pk).values_list('book_id', flat=True).first()
 
 
 # TODO If you want every user to have an automatically generated Token, you can simply catch the User's post_save signal.
@@ -0,0 +1,194 @@
+import functools
+import hashlib
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+from book.models import BookInfo, BookStats, PersonInfo
+from book.signals import post_bulk_write
+
+
+# 响应缓存：缓存视图返回的序列化数据(response.data)，命中时跳过查询和序列化，只做渲染
+# 缓存键 = 视图 + 版本号 + 请求(host、path、排序后的查询参数、认证范围)
+# 版本号：每个模型一个“代”(任何写入都换新)，每行数据一个“行版本”(该行写入时换新)
+#   列表：键中带上依赖模型的代，任一写入后旧键不再命中
+#   详情：键中带上主模型该行的行版本和其他依赖模型的代，只有该行写入才失效
+# 旧键不删除，等过期淘汰；版本号用随机值而不是自增，避免并发写入时incr的竞争
+class ResponseCache:
+    key_prefix = 'respcache:'
+
+    def __init__(self, cache_alias='default', timeout=300, lock_timeout=10, poll_interval=0.02):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout            # 单飞锁的最长持有时间(秒)，也是等待者的最长等待时间
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'coalesced': 0, 'bypassed': 0})
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def configure(self, cache_alias=None, timeout=None, lock_timeout=None):
+        if cache_alias is not None:
+            self.cache_alias = cache_alias
+        if timeout is not None:
+            self.timeout = timeout
+        if lock_timeout is not None:
+            self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def generation_key(model):
+        return 'gen:%s' % model._meta.label_lower
+
+    @staticmethod
+    def object_key(model, pk):
+        return 'obj:%s:%s' % (model._meta.label_lower, pk)
+
+    def versions(self, keys):
+        # 一次get_many取回全部版本号，缺失的补一个新值
+        keys = [self.key_prefix + key for key in keys]
+        found = self.cache.get_many(keys)
+        missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+        for key, value in missing.items():
+            # add：并发补值时以先写入的为准
+            if not self.cache.add(key, value, None):
+                missing[key] = self.cache.get(key, value)
+        found.update(missing)
+        return [found[key] for key in keys]
+
+    def invalidate(self, model, pks=()):
+        values = {self.key_prefix + self.generation_key(model): uuid.uuid4().hex}
+        for pk in pks:
+            values[self.key_prefix + self.object_key(model, pk)] = uuid.uuid4().hex
+        self.cache.set_many(values, None)
+
+    def invalidate_on_commit(self, model, pks=()):
+        # 立即失效一次，事务提交后再失效一次：事务未提交期间重新计算并缓存的旧数据，提交后也不会再命中
+        pks = [pk for pk in pks if pk is not None]
+        self.invalidate(model, pks)
+        transaction.on_commit(lambda: self.invalidate(model, pks))
+
+    def build_key(self, view, request, kwargs):
+        models = list(getattr(view, 'cache_models', ()))
+        pk = kwargs.get('pk')
+        if pk is not None and models:
+            # 详情：主模型只看该行的行版本
+            version_keys = [self.object_key(models[0], pk)] + [self.generation_key(m) for m in models[1:]]
+        else:
+            version_keys = [self.generation_key(m) for m in models]
+
+        if getattr(view, 'cache_per_user', False) and request.user.is_authenticated:
+            scope = 'user:%s' % request.user.pk
+        else:
+            scope = 'auth' if request.user.is_authenticated else 'anon'
+        query = sorted(request.query_params.lists())
+        raw = repr((request.get_host(), request.path, query, scope, self.versions(version_keys)))
+        name = '%s.%s' % (type(view).__name__, getattr(view, 'action', None) or request.method.lower())
+        return name, '%sresp:%s:%s' % (self.key_prefix, name, hashlib.md5(raw.encode()).hexdigest())
+
+    def get_or_compute(self, name, key, compute):
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.record(name, 'hits')
+            return Response(cached, headers={'X-Cache': 'HIT'})
+
+        # 单飞：同一个键只有拿到锁的请求重新计算，其余请求等待结果，避免缓存失效瞬间大量请求同时打到数据库
+        lock_key = key + ':lock'
+        if self.cache.add(lock_key, 1, self.lock_timeout):
+            try:
+                response = compute()
+                if response.status_code == status.HTTP_200_OK and not response.streaming:
+                    self.cache.set(key, response.data, self.timeout)
+            finally:
+                self.cache.delete(lock_key)
+            self.record(name, 'misses')
+            response['X-Cache'] = 'MISS'
+            return response
+
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.record(name, 'coalesced')
+                return Response(cached, headers={'X-Cache': 'HIT'})
+            if not self.cache.get(lock_key):
+                break
+        # 计算者失败或超时：自己计算，不写缓存
+        self.record(name, 'bypassed')
+        return compute()
+
+    def record(self, name, field):
+        with self._lock:
+            self._stats[name][field] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {name: dict(values) for name, values in self._stats.items()}
+        for values in stats.values():
+            total = values['hits'] + values['coalesced'] + values['misses'] + values['bypassed']
+            values['hit_ratio'] = (values['hits'] + values['coalesced']) / total if total else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+
+response_cache = ResponseCache(
+    cache_alias=settings.RESPONSE_CACHE['CACHE_ALIAS'],
+    timeout=settings.RESPONSE_CACHE['TIMEOUT'],
+    lock_timeout=settings.RESPONSE_CACHE['LOCK_TIMEOUT'],
+)
+
+
+# 视图方法装饰器：只缓存GET；视图通过cache_models声明依赖的模型，第一个为主模型
+# 在DRF的认证、权限、限流检查之后执行，缓存命中不会绕过这些检查
+def cache_response(method):
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        if request.method != 'GET' or not settings.RESPONSE_CACHE['ENABLED']:
+            return method(view, request, *args, **kwargs)
+        name, key = response_cache.build_key(view, request, kwargs)
+        return response_cache.get_or_compute(name, key, lambda: method(view, request, *args, **kwargs))
+    return wrapper
+
+
+# 视图集/通用视图使用：缓存list和retrieve
+class CachedResponseMixin:
+    cache_models = (BookInfo,)
+    cache_per_user = False          # 响应内容与用户有关时设为True，按用户分别缓存
+
+    @cache_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+# 失效：书籍、人物的保存、删除、批量写入，书籍统计的更新
+@receiver(post_save, sender=BookInfo)
+@receiver(post_delete, sender=BookInfo)
+@receiver(post_save, sender=PersonInfo)
+@receiver(post_delete, sender=PersonInfo)
+def invalidate_instance(sender, instance=None, **kwargs):
+    response_cache.invalidate_on_commit(sender, [instance.pk])
+
+
+@receiver(post_bulk_write, sender=BookInfo)
+@receiver(post_bulk_write, sender=PersonInfo)
+@receiver(post_bulk_write, sender=BookStats)
+def invalidate_bulk(sender, pks=None, **kwargs):
+    response_cache.invalidate_on_commit(sender, pks or [])
@@ -0,0 +1,160 @@
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, When
+from django.db.models.functions import Substr
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from book.models import BookInfo, BookSearchToken, PersonInfo
+from book.signals import post_bulk_write
+
+
+# 分词：中文没有空格，按相邻两字切分(二元切分)，每段最后一个字再单独作为一个词项，
+# 这样任意单字都是某个词项的前缀，单字搜索可以走前缀匹配；字母数字按单词切分并转小写
+CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+WORD_RE = re.compile(r'[%s]+|[0-9a-z]+' % CJK_CHARS)
+CJK_RE = re.compile(r'[%s]' % CJK_CHARS)
+
+MAX_TOKEN_LENGTH = 20
+NAME_WEIGHT = 4               # 书名命中的权重
+PERSON_NAME_WEIGHT = 2        # 人物名命中的权重
+DESCRIPTION_WEIGHT = 1        # 人物描述命中的权重
+
+BOOK_FIELDS = {'name', 'is_delete'}
+PERSON_FIELDS = {'name', 'description', 'is_delete', 'book_id', 'book_id_id'}
+
+
+def tokenize(text):
+    tokens = []
+    for word in WORD_RE.findall((text or '').lower()):
+        if CJK_RE.match(word):
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+            tokens.append(word[-1])
+        else:
+            tokens.append(word[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+# 查询分词：返回[(词项, 是否前缀匹配)]，单个汉字用前缀匹配
+def tokenize_query(text):
+    terms = set()
+    for word in WORD_RE.findall((text or '').lower()):
+        if CJK_RE.match(word):
+            if len(word) == 1:
+                terms.add((word, True))
+            else:
+                terms.update((word[i:i + 2], False) for i in range(len(word) - 1))
+        else:
+            terms.add((word[:MAX_TOKEN_LENGTH], False))
+    return sorted(terms)
+
+
+# 重建指定书籍的全部词项(书名 + 未删除人物的名字和描述)，已删除的书籍不再有词项
+def index_books(book_ids, delete=True):
+    book_ids = list(set(book_ids))
+    if not book_ids:
+        return 0
+    weights = defaultdict(Counter)        # {书籍id: {词项: 权重}}
+    for book_id, name in BookInfo.objects.filter(id__in=book_ids).values_list('id', 'name'):
+        for token in tokenize(name):
+            weights[book_id][token] += NAME_WEIGHT
+    persons = PersonInfo.objects.filter(book_id__in=list(weights)).values_list('book_id', 'name', 'description')
+    for book_id, name, description in persons:
+        for token in tokenize(name):
+            weights[book_id][token] += PERSON_NAME_WEIGHT
+        for token in tokenize(description):
+            weights[book_id][token] += DESCRIPTION_WEIGHT
+
+    tokens = [
+        BookSearchToken(token=token, book_id_id=book_id, weight=weight)
+        for book_id, counter in weights.items() for token, weight in counter.items()
+    ]
+    with transaction.atomic():
+        if delete:
+            BookSearchToken.objects.filter(book_id__in=book_ids).delete()
+        BookSearchToken.objects.bulk_create(tokens, batch_size=1000)
+    return len(tokens)
+
+
+# 搜索：词项全部命中的书籍，按权重之和排序
+# SELECT book_id, SUM(weight) FROM book_search_token WHERE token IN (...) GROUP BY book_id HAVING COUNT(DISTINCT 词项) = n
+def search_books(query, limit=20):
+    terms = tokenize_query(query)
+    if not terms:
+        return []
+    exact = [token for token, prefix in terms if not prefix]
+    prefixes = [token for token, prefix in terms if prefix]
+
+    condition = Q(token__in=exact) if exact else Q()
+    for prefix in prefixes:
+        # 前缀写成范围条件 token >= '雕' AND token < '雕'的下一个字，LIKE '雕%' 在SQLite上用不到索引
+        condition |= Q(token__gte=prefix, token__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    # 前缀匹配的词项按首字归并，保证每个查询词只计一次
+    term = F('token')
+    if prefixes:
+        term = Case(When(token__in=exact, then=F('token')), default=Substr('token', 1, 1), output_field=CharField())
+    rows = list(
+        BookSearchToken.objects.filter(condition)
+        .values('book_id')
+        .annotate(score=Sum('weight'), matched=Count(term, distinct=True))
+        .filter(matched=len(terms))
+        .order_by('-score', 'book_id')[:limit]
+    )
+
+    books = BookInfo.objects.in_bulk([row['book_id'] for row in rows])
+    results = []
+    for row in rows:
+        book = books.get(row['book_id'])
+        if book is None:
+            continue
+        results.append({
+            'id': book.id,
+            'name': book.name,
+            'pub_date': book.pub_date,
+            'read_count': book.read_count,
+            'comment_count': book.comment_count,
+            'score': row['score'],
+        })
+    return results
+
+
+# 增量维护：书籍或人物保存、删除后重建对应书籍的词项
+# 放到事务提交后执行：不拖慢写入事务，删除书籍时级联删除人物也不会把词项重新写回
+# 只修改了与搜索无关的字段(如read_count)时跳过
+def affects_index(fields, indexed_fields):
+    return fields is None or bool(set(fields) & indexed_fields)
+
+
+def index_books_on_commit(book_ids):
+    book_ids = [book_id for book_id in book_ids if book_id is not None]
+    if book_ids:
+        transaction.on_commit(lambda: index_books(book_ids))
+
+
+@receiver(post_save, sender=BookInfo)
+def index_saved_book(sender, instance=None, update_fields=None, **kwargs):
+    if affects_index(update_fields, BOOK_FIELDS):
+        index_books_on_commit([instance.id])
+
+
+@receiver(post_save, sender=PersonInfo)
+@receiver(post_delete, sender=PersonInfo)
+def index_person_book(sender, instance=None, update_fields=None, **kwargs):
+    if affects_index(update_fields, PERSON_FIELDS):
+        index_books_on_commit([instance.book_id_id, getattr(instance, '_old_book_id', None)])
+
+
+@receiver(post_bulk_write, sender=BookInfo)
+def index_bulk_books(sender, pks=None, fields=None, **kwargs):
+    if affects_index(fields, BOOK_FIELDS):
+        index_books_on_commit(pks)
+
+
+@receiver(post_bulk_write, sender=PersonInfo)
+def index_bulk_persons(sender, pks=None, fields=None, previous=None, **kwargs):
+    if affects_index(fields, PERSON_FIELDS):
+        book_ids = set(PersonInfo.all_objects.filter(id__in=pks).values_list('book_id', flat=True))
+        book_ids.update((previous or {}).get('book_id_id', ()))
+        index_books_on_commit(list(book_ids))
@@ -1,9 +1,12 @@
 from book.models import BookInfo, PersonInfo
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+
+from BookLib.utils.perfMiddleware import TimedSerializerMixin
 
 
 # 定义嵌套序列化器，需在被嵌套的之前
-class PersonInfoSerializer(serializers.Serializer):
+class PersonInfoSerializer(TimedSerializerMixin, serializers.Serializer):
     name = serializers.CharField(max_length=20, label='姓名')
     description = serializers.CharField(max_length=200, label='描述')
 
@@ -12,7 +15,7 @@ class PersonInfoSerializer(serializers.Serializer):
 
 
 # 定义一般形式序列化器：自定义序列化器需要将好多字段在序列化器中定义
-class BookInfoSerializer1(serializers.Serializer):
+class BookInfoSerializer1(TimedSerializerMixin, serializers.Serializer):
     # write_only表示字段只用于反序列化，不用于序列化
     name = serializers.CharField(max_length=10, min_length=5, label='书籍名', write_only=True, help_text='书名')
     # read_only表示字段只用于序列化，不用于反序列化，即反序列化不验证保存
@@ -51,12 +54,24 @@ class BookInfoSerializer1(serializers.Serializer):
     # 更新数据
     def update(self, instance, validated_data):
         instance.name = validated_data['name']
-        instance.save()
+        instance.save(update_fields=['name', 'updated_at'])      # 只更新修改的字段，不覆盖并发写入的计数字段
         return instance
 
 
+# 逻辑删除：ModelSerializer生成的UniqueValidator使用默认管理器，查不到已逻辑删除的数据，
+# 与它们重名时校验通过，保存时才违反数据库的唯一约束(500)；改为在包括已删除数据的_base_manager中校验
+class SoftDeleteUniqueMixin:
+    def get_fields(self):
+        fields = super().get_fields()
+        for field in fields.values():
+            for validator in field.validators:
+                if isinstance(validator, UniqueValidator):
+                    validator.queryset = validator.queryset.model._base_manager.all()
+        return fields
+
+
 # 模型类序列化器：直接继承序列化器类Serializers
-class BookInfoSerializer(serializers.ModelSerializer):
+class BookInfoSerializer(TimedSerializerMixin, SoftDeleteUniqueMixin, serializers.ModelSerializer):
     # 显示修改指明字段的选项参数
     # read_count = serializers.IntegerField(max_value=100, min_value=5, required=False, label='阅读量')
 
@@ -95,3 +110,86 @@ class BookInfoSerializer(serializers.ModelSerializer):
     # 内部封装了create, update方法
 
 
+# 批量写入时，唯一性校验(UniqueValidator)和外键校验(PrimaryKeyRelatedField)每条数据都要查一次库
+# context中指定bulk=True时去掉这两类逐条查询，改由book.bulk.BulkWriter按批次一次查询校验
+class BulkSerializerMixin:
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('bulk'):
+            return fields
+        model = self.Meta.model
+        for name, field in fields.items():
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and not field.read_only:
+                # 外键只校验为整数，写入attname(如book_id_id)
+                fields[name] = serializers.IntegerField(source=model._meta.get_field(name).attname,
+                                                        required=field.required)
+            else:
+                field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+        return fields
+
+
+# 可直接使用的模型类序列化器，供批量写入、分页等视图使用
+class BookInfoModelSerializer(TimedSerializerMixin, SoftDeleteUniqueMixin, BulkSerializerMixin,
+                              serializers.ModelSerializer):
+    class Meta:
+        model = BookInfo
+        fields = ('id', 'name', 'pub_date', 'read_count', 'comment_count', 'is_delete', 'updated_at')
+
+
+class PersonInfoModelSerializer(TimedSerializerMixin, SoftDeleteUniqueMixin, BulkSerializerMixin,
+                                serializers.ModelSerializer):
+    class Meta:
+        model = PersonInfo
+        fields = ('id', 'name', 'gender', 'book_id', 'description', 'is_delete', 'updated_at')
+
+
+# 预加载：嵌套序列化器(如personinfo_set)在列表序列化时，每个对象都会单独查询一次关联表(N+1问题)
+# 根据序列化器声明的关联字段，自动生成prefetch_related的查找路径，使列表查询次数为常数
+def get_prefetch_lookups(serializer, model, prefix=''):
+    lookups = []
+    for field in serializer.fields.values():
+        # 只用于反序列化的字段不参与输出，无需预加载
+        if field.write_only or field.source == '*':
+            continue
+
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+        elif isinstance(field, (serializers.BaseSerializer, serializers.ManyRelatedField, serializers.RelatedField)):
+            child = field
+        else:
+            continue
+        # 只输出主键的外键字段(PrimaryKeyRelatedField)直接取本表的外键列，预加载反而多一次查询
+        if isinstance(child, serializers.RelatedField) and child.use_pk_only_optimization() and \
+                not isinstance(field, serializers.ManyRelatedField):
+            continue
+
+        # 只处理模型上真实存在的关联(正向外键/多对多，或反向的xxx_set)
+        related_model = _get_related_model(model, field.source_attrs)
+        if related_model is None:
+            continue
+
+        lookup = prefix + '__'.join(field.source_attrs)
+        lookups.append(lookup)
+        # 嵌套序列化器内部还有关联字段时，继续向下展开
+        if isinstance(child, serializers.BaseSerializer):
+            lookups.extend(get_prefetch_lookups(child, related_model, lookup + '__'))
+    return lookups
+
+
+def _get_related_model(model, source_attrs):
+    for attr in source_attrs:
+        relations = {f.name: f.related_model for f in model._meta.get_fields() if f.is_relation and not f.auto_created}
+        relations.update({r.get_accessor_name(): r.related_model for r in model._meta.related_objects})
+        model = relations.get(attr)
+        if model is None:
+            return None
+    return model
+
+
+def setup_eager_loading(queryset, serializer_class):
+    lookups = get_prefetch_lookups(serializer_class(), queryset.model)
+    if lookups:
+        queryset = queryset.prefetch_related(*lookups)
+    return queryset
+
+
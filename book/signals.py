@@ -0,0 +1,18 @@
+from django.dispatch import Signal
+
+
+# 批量写入(bulk_create、bulk_update、queryset.update)不会发送post_save信号，写入后手动发送此信号
+# sender: 模型类
+# pks: 受影响数据的主键列表
+# fields: 修改了哪些字段，None表示不确定(新增、全部字段)
+# previous: 可选，修改了外键时 {外键attname: 修改前的值}，接收方据此处理数据从一个关联对象移到另一个(如人物换了书籍)
+post_bulk_write = Signal()
+
+
+# 计数器增加(进程内缓冲，尚未写入数据库)时发送
+# sender: 模型类
+# pk: 数据的主键
+# field: 计数字段
+# amount: 增量
+# seq: 本次增加在计数器中的序号，与BookCounter.snapshot()返回的序号比较可知快照是否已包含这次增加
+counter_changed = Signal()
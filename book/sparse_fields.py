@@ -0,0 +1,160 @@
+import functools
+
+from django.db.models import Max, Prefetch
+from rest_framework.exceptions import ValidationError
+
+from book.compiled_serializer import _column
+from book.conditional import latest
+
+
+# 稀疏字段：?fields=id,name 只返回这些字段，?expand=personinfo_set 展开关联对象(嵌套的字段用 personinfo_set.name 指定)
+# 不只是裁剪输出，查询也只取需要的列：
+#   不展开时裁剪后的序列化器仍可编译(book.compiled_serializer)，values()只查询这些列
+#   展开时用only()只取需要的列，关联对象按需Prefetch，同样只取需要的列；不展开就不查询关联表
+# 裁剪后的序列化器类按(字段, 展开)缓存；字段按序列化器声明的顺序排列，组合是有限的
+@functools.lru_cache(maxsize=None)
+def sparse_serializer(serializer_class, fields, expand):
+    # fields: 字段名元组，None表示全部；expand: ((字段名, 嵌套序列化器类, many, 嵌套的字段), ...)
+    declared = {}
+    for name, nested_class, many, nested_fields in expand:
+        declared[name] = sparse_serializer(nested_class, nested_fields, ())(many=many, read_only=True)
+    names = [name for name in serializer_class.Meta.fields if fields is None or name in fields]
+    names.extend(name for name in declared if name not in names)
+    meta = type('Meta', (serializer_class.Meta,), {'fields': tuple(names)})
+    return type(serializer_class.__name__, (serializer_class,), dict(declared, Meta=meta))
+
+
+def model_columns(serializer, model):
+    # 序列化器字段对应的列；有不对应模型列的字段时返回None(不能用only())
+    columns = set()
+    for name, field in serializer.fields.items():
+        if field.write_only or name in getattr(serializer, '_declared_fields', {}):
+            continue
+        column = _column(model, field)
+        if column is None:
+            return None
+        columns.add(column)
+    return columns
+
+
+# 视图集使用：list、retrieve支持fields、expand参数，其他操作不变
+# expandable_fields = {字段名: (嵌套序列化器类, many)}，字段名为模型上的正向外键或反向关联(xxx_set)
+class SparseFieldsMixin:
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    expandable_fields = {}
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        # 返回(fields, expand)，没有指定时返回None
+        if hasattr(self, '_sparse_fields'):
+            return self._sparse_fields
+        self._sparse_fields = None
+        request = getattr(self, 'request', None)
+        if request is None:
+            return None
+        params = request.query_params
+        if getattr(self, 'action', None) not in self.sparse_actions or not (
+                params.get(self.fields_query_param) or params.get(self.expand_query_param)):
+            return None
+
+        serializer_class = super().get_serializer_class()
+        expand_names = [name for name in params.get(self.expand_query_param, '').split(',') if name]
+        unknown = [name for name in expand_names if name not in self.expandable_fields]
+        if unknown:
+            raise ValidationError({self.expand_query_param: ['不能展开的字段: %s' % ', '.join(unknown)]})
+
+        fields, nested = None, {name: None for name in expand_names}
+        requested = [name for name in params.get(self.fields_query_param, '').split(',') if name]
+        if requested:
+            fields = {serializer_class.Meta.model._meta.pk.name}      # 主键总是返回，分页游标、带统计需要
+            for name in requested:
+                name, _, child = name.partition('.')
+                if child:
+                    if name not in nested:
+                        raise ValidationError({self.fields_query_param: ['%s需要同时展开' % name]})
+                    nested[name] = (nested[name] or set()) | {child}
+                fields.add(name)
+            known = set(serializer_class.Meta.fields) | set(self.expandable_fields)
+            unknown = sorted(fields - known)
+            if unknown:
+                raise ValidationError({self.fields_query_param: ['未知字段: %s' % ', '.join(unknown)]})
+            fields = tuple(sorted(fields))
+
+        expand = []
+        for name in sorted(nested):
+            nested_class, many = self.expandable_fields[name]
+            children = nested[name]
+            if children is not None:
+                unknown = sorted(children - set(nested_class.Meta.fields))
+                if unknown:
+                    raise ValidationError({self.fields_query_param: ['未知字段: %s' % ', '.join(
+                        '%s.%s' % (name, child) for child in unknown)]})
+                children = tuple(sorted(children))
+            expand.append((name, nested_class, many, children))
+        self._sparse_fields = (fields, tuple(expand))
+        return self._sparse_fields
+
+    def get_serializer_class(self):
+        serializer_class = super().get_serializer_class()
+        sparse = self.get_sparse_fields()
+        if sparse is None:
+            return serializer_class
+        return sparse_serializer(serializer_class, *sparse)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        sparse = self.get_sparse_fields()
+        if sparse is None:
+            return queryset
+        model = queryset.model
+        serializer = self.get_serializer_class()()
+        columns = model_columns(serializer, model)
+        if columns is None:
+            return queryset
+        # 主键、分页排序字段也要取出，否则访问时每行再查一次
+        columns.add(model._meta.pk.attname)
+        if self.action == 'list':
+            attnames = {f.attname for f in model._meta.concrete_fields}
+            columns.update(f for f in getattr(self.paginator, 'ordering_fields', ()) if f in attnames)
+
+        prefetches = []
+        for name, _, _, _ in sparse[1]:
+            nested = serializer.fields[name]
+            nested = getattr(nested, 'child', nested)
+            related_columns = model_columns(nested, nested.Meta.model) or set()
+            relation = self.get_relation(model, name)
+            related_model = relation.related_model
+            if relation.is_relation and relation.concrete:
+                # 正向外键：本表取外键列，关联表按主键查询
+                columns.add(relation.attname)
+                related_columns.add(related_model._meta.pk.attname)
+                related_queryset = related_model._base_manager.only(*related_columns)
+            else:
+                # 反向关联：关联表按外键列查询，逻辑删除的不返回
+                related_columns.add(relation.field.attname)
+                related_queryset = related_model._default_manager.only(*related_columns)
+            prefetches.append(Prefetch(name, queryset=related_queryset))
+        return queryset.only(*columns).prefetch_related(*prefetches)
+
+    @staticmethod
+    def get_relation(model, name):
+        for relation in model._meta.related_objects:
+            if relation.get_accessor_name() == name:
+                return relation
+        return model._meta.get_field(name)
+
+    def expanded_models(self):
+        sparse = self.get_sparse_fields()
+        return tuple(nested_class.Meta.model for _, nested_class, _, _ in sparse[1]) if sparse else ()
+
+    @property
+    def cache_models(self):
+        # 展开的关联对象变化时缓存也要失效
+        return tuple(super().cache_models) + self.expanded_models()
+
+    def get_dependent_last_modified(self):
+        last_modified = super().get_dependent_last_modified()
+        for model in self.expanded_models():
+            last_modified = latest(last_modified, model._base_manager.aggregate(m=Max('updated_at'))['m'])
+        return last_modified
@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from book.bulk import chunked
+from book.models import BookInfo, BookStats, PersonInfo
+from book.signals import post_bulk_write
+
+
+# 书籍统计(book_stats)的维护
+# 新增单个人物：在同一事务中 UPDATE ... SET character_count = character_count + 1，不重新统计
+# 其他变化(修改、删除、批量写入、书籍逻辑删除)：事务提交后按书重新统计，GROUP BY只扫描这些书的人物(book_id, is_delete索引)
+# 书籍逻辑删除后删掉它的统计行，表中只有未删除的书籍
+GENDER_FIELDS = {0: 'male_count', 1: 'female_count'}
+STATS_FIELDS = ('character_count', 'male_count', 'female_count')
+
+BOOK_FIELDS = {'is_delete'}
+PERSON_FIELDS = {'gender', 'is_delete', 'book_id', 'book_id_id'}
+
+
+def refresh_book_stats(book_ids, chunk_size=1000):
+    # 重新统计这些书籍，返回写入的统计行数
+    book_ids = sorted({book_id for book_id in book_ids if book_id is not None})
+    written = 0
+    for chunk in chunked(book_ids, chunk_size):
+        live = set(BookInfo.objects.filter(id__in=chunk).values_list('id', flat=True))
+        rows = {book_id: dict.fromkeys(STATS_FIELDS, 0) for book_id in live}
+        counts = (PersonInfo.objects.filter(book_id__in=live)
+                  .values_list('book_id', 'gender').annotate(count=Count('id')).order_by())
+        for book_id, gender, count in counts:
+            rows[book_id]['character_count'] += count
+            if gender in GENDER_FIELDS:
+                rows[book_id][GENDER_FIELDS[gender]] += count
+
+        now = timezone.now()
+        objs = [BookStats(book_id_id=book_id, updated_at=now, **values) for book_id, values in rows.items()]
+        with transaction.atomic():
+            BookStats.objects.filter(book_id__in=set(chunk) - live).delete()
+            existing = set(BookStats.objects.filter(book_id__in=live).values_list('book_id', flat=True))
+            # 并发重新统计同一本书时，后插入的忽略冲突即可，两边的统计结果相同
+            BookStats.objects.bulk_create([obj for obj in objs if obj.book_id_id not in existing],
+                                          ignore_conflicts=True)
+            BookStats.objects.bulk_update([obj for obj in objs if obj.book_id_id in existing],
+                                          STATS_FIELDS + ('updated_at',))
+        post_bulk_write.send(sender=BookStats, pks=chunk, fields=None)
+        written += len(objs)
+    return written
+
+
+def add_person(book_id, gender):
+    values = {'character_count': F('character_count') + 1, 'updated_at': timezone.now()}
+    if gender in GENDER_FIELDS:
+        values[GENDER_FIELDS[gender]] = F(GENDER_FIELDS[gender]) + 1
+    if BookStats.objects.filter(book_id=book_id).update(**values):
+        post_bulk_write.send(sender=BookStats, pks=[book_id], fields=sorted(values))
+    else:
+        # 还没有统计行(如重建统计之前的数据)：提交后重新统计
+        refresh_on_commit([book_id])
+
+
+def affects_stats(fields, stats_fields):
+    return fields is None or bool(set(fields) & stats_fields)
+
+
+def refresh_on_commit(book_ids):
+    book_ids = [book_id for book_id in book_ids if book_id is not None]
+    if book_ids:
+        transaction.on_commit(lambda: refresh_book_stats(book_ids))
+
+
+@receiver(post_save, sender=BookInfo)
+def book_saved(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created:
+        # 新书还没有人物，直接插入全0的统计行
+        if not instance.is_delete:
+            BookStats.objects.bulk_create([BookStats(book_id_id=instance.pk)], ignore_conflicts=True)
+    elif affects_stats(update_fields, BOOK_FIELDS):
+        refresh_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=PersonInfo)
+def person_saved(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created:
+        if not instance.is_delete:
+            add_person(instance.book_id_id, instance.gender)
+    elif affects_stats(update_fields, PERSON_FIELDS):
+        refresh_on_commit([instance.book_id_id, getattr(instance, '_old_book_id', None)])
+
+
+@receiver(post_delete, sender=PersonInfo)
+def person_deleted(sender, instance=None, **kwargs):
+    refresh_on_commit([instance.book_id_id])
+
+
+@receiver(post_bulk_write, sender=BookInfo)
+def refresh_bulk_books(sender, pks=None, fields=None, **kwargs):
+    if affects_stats(fields, BOOK_FIELDS):
+        refresh_on_commit(pks or [])
+
+
+@receiver(post_bulk_write, sender=PersonInfo)
+def refresh_bulk_persons(sender, pks=None, fields=None, previous=None, **kwargs):
+    if affects_stats(fields, PERSON_FIELDS):
+        book_ids = set(PersonInfo.all_objects.filter(id__in=pks or []).values_list('book_id', flat=True))
+        book_ids.update((previous or {}).get('book_id_id', ()))
+        refresh_on_commit(book_ids)
+
+
+def attach_book_stats(rows):
+    # 书籍列表带上统计：按本页的书籍id一次查询
+    stats = {
+        row[0]: dict(zip(STATS_FIELDS, row[1:]))
+        for row in BookStats.objects.filter(book_id__in=[row['id'] for row in rows])
+        .values_list('book_id', *STATS_FIELDS)
+    }
+    empty = dict.fromkeys(STATS_FIELDS, 0)
+    for row in rows:
+        row.update(stats.get(row['id'], empty))
+    return rows
@@ -1,3 +1,1514 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime
+import decimal
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django import http
+from django.contrib.sessions.backends.db import SessionStore
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, OperationalError, connection, connections
+from django.db.backends.utils import CursorWrapper
+from django.db.models.functions import Lower
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+
+from BookLib.utils.customDRFRenderer import JSON_BACKENDS, CustomRenderer
+from BookLib.utils.perfMiddleware import PerformanceMiddleware, registry, sql_shape
+from book.auth.authentication import AuthCache, CachedTokenAuthentication, token_cache
+from book.auth.backends import CustomAuthBackend, user_cache
+from book.auth.hashing import HashingPool, HashingPoolFull
+from book.compiled_serializer import compile_serializer
+from book.conditional import save_if_unmodified
+from book.db.backends.sqlite3.base import DatabaseWrapper as PooledSQLiteWrapper
+from book.db.pool import ConnectionPool, PoolTimeout
+from book.db.routers import ReplicaRoutingMiddleware, ReplicaSet
+from book.counters import BookCounter
+from book.importer import BookImporter, read_ndjson
+from book.leaderboard import Leaderboard, leaderboard
+from book.signals import counter_changed
+from book.models import BookDocument, BookInfo, BookSearchToken, BookStats, PersonInfo, User
+from book.response_cache import ResponseCache, response_cache
+from book.search import search_books, tokenize, tokenize_query
+from book.serializer import BookInfoModelSerializer, BookInfoSerializer1, PersonInfoModelSerializer, get_prefetch_lookups
+from book.throttling import BucketScopedRateThrottle, ThrottleStore
+from book import viewsAuth, viewsBasics
+
 
 # Create your tests here.
+class PrefetchNestedTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def create_books(self, count):
+        for i in range(count):
+            book = BookInfo.objects.create(name='book%d' % BookInfo.objects.count())
+            PersonInfo.objects.create(name='person%d' % book.id, book_id=book, description='desc')
+
+    def test_prefetch_lookups(self):
+        lookups = get_prefetch_lookups(BookInfoSerializer1(), BookInfo)
+        self.assertEqual(lookups, ['personinfo_set'])
+        # 只输出主键的外键直接用本表的外键列，不预加载
+        self.assertEqual(get_prefetch_lookups(PersonInfoModelSerializer(), PersonInfo), [])
+
+    def test_routed_expand_without_column_pruning(self):
+        # 展开时裁剪不了列(SparseFieldsMixin不生成Prefetch)，仍按嵌套序列化器预加载
+        with mock.patch('book.sparse_fields.model_columns', return_value=None):
+            for count in (3, 20):
+                self.create_books(count)
+                cache.clear()
+                # 最后修改时间两次(条件请求) + 书籍一次 + 人物一次
+                with self.assertNumQueries(4):
+                    response = self.client.get('/book/books/', {'expand': 'personinfo_set', 'page_size': 20})
+                self.assertEqual(len(response.data['results']), min(BookInfo.objects.count(), 20))
+                for book in response.data['results']:
+                    self.assertEqual(book['personinfo_set'][0]['description'], 'desc')
+
+    def test_list_query_count_constant(self):
+        views = (
+            viewsBasics.BookGenericViewSet.as_view({'get': 'list'}, serializer_class=BookInfoSerializer1),
+            viewsBasics.BookListCreateAPIView.as_view(serializer_class=BookInfoSerializer1),
+        )
+        for view in views:
+            # 书籍数量增加，查询次数不变：书籍一次 + 人物一次
+            for count in (3, 20):
+                self.create_books(count)
+                with self.assertNumQueries(2):
+                    response = view(self.factory.get('/books/'))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data), BookInfo.objects.count())
+                self.assertEqual(response.data[0]['personinfo_set'][0]['description'], 'desc')
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        dates = [None, datetime.date(2020, 1, 1), datetime.date(2020, 1, 1), datetime.date(2021, 5, 1), None]
+        for i in range(25):
+            BookInfo.objects.create(name='book%d' % i, pub_date=dates[i % len(dates)], read_count=i % 4)
+
+    def paginate(self, url):
+        paginator = viewsBasics.KeysetPagination()
+        request = Request(self.factory.get(url))
+        rows = paginator.paginate_queryset(BookInfo.objects.all(), request)
+        return rows, paginator.get_paginated_response([row.id for row in rows]).data
+
+    def walk(self, ordering):
+        ids, url = [], '/books/?ordering=%s&page_size=4' % ordering
+        while url:
+            with self.assertNumQueries(1):         # 只有一条分页查询，没有COUNT
+                rows, data = self.paginate(url)
+            ids.extend(data['results'])
+            url = data['next']
+        return ids
+
+    def test_walk_all_orderings(self):
+        for ordering in ('id', '-id', 'pub_date', '-pub_date', 'read_count', '-read_count'):
+            field = ordering.lstrip('-')
+            prefix = '-' if ordering.startswith('-') else ''
+            expected = list(BookInfo.objects.order_by(prefix + field, prefix + 'id').values_list('id', flat=True))
+            self.assertEqual(self.walk(ordering), expected, ordering)
+
+    def test_previous_link(self):
+        rows, first = self.paginate('/books/?ordering=-pub_date&page_size=4')
+        rows, second = self.paginate(first['next'])
+        rows, back = self.paginate(second['previous'])
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(first['previous'])
+
+    def test_total_and_invalid_cursor(self):
+        rows, data = self.paginate('/books/?with_total=1')
+        self.assertNotIn('total', self.paginate('/books/')[1])
+        self.assertEqual(data['total'], 25)
+        with self.assertRaises(NotFound):
+            self.paginate('/books/?cursor=bad')
+        # 值与排序字段类型不符的游标(被篡改)
+        for cursor in ({'id': 1, 'v': 'garbage'}, {'id': 1, 'v': [1]}, {'id': 1}):
+            token = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+            with self.assertRaises(NotFound):
+                self.paginate('/books/?ordering=pub_date&cursor=%s' % token)
+
+    def test_total_is_row_count(self):
+        # 逻辑删除、删除最大id之后仍是实际行数
+        BookInfo.objects.filter(name='book0').soft_delete()
+        BookInfo.objects.order_by('-id').first().delete()
+        self.assertEqual(self.paginate('/books/?with_total=1')[1]['total'], 23)
+
+
+class BookCounterTestCase(TestCase):
+    def setUp(self):
+        self.counter = BookCounter(flush_interval=3600, flush_threshold=100)
+        self.books = [BookInfo.objects.create(name='book%d' % i) for i in range(3)]
+
+    def test_incr_buffers_and_flush_groups_updates(self):
+        with self.assertNumQueries(0):
+            for book in self.books:
+                self.counter.incr(book.id)
+            self.counter.incr(self.books[0].id)
+            self.counter.incr(self.books[1].id, 'comment_count', 5)
+        self.assertEqual(self.counter.pending(self.books[0].id), 2)
+
+        # read_count增量1和2各一条，comment_count一条
+        with CaptureQueriesContext(connection) as ctx:
+            self.counter.flush()
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]), 3)
+        counts = dict(BookInfo.objects.values_list('id', 'read_count'))
+        self.assertEqual([counts[book.id] for book in self.books], [2, 1, 1])
+        self.assertEqual(BookInfo.objects.get(id=self.books[1].id).comment_count, 5)
+        self.assertEqual(self.counter.pending(self.books[0].id), 0)
+
+    def test_threshold_triggers_flush(self):
+        for i in range(100):
+            self.counter.incr(self.books[2].id)
+        self.assertEqual(BookInfo.objects.get(id=self.books[2].id).read_count, 100)
+
+    def test_read_action_does_not_write(self):
+        view = viewsBasics.BookModelView.as_view({'post': 'read'}, counter=self.counter)
+        with self.assertNumQueries(0):
+            response = view(APIRequestFactory().post('/books/%d/read/' % self.books[0].id), pk=str(self.books[0].id))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.counter.pending(self.books[0].id), 1)
+
+    def test_read_rejects_out_of_range_ids(self):
+        view = viewsBasics.BookModelView.as_view({'post': 'read'}, counter=self.counter)
+        for pk in ('99999999999999999999999', '0', '-1', '١٢'):
+            response = view(APIRequestFactory().post('/books/%s/read/' % pk), pk=pk)
+            self.assertEqual(response.status_code, 404, pk)
+        self.assertEqual(self.counter.snapshot()[0], {})
+
+    def test_unwritable_increment_is_dropped(self):
+        # 绕过接口的检查直接缓冲超出范围的id：刷新时丢弃它，其他增量照常写入，之后的刷新不受影响
+        self.counter.incr(10 ** 23)
+        self.counter.incr(self.books[0].id)
+        with self.assertLogs('book.counters', 'ERROR'):
+            self.counter.flush()
+        self.assertEqual(BookInfo.objects.get(id=self.books[0].id).read_count, 1)
+        self.assertEqual(self.counter.snapshot()[0], {})
+        self.counter.incr(self.books[0].id)
+        self.counter.flush()
+        self.assertEqual(BookInfo.objects.get(id=self.books[0].id).read_count, 2)
+
+    def test_transient_error_requeues(self):
+        self.counter.incr(self.books[0].id)
+        with mock.patch('book.counters.BookInfo.objects.filter', side_effect=OperationalError('locked')):
+            with self.assertRaises(OperationalError):
+                self.counter.flush()
+        self.assertEqual(self.counter.pending(self.books[0].id), 1)
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(username='reader', password='password123')
+        self.key = Token.objects.get(user=self.user).key
+        self.auth = CachedTokenAuthentication()
+
+    def test_warm_key_skips_database(self):
+        user, token = self.auth.authenticate_credentials(self.key)
+        with self.assertNumQueries(0):
+            cached_user, cached_token = self.auth.authenticate_credentials(self.key)
+        self.assertEqual(cached_user.pk, self.user.pk)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_rotated_token_is_invalidated(self):
+        self.auth.authenticate_credentials(self.key)
+        # 删除旧token(queryset.delete同样发送post_delete信号)
+        Token.objects.filter(user=self.user).delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_deactivated_user_is_invalidated(self):
+        self.auth.authenticate_credentials(self.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.key)
+
+    def test_lru_eviction(self):
+        cache = AuthCache('test:', max_size=2, ttl=60)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'c')
+
+    def test_stats_exact_under_threads(self):
+        cache = AuthCache('test:', ttl=60)
+        cache.set('a', 'a')
+        threads = [threading.Thread(target=lambda: [cache.get(key) for _ in range(2000) for key in ('a', 'b')])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (16000, 16000))
+
+
+class CustomAuthBackendTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username='reader', email='Reader@Example.com', password='password123')
+        self.backend = CustomAuthBackend()
+
+    def test_email_login_single_query(self):
+        with self.assertNumQueries(1):
+            user = self.backend.authenticate(None, username='reader@example.COM', password='password123')
+        self.assertEqual(user.pk, self.user.pk)
+        with self.assertRaises(PermissionDenied):
+            self.backend.authenticate(None, username='reader@example.com', password='wrong')
+        self.assertEqual(self.backend.authenticate(None, username='reader', password='password123').pk, self.user.pk)
+
+    def test_ambiguous_email_fails_login(self):
+        User.objects.create_user(username='other', email='reader@example.com', password='password123')
+        self.assertIsNone(authenticate(None, username='READER@example.com', password='password123'))
+        response = APIClient().post('/book/custom-drf-token-auth/',
+                                    {'username': 'reader@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_login_hashes_only_in_pool(self):
+        # 密码错误、用户不存在：不再交给ModelBackend在线程池外查询、哈希
+        User.objects.create_user(username='a@b.cn', email='other@example.com', password='password123')
+        with mock.patch('django.contrib.auth.backends.ModelBackend.authenticate') as model_backend, \
+                mock.patch('book.auth.hashing.HashingPool.run', autospec=True,
+                           side_effect=lambda pool, func, *args: func(*args)) as run:
+            self.assertIsNone(authenticate(None, username='reader', password='wrong'))
+            self.assertIsNone(authenticate(None, username='nobody', password='password123'))
+            self.assertIsNone(authenticate(None, username='nobody@example.com', password='password123'))
+            # 邮箱格式的用户名
+            self.assertEqual(authenticate(None, username='a@b.cn', password='password123').username, 'a@b.cn')
+        model_backend.assert_not_called()
+        self.assertEqual(run.call_count, 4)
+
+    def test_login_upgrades_password_hash(self):
+        self.user.password = make_password('password123', hasher='pbkdf2_sha1')
+        self.user.save()
+        user = self.backend.authenticate(None, username='reader', password='password123')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, user.password)
+        self.assertTrue(self.user.check_password('password123'))
+        # 已是最新的哈希：不写库
+        with self.assertNumQueries(1):
+            self.backend.authenticate(None, username='reader', password='password123')
+
+    @skipUnless(connection.vendor == 'sqlite', '查询计划的输出格式与数据库有关')
+    def test_email_lookup_uses_index(self):
+        qs = User.objects.alias(email_lower=Lower('email')).filter(email_lower='reader@example.com')
+        self.assertIn('tb_user_email_lower_idx', qs.explain())
+
+    def test_get_user_cached_and_invalidated(self):
+        self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(self.user.pk).pk, self.user.pk)
+        self.user.first_name = 'new'
+        self.user.save()
+        self.assertEqual(self.backend.get_user(self.user.pk).first_name, 'new')
+
+
+class HashingPoolTestCase(TestCase):
+    def test_full_pool_rejects(self):
+        pool = HashingPool(max_workers=1, max_queue=0)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=pool.run, args=(block,))
+        thread.start()
+        started.wait(5)
+        with self.assertRaises(HashingPoolFull):
+            pool.make_password('password123')
+        release.set()
+        thread.join()
+        self.assertTrue(pool.check_password('password123', pool.make_password('password123')))
+
+    def test_timeout_counts_as_full(self):
+        pool = HashingPool(max_workers=1, max_queue=1, timeout=0.05)
+        release = threading.Event()
+        with self.assertRaises(HashingPoolFull):
+            pool.run(release.wait, 5)
+        release.set()
+
+    def test_full_pool_on_login_paths(self):
+        User.objects.create_user(username='reader', password='password123')
+        with mock.patch('book.auth.hashing.hashing_pool.check_password', side_effect=HashingPoolFull):
+            # DRF：自带的obtain_auth_token、Basic认证都返回429
+            response = APIClient().post('/book/drf-token-auth/', {'username': 'reader', 'password': 'password123'})
+            self.assertEqual(response.status_code, 429)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'reader:password123').decode())
+            self.assertEqual(client.get('/book/books/').status_code, 429)
+            # 非DRF(admin登录)：登录失败，不是500
+            response = self.client.post('/admin/login/', {'username': 'reader', 'password': 'password123'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_register_hashes_password(self):
+        response = viewsAuth.register(RequestFactory().post('/book/register/', {'username': 'new', 'password': 'pw123456'}))
+        user = User.objects.get(id=json.loads(response.content)['id'])
+        self.assertTrue(user.check_password('pw123456'))
+
+
+class BulkWriteTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.book = BookInfo.objects.create(name='existing')
+
+    def test_bulk_create_reports_errors_by_index(self):
+        rows = [{'name': 'b%d' % i} for i in range(5)] + [{'name': 'existing'}, {'name': 'b1'}, {'read_count': 'x'}]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/book/books/bulk/', rows, format='json')
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(response.data['created'], 5)
+        self.assertEqual([e['index'] for e in response.data['errors']], [5, 6, 7])
+        self.assertEqual(BookInfo.objects.count(), 6)
+
+    def test_bulk_create_persons_checks_foreign_key(self):
+        rows = [{'name': 'p1', 'book_id': self.book.id}, {'name': 'p2', 'book_id': 9999}]
+        response = self.client.post('/book/persons/bulk/', rows, format='json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertIn('book_id', response.data['errors'][0]['errors'])
+        # 同一行的多个错误都返回
+        response = self.client.post('/book/persons/bulk/', [{'name': 'p1', 'book_id': 9999}], format='json')
+        self.assertEqual(set(response.data['errors'][0]['errors']), {'name', 'book_id'})
+
+    def test_bulk_delete_requires_list(self):
+        books = [BookInfo.objects.create(name='d%d' % i) for i in range(3)]
+        pks = ''.join(str(b.id) for b in books[:2])
+        response = self.client.post('/book/books/bulk-delete/', {'ids': pks}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(BookInfo.all_objects.filter(is_delete=True).count(), 0)
+
+    def test_person_ordering(self):
+        for name in ('b', 'a'):
+            PersonInfo.objects.create(name=name, book_id=self.book)
+        # 书籍的排序字段不适用于人物，按默认的id排序
+        response = self.client.get('/book/persons/', {'ordering': 'pub_date'})
+        self.assertEqual([p['name'] for p in response.data['results']], ['b', 'a'])
+        response = self.client.get('/book/persons/', {'ordering': 'name'})
+        self.assertEqual([p['name'] for p in response.data['results']], ['a', 'b'])
+
+    def test_bulk_update_and_soft_delete(self):
+        books = [BookInfo.objects.create(name='u%d' % i) for i in range(3)]
+        rows = [{'id': book.id, 'read_count': 7} for book in books] + [{'id': 9999, 'read_count': 1}, {'read_count': 1}]
+        response = self.client.patch('/book/books/bulk/', rows, format='json')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual([e['index'] for e in response.data['errors']], [3, 4])
+        self.assertEqual(set(BookInfo.objects.filter(id__in=[b.id for b in books]).values_list('read_count', flat=True)), {7})
+
+        with self.assertNumQueries(1):
+            response = self.client.post('/book/books/bulk-delete/', {'ids': [b.id for b in books]}, format='json')
+        self.assertEqual(response.data['deleted'], 3)
+        self.assertEqual(BookInfo.all_objects.filter(is_delete=True).count(), 3)
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        for i in range(5):
+            book = BookInfo.objects.create(name='书%d' % i, pub_date=datetime.date(2020, 1, i + 1))
+            if i % 2 == 0:
+                PersonInfo.objects.create(name='人物%d' % i, book_id=book, description='描述')
+
+    def test_ndjson_streams_in_chunks(self):
+        view = viewsBasics.BookModelView.as_view({'get': 'export'}, export_chunk_size=2)
+        response = view(APIRequestFactory().get('/book/books/export/', {'persons': '1'}))
+        self.assertTrue(response.streaming)
+        # 3批书籍，每批一次书籍查询 + 一次人物查询
+        with self.assertNumQueries(6):
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        books = [json.loads(line) for line in lines]
+        self.assertEqual([book['name'] for book in books], ['书%d' % i for i in range(5)])
+        self.assertEqual(books[0]['persons'][0]['name'], '人物0')
+        self.assertEqual(books[1]['persons'], [])
+        self.assertEqual(books[0]['pub_date'], '2020-01-01')
+
+    def test_csv(self):
+        response = APIClient().get('/book/books/export/', {'type': 'csv', 'persons': '1'})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:2], ['id', 'name'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][7], '人物0')
+
+
+class ImportTestCase(TestCase):
+    def test_ndjson_upsert_resolves_book_names(self):
+        BookInfo.objects.create(name='旧书', read_count=1)
+        lines = [
+            {'name': '旧书', 'read_count': 9},
+            {'name': '新书', 'pub_date': '2020-01-01', 'persons': [{'name': '甲', 'gender': 1}]},
+            {'type': 'person', 'name': '乙', 'book': '旧书'},
+            {'type': 'person', 'name': '丙', 'book': '不存在'},
+            {'name': 'x' * 20},
+            'not an object',
+        ]
+        stream = io.StringIO('\n'.join(json.dumps(line, ensure_ascii=False) for line in lines) + '\n{bad json\n')
+        importer = BookImporter(batch_size=2)
+        report = importer.run(read_ndjson(stream))
+
+        self.assertEqual(report['rows'], 7)
+        self.assertEqual((report['books_created'], report['books_updated']), (1, 1))
+        self.assertEqual(report['persons_created'], 2)
+        self.assertEqual(sorted(r['line'] for r in importer.rejected), [4, 5, 6, 7])
+        self.assertEqual(BookInfo.objects.get(name='旧书').read_count, 9)
+        self.assertEqual(PersonInfo.objects.get(name='甲').book_id.name, '新书')
+
+    def test_export_roundtrip_via_upload(self):
+        book = BookInfo.objects.create(name='书', pub_date=datetime.date(2021, 1, 1))
+        PersonInfo.objects.create(name='人', book_id=book, description='描述')
+        client = APIClient()
+        content = b''.join(client.get('/book/books/export/', {'type': 'csv', 'persons': '1'}).streaming_content)
+        PersonInfo.objects.all().delete()
+        BookInfo.objects.all().delete()
+
+        upload = SimpleUploadedFile('books.csv', content, content_type='text/csv')
+        response = client.post('/book/books/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data['rejected'], 0)
+        self.assertEqual(PersonInfo.objects.get(name='人').book_id.pub_date, datetime.date(2021, 1, 1))
+
+    def post_import(self, name, content):
+        upload = SimpleUploadedFile(name, content)
+        return APIClient().post('/book/books/import/', {'file': upload}, format='multipart')
+
+    def test_undecodable_line_returns_400(self):
+        content = '{"name": "第一本"}\n{"name": "第二本"}\n'.encode() + '{"name": "第三本"}\n'.encode('gbk')
+        response = self.post_import('books.ndjson', content)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['line'], 3)
+        self.assertIn('第3行', response.data['file'][0])
+        # 出错行之前的数据已导入
+        self.assertEqual(response.data['books_created'], 2)
+        self.assertEqual(set(BookInfo.objects.values_list('name', flat=True)), {'第一本', '第二本'})
+
+    def test_malformed_csv_returns_400(self):
+        content = 'name,read_count\n书一,1\n书二,2\n"%s,3\n' % ('x' * (csv.field_size_limit() + 1))
+        response = self.post_import('books.csv', content.encode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['line'], 4)
+        self.assertIn('CSV', response.data['file'][0])
+        self.assertEqual(response.data['books_created'], 2)
+
+    def test_command_reports_failing_line(self):
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as f:
+            f.write('{"name": "书"}\n'.encode() + b'\xff\n')
+            f.flush()
+            with self.assertRaisesMessage(CommandError, '第2行'):
+                call_command('import_books', f.name, stdout=io.StringIO())
+        self.assertTrue(BookInfo.objects.filter(name='书').exists())
+
+
+class SoftDeleteTestCase(TestCase):
+    def setUp(self):
+        self.live = BookInfo.objects.create(name='live')
+        self.deleted = BookInfo.objects.create(name='deleted', is_delete=True)
+        PersonInfo.objects.create(name='p1', book_id=self.live)
+        PersonInfo.objects.create(name='p2', book_id=self.live, is_delete=True)
+
+    def test_default_manager_hides_deleted_rows(self):
+        self.assertEqual(list(BookInfo.objects.values_list('name', flat=True)), ['live'])
+        self.assertEqual(BookInfo.all_objects.count(), 2)
+        self.assertEqual([p.name for p in self.live.personinfo_set.all()], ['p1'])
+        BookInfo.objects.filter(id=self.live.id).soft_delete()
+        self.assertFalse(BookInfo.objects.exists())
+
+    def test_unique_name_includes_deleted_rows(self):
+        # 与已逻辑删除的书籍重名：校验失败(400)，而不是保存时违反唯一约束(500)
+        response = APIClient().post('/book/books/', {'name': 'deleted'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data)
+        response = APIClient().post('/book/persons/', {'name': 'p2', 'book_id': self.live.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_deleted_user_is_hidden(self):
+        User.objects.create_user(username='gone', password='password123', is_delete=True)
+        User.objects.create_user(username='here', password='password123')
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['here'])
+        self.assertIsNone(authenticate(None, username='gone', password='password123'))
+
+    @skipUnless(connection.vendor == 'sqlite', '查询计划的输出格式与数据库有关')
+    def test_live_queries_use_indexes(self):
+        plans = {
+            'bookinfo_live_id_idx': BookInfo.objects.order_by('id')[:10],
+            'bookinfo_live_pub_date_idx': BookInfo.objects.order_by('pub_date')[:10],
+            'bookinfo_live_read_count_idx': BookInfo.objects.order_by('-read_count')[:10],
+            'personinfo_book_live_idx': PersonInfo.objects.filter(book_id=self.live.id),
+        }
+        for index, queryset in plans.items():
+            plan = queryset.explain()
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book1 = BookInfo.objects.create(name='射雕英雄传')
+            self.book2 = BookInfo.objects.create(name='天龙八部')
+            PersonInfo.objects.create(name='郭靖', book_id=self.book1, description='降龙十八掌')
+            PersonInfo.objects.create(name='乔峰', book_id=self.book2, description='丐帮帮主，降龙十八掌，亢龙有悔是降龙十八掌的一招')
+
+    def names(self, query):
+        return [book['name'] for book in search_books(query)]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('射雕英雄 Hero2'), ['射雕', '雕英', '英雄', '雄', 'hero2'])
+        self.assertEqual(tokenize_query('雕'), [('雕', True)])
+        self.assertEqual(tokenize_query('英雄传'), [('英雄', False), ('雄传', False)])
+
+    def test_ranked_search(self):
+        # 两本书的人物描述都命中，命中次数多的排在前面
+        self.assertEqual(self.names('降龙'), ['天龙八部', '射雕英雄传'])
+        self.assertEqual(self.names('天龙'), ['天龙八部'])
+        self.assertEqual(self.names('郭靖'), ['射雕英雄传'])
+        self.assertEqual(self.names('雕'), ['射雕英雄传'])
+        self.assertEqual(self.names('射雕 十八掌'), ['射雕英雄传'])
+        self.assertEqual(self.names('射天'), [])
+
+    def test_index_follows_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book2.name = '笑傲江湖'
+            self.book2.save()
+        self.assertEqual(self.names('天龙'), [])
+        self.assertEqual(self.names('江湖'), ['笑傲江湖'])
+
+        # 只修改阅读量不重建
+        with mock.patch('book.search.index_books') as index_books:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.book2.read_count = 5
+                self.book2.save(update_fields=['read_count'])
+        index_books.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book1.personinfo_set.all().delete()
+        self.assertEqual(self.names('郭靖'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/book/books/bulk-delete/', {'ids': [self.book2.id]}, content_type='application/json')
+        self.assertEqual(self.names('江湖'), [])
+        self.assertFalse(BookSearchToken.objects.filter(book_id=self.book2.id).exists())
+
+    def test_bulk_create_and_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/book/books/bulk/', [{'name': '神雕侠侣'}], content_type='application/json')
+        response = APIClient().get('/book/books/search/', {'q': '神雕'})
+        self.assertEqual([book['name'] for book in response.data['results']], ['神雕侠侣'])
+        self.assertEqual(APIClient().get('/book/books/search/').status_code, 400)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        response_cache.reset_stats()
+        self.client = APIClient()
+        self.book1 = BookInfo.objects.create(name='book1')
+        self.book2 = BookInfo.objects.create(name='book2')
+
+    def test_hit_and_precise_invalidation(self):
+        self.assertEqual(self.client.get('/book/books/%d/' % self.book1.id)['X-Cache'], 'MISS')
+        self.client.get('/book/books/%d/' % self.book2.id)
+        self.client.get('/book/books/')
+        # 命中缓存时只剩条件GET的一条updated_at查询
+        with self.assertNumQueries(1):
+            response = self.client.get('/book/books/%d/' % self.book1.id)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['name'], 'book1')
+
+        # 修改book2：book2的详情和列表失效，book1的详情仍然命中
+        self.client.patch('/book/books/%d/' % self.book2.id, {'name': 'changed'}, format='json')
+        self.assertEqual(self.client.get('/book/books/%d/' % self.book1.id)['X-Cache'], 'HIT')
+        response = self.client.get('/book/books/%d/' % self.book2.id)
+        self.assertEqual((response['X-Cache'], response.data['name']), ('MISS', 'changed'))
+        response = self.client.get('/book/books/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([book['name'] for book in response.data['results']], ['book1', 'changed'])
+
+        # 查询参数不同的请求分别缓存
+        self.assertEqual(self.client.get('/book/books/', {'ordering': '-id'})['X-Cache'], 'MISS')
+
+        stats = response_cache.stats()['BookModelView.retrieve']
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+
+    def test_bulk_write_and_person_write_invalidate(self):
+        self.client.get('/book/books/')
+        self.client.post('/book/books/bulk-delete/', {'ids': [self.book1.id]}, format='json')
+        response = self.client.get('/book/books/')
+        self.assertEqual([book['name'] for book in response.data['results']], ['book2'])
+
+        self.client.get('/book/persons/')
+        PersonInfo.objects.create(name='p', book_id=self.book2)
+        self.assertEqual(len(self.client.get('/book/persons/').data['results']), 1)
+
+    def test_single_flight(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return Response({'value': 1})
+
+        cache_ = ResponseCache(poll_interval=0.01)
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(cache_.get_or_compute('v', 'k', compute)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.data for r in responses], [{'value': 1}] * 8)
+        self.assertEqual(cache_.stats()['v']['coalesced'], 7)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = BookInfo.objects.create(name='book1')
+        BookInfo.objects.create(name='book2')
+
+    def test_detail_not_modified_and_if_match(self):
+        url = '/book/books/%d/' % self.book.id
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.put(url, {'name': 'new'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        # 旧ETag再次修改：412，数据不变
+        response = self.client.put(url, {'name': 'lost'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(BookInfo.objects.get(id=self.book.id).name, 'new')
+
+    def test_update_conflict_between_read_and_write(self):
+        book = BookInfo.objects.get(id=self.book.id)
+        BookInfo.objects.get(id=self.book.id).save()
+        response = save_if_unmodified(book, {'name': 'stale'})
+        self.assertEqual(response.status_code, 412)
+
+        view = viewsBasics.BookDRFView.as_view()
+        request = RequestFactory().put('/', json.dumps({'name': 'drf'}), content_type='application/json',
+                                       HTTP_IF_MATCH='"stale"')
+        self.assertEqual(view(request, pk=book.id).status_code, 412)
+        request = RequestFactory().put('/', json.dumps({'name': 'drf'}), content_type='application/json')
+        self.assertEqual(view(request, pk=book.id).status_code, 200)
+        self.assertEqual(BookInfo.objects.get(id=book.id).name, 'drf')
+
+    def test_list_changes_on_update_and_delete(self):
+        etag = self.client.get('/book/books/')['ETag']
+        self.assertEqual(self.client.get('/book/books/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/book/books/', {'page_size': 1}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        BookInfo.objects.filter(id=self.book.id).soft_delete()
+        response = self.client.get('/book/books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.client.post('/book/books/bulk/', [{'name': 'book3'}], format='json')
+        response = self.client.get('/book/books/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # DELETE为逻辑删除
+        book = BookInfo.objects.get(name='book3')
+        self.assertEqual(self.client.delete('/book/books/%d/' % book.id).status_code, 204)
+        self.assertTrue(BookInfo.all_objects.get(id=book.id).is_delete)
+        self.assertEqual(self.client.get('/book/books/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class CustomRendererTestCase(TestCase):
+    context = {'view': None, 'request': None, 'response': None}
+
+    def test_backends_match_drf_output(self):
+        data = {
+            'msg': 'ok', 'code': 201, 'results': [{
+                'name': '书\u2028', 'pub_date': datetime.date(2020, 1, 2),
+                'updated_at': datetime.datetime(2020, 1, 2, 3, 4, 5, 678, tzinfo=datetime.timezone.utc),
+                'price': decimal.Decimal('1.5'), 'uuid': uuid.UUID(int=1), 'lazy': gettext_lazy('name'),
+            }],
+        }
+        expected = JSONRenderer().render({'msg': 'ok', 'code': 201, 'data': {'list': {'results': data['results']}, 'total': 1}})
+        for backend in JSON_BACKENDS:
+            renderer = CustomRenderer()
+            renderer.json_backend = backend
+            self.assertEqual(renderer.render(data, 'application/json', self.context), expected, backend)
+        # 不修改视图返回的数据
+        self.assertEqual(data['msg'], 'ok')
+
+    def test_status_envelope_and_list(self):
+        renderer = CustomRenderer()
+        ret = json.loads(renderer.render({'status': 1, 'msg': 'm', 'data': [1, 2]}, 'application/json', self.context))
+        self.assertEqual(ret, {'msg': 'm', 'code': 200, 'data': {'list': [1, 2], 'total': 2}})
+        ret = json.loads(renderer.render([1, 2, 3], 'application/json', self.context))
+        self.assertEqual(ret['data']['total'], 3)
+        self.assertIn(b'\n    "msg"', renderer.render([1], 'application/json; indent=4', self.context))
+
+
+class CompiledSerializerTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            book = BookInfo.objects.create(name='书%d' % i, pub_date=datetime.date(2020, 1, i + 1) if i % 2 else None,
+                                           read_count=i, is_delete=i == 4)
+            PersonInfo.objects.create(name='人%d' % i, book_id=book, gender=i % 2, description=None if i else '描述')
+
+    def test_output_matches_drf(self):
+        for serializer_class in (BookInfoModelSerializer, PersonInfoModelSerializer):
+            compiled = compile_serializer(serializer_class)
+            model = serializer_class.Meta.model
+            queryset = model.all_objects.order_by('id')
+            expected = json.loads(JSONRenderer().render(serializer_class(queryset, many=True).data))
+            actual = json.loads(JSONRenderer().render(compiled.many(queryset.values(*compiled.columns))))
+            self.assertEqual(actual, expected)
+            self.assertEqual(list(actual[0]), list(expected[0]))
+
+    def test_custom_output_is_not_compiled(self):
+        class MethodSerializer(BookInfoModelSerializer):
+            extra = serializers.SerializerMethodField()
+
+            class Meta(BookInfoModelSerializer.Meta):
+                fields = BookInfoModelSerializer.Meta.fields + ('extra',)
+
+            def get_extra(self, obj):
+                return 1
+
+        class OverrideSerializer(BookInfoModelSerializer):
+            def to_representation(self, instance):
+                return super().to_representation(instance)
+
+        for serializer_class in (MethodSerializer, OverrideSerializer):
+            self.assertIsNone(compile_serializer(serializer_class))
+
+    def test_list_endpoint_uses_values(self):
+        client = APIClient()
+        response = client.get('/book/books/', {'ordering': '-pub_date', 'page_size': 2})
+        # 编译的函数输出普通dict，DRF序列化器输出OrderedDict
+        self.assertIs(type(response.data['results'][0]), dict)
+        self.assertEqual([b['name'] for b in response.data['results']], ['书3', '书1'])
+        response = client.get(response.data['next'])
+        self.assertEqual([b['name'] for b in response.data['results']], ['书2', '书0'])
+        self.assertEqual(client.get('/book/persons/').data['results'][0]['book_id'], BookInfo.all_objects.get(name='书0').id)
+
+
+# 异步视图的查询在线程池中执行，使用另外的数据库连接，测试数据需要真正提交
+class AsyncViewTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        # 自动提交，搜索索引在提交后随即建立
+        for i in range(3):
+            BookInfo.objects.create(name='射雕%d' % i, read_count=i)
+
+    async def test_list_detail_search_match_sync_views(self):
+        client = AsyncClient()
+        # Django 3.2的AsyncClient不会把data参数放进查询字符串，直接写在路径中
+        response = await client.get('/book/async/books/?ordering=-read_count&page_size=2')
+        data = json.loads(response.content)
+        expected = await sync_to_async(lambda: APIClient().get('/book/books/', {'ordering': '-read_count', 'page_size': 2}))()
+        self.assertEqual(data['results'], json.loads(expected.content)['results'])
+        self.assertIn('cursor=', data['next'])
+
+        book = data['results'][0]
+        response = await client.get('/book/async/books/%d/' % book['id'])
+        self.assertEqual(json.loads(response.content), book)
+        self.assertEqual((await client.get('/book/async/books/999999/')).status_code, 404)
+
+        response = await client.get('/book/async/books/search/?q=%E5%B0%84%E9%9B%95')
+        self.assertEqual(len(json.loads(response.content)['results']), 3)
+
+    def test_middleware_is_async_capable(self):
+        # 只要有一个同步的中间件，ASGI下整个中间件链和视图都在同一个线程中执行，异步接口失去并发
+        sync_only = [path for path in settings.MIDDLEWARE if not getattr(import_string(path), 'async_capable', False)]
+        self.assertEqual(sync_only, [])
+
+    async def test_concurrent_requests_overlap(self):
+        # 每条SQL等待0.2秒(模拟网络往返)；按实际的MIDDLEWARE，4个并发请求的总耗时应接近一个请求而不是4个
+        execute = CursorWrapper._execute_with_wrappers
+
+        def slow(self, *args, **kwargs):
+            time.sleep(0.2)
+            return execute(self, *args, **kwargs)
+
+        client = AsyncClient()
+        book_ids = await sync_to_async(self.book_ids)()
+        with mock.patch.object(CursorWrapper, '_execute_with_wrappers', slow):
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[client.get('/book/async/books/%d/' % book_id) for book_id in book_ids])
+            elapsed = time.perf_counter() - start
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertLess(elapsed, 0.6)
+
+    def book_ids(self):
+        return list(BookInfo.objects.values_list('id', flat=True)) + [BookInfo.objects.first().id]
+
+
+class ConnectionPoolTestCase(TestCase):
+    def make_pool(self, **options):
+        return ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False),
+                              lambda conn: conn.execute('SELECT 1'), **options)
+
+    def test_reuse_overflow_and_timeout(self):
+        pool = self.make_pool(max_size=1, max_overflow=1, timeout=0.05)
+        a = pool.acquire()
+        pool.release(a)
+        self.assertIs(pool.acquire(), a)
+        b = pool.acquire()
+        # 常驻1个 + 溢出1个都在使用，等待超时
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        pool.release(a)
+        pool.release(b)
+        # 溢出的连接归还时关闭
+        stats = pool.stats()
+        self.assertEqual((stats['size'], stats['idle'], stats['in_use']), (1, 1, 0))
+        self.assertEqual((stats['created'], stats['reused'], stats['closed'], stats['timeouts']), (2, 1, 1, 1))
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.make_pool(max_size=1, max_overflow=0, timeout=5)
+        a = pool.acquire()
+        got = []
+        t = threading.Thread(target=lambda: got.append(pool.acquire()))
+        t.start()
+        time.sleep(0.05)
+        pool.release(a)
+        t.join()
+        self.assertEqual(got, [a])
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_expired_and_broken_connections_are_replaced(self):
+        pool = self.make_pool(idle_timeout=60, ping_interval=0)
+        a = pool.acquire()
+        pool.release(a)
+        a.close()
+        # ping失败，丢弃后新建
+        b = pool.acquire()
+        self.assertIsNot(b, a)
+        self.assertEqual(pool.stats()['ping_failures'], 1)
+        pool.release(b)
+        with mock.patch('book.db.pool.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNot(pool.acquire(), b)
+        self.assertEqual(pool.stats()['expired'], 1)
+
+    def test_slow_ping_does_not_block_other_threads(self):
+        pinging, release = threading.Event(), threading.Event()
+        slow = []
+
+        def ping(conn):
+            if conn in slow:
+                pinging.set()
+                release.wait(5)
+            conn.execute('SELECT 1')
+
+        pool = ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), ping,
+                              max_size=2, max_overflow=0, ping_interval=0)
+        a, b = pool.acquire(), pool.acquire()
+        slow.append(b)
+        pool.release(a)
+        pool.release(b)
+        thread = threading.Thread(target=pool.acquire)
+        thread.start()
+        pinging.wait(5)
+        # 另一个线程正在ping连接b，本线程仍能立即取到a
+        start = time.monotonic()
+        self.assertIs(pool.acquire(), a)
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        thread.join()
+
+    def test_pooled_backend_returns_connection_on_close(self):
+        fd, name = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, name)
+        settings_dict = dict(connection.settings_dict, NAME=name, CONN_MAX_AGE=0, POOL={'MAX_SIZE': 2})
+        first = PooledSQLiteWrapper(settings_dict, 'pool_test')
+        first.ensure_connection()
+        raw = first.connection
+        with first.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x integer)')
+        # 未提交的事务在归还时回滚
+        first.set_autocommit(False)
+        with first.cursor() as cursor:
+            cursor.execute('INSERT INTO t VALUES (1)')
+        first.close()
+        self.assertIsNone(first.connection)
+
+        # 其他线程的连接对象(Django每个线程一个)取到同一个物理连接
+        second = PooledSQLiteWrapper(settings_dict, 'pool_test')
+        second.ensure_connection()
+        self.assertIs(second.connection, raw)
+        with second.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM t')
+            self.assertEqual(cursor.fetchone(), (0,))
+        second.close()
+        self.assertEqual(second.pool.stats()['reused'], 1)
+        second.pool.close_all()
+
+
+# 两个SQLite文件作为只读副本：表结构相同，数据不同，从查出的数据判断读的是哪个库
+# 不用TestCase：测试事务中的查询都会走主库
+class ReplicaRouterTestCase(TransactionTestCase):
+    aliases = ('replica_a', 'replica_b')
+
+    def setUp(self):
+        cache.clear()
+        BookInfo.objects.create(name='default')
+        for alias in self.aliases:
+            fd, name = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            self.addCleanup(os.remove, name)
+            connections.databases[alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+            self.addCleanup(connections.databases.pop, alias)
+            self.addCleanup(connections.__delitem__, alias)
+            self.addCleanup(lambda alias=alias: connections[alias].close())
+            with connections[alias].schema_editor() as editor:
+                editor.create_model(BookInfo)
+            BookInfo.objects.using(alias).bulk_create([BookInfo(name=alias)])
+        patcher = mock.patch('book.db.routers.replicas', ReplicaSet(self.aliases))
+        self.replicas = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def view(request):
+            if request.GET.get('write'):
+                BookInfo.objects.create(name='written')
+            if request.GET.get('session'):
+                # 其他应用的写入(会话、令牌)
+                SessionStore().save()
+            names = [','.join(BookInfo.objects.values_list('name', flat=True)) for _ in range(int(request.GET.get('n', 1)))]
+            return http.HttpResponse('|'.join(names))
+        self.middleware = ReplicaRoutingMiddleware(view)
+        self.factory = RequestFactory()
+
+    def read(self, method='get', path='/', **cookies):
+        request = getattr(self.factory, method)(path)
+        request.COOKIES.update(cookies)
+        response = self.middleware(request)
+        return response.content.decode(), response
+
+    def test_round_robin_and_unsafe_methods(self):
+        self.assertEqual([self.read()[0] for _ in range(3)], ['replica_a', 'replica_b', 'replica_a'])
+        self.assertEqual(self.read('post')[0], 'default')
+        # 请求之外(命令、后台线程)都读主库
+        self.assertEqual(list(BookInfo.objects.values_list('name', flat=True)), ['default'])
+
+    def test_read_your_writes(self):
+        content, response = self.read(path='/?write=1')
+        self.assertEqual(content, 'default,written')
+        cookie = response.cookies['db_primary_until']
+        self.assertEqual(self.read(db_primary_until=cookie.value)[0], 'default,written')
+        # 过期的Cookie不再读主库
+        self.assertIn(self.read(db_primary_until=str(time.time() - 1))[0], self.aliases)
+        # 读主库的时间覆盖副本可能的最大延迟
+        self.assertGreaterEqual(cookie['max-age'], 15)
+
+    def test_one_replica_per_request(self):
+        self.assertEqual(self.read(path='/?n=4')[0], '|'.join(['replica_a'] * 4))
+        self.assertEqual(self.read(path='/?n=4')[0], '|'.join(['replica_b'] * 4))
+
+    def test_other_app_writes_do_not_pin(self):
+        content, response = self.read(path='/?session=1')
+        self.assertIn(content, self.aliases)
+        self.assertNotIn('db_primary_until', response.cookies)
+
+    def test_async_get_response(self):
+        async def view(request):
+            names = await sync_to_async(lambda: list(BookInfo.objects.values_list('name', flat=True)),
+                                        thread_sensitive=False)()
+            return http.HttpResponse(','.join(names))
+
+        middleware = ReplicaRoutingMiddleware(view)
+        response = async_to_sync(middleware)(self.factory.get('/'))
+        self.assertIn(response.content.decode(), self.aliases)
+
+    def test_unhealthy_replica_and_least_lag(self):
+        lags = {'replica_a': 30, 'replica_b': 1}
+        with mock.patch('book.db.routers.replica_lag', side_effect=lambda c: lags[c.alias]):
+            self.assertEqual({self.read()[0] for _ in range(3)}, {'replica_b'})
+        self.replicas._health.clear()
+        with mock.patch('book.db.routers.replica_lag', side_effect=DatabaseError):
+            self.assertEqual(self.read()[0], 'default')
+        self.assertEqual(self.replicas.stats()['reads']['fallback'], 1)
+
+        self.replicas._health.clear()
+        self.replicas.strategy = 'least_lag'
+        lags = {'replica_a': 2, 'replica_b': 0}
+        with mock.patch('book.db.routers.replica_lag', side_effect=lambda c: lags[c.alias]):
+            self.assertEqual({self.read()[0] for _ in range(3)}, {'replica_b'})
+
+    def test_list_endpoint_reads_replica(self):
+        response = APIClient().get('/book/books/')
+        self.assertIn(response.data['results'][0]['name'], self.aliases)
+
+
+class PerformanceMiddlewareTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        for i in range(3):
+            BookInfo.objects.create(name='书%d' % i)
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get('/book/books/')
+        timing = dict(item.split(';', 1) for item in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'db', 'serialize', 'render', 'total'})
+        self.assertRegex(timing['db'], r'dur=[\d.]+;desc="[1-9]\d* queries"')
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('booklib_request_duration_seconds_count{view="BookModelView.list"} 1', metrics)
+        self.assertIn('booklib_render_duration_seconds_bucket{view="BookModelView.list",le="+Inf"} 1', metrics)
+        # /metrics自身不统计
+        self.assertNotIn('metrics_view', metrics)
+
+    def test_render_time_with_default_renderers(self):
+        # 使用DRF默认的渲染器(未配置FastJSONRenderer)时也统计渲染耗时
+        self.assertNotIn('DEFAULT_RENDERER_CLASSES', settings.REST_FRAMEWORK)
+        for path in ('/book/books/', '/book/persons/'):
+            response = self.client.get(path)
+            timing = dict(item.split(';', 1) for item in response['Server-Timing'].split(', '))
+            self.assertGreater(float(timing['render'][len('dur='):]), 0, path)
+            # 渲染后恢复类的render方法
+            self.assertNotIn('render', vars(response))
+
+    async def test_render_time_under_asgi(self):
+        response = await AsyncClient().get('/book/books/')
+        render = response['Server-Timing'].split('render;dur=')[1].split(',')[0]
+        self.assertGreater(float(render), 0)
+
+    def test_metrics_requires_allowed_ip_or_staff(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9').status_code, 403)
+        self.client.force_login(User.objects.create_user(username='ops', password='x', is_staff=True))
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9').status_code, 200)
+
+    async def test_async_get_response(self):
+        async def view(request):
+            await sync_to_async(lambda: list(BookInfo.objects.all()))()
+            return http.HttpResponse('ok')
+
+        response = await PerformanceMiddleware(view)(RequestFactory().get('/'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+
+    def test_n_plus_one_logged(self):
+        def view(request):
+            for book in BookInfo.objects.all():
+                for _ in range(4):
+                    BookInfo.objects.filter(pk=book.pk).exists()
+            return http.HttpResponse('ok')
+
+        with self.assertLogs('BookLib.utils.perfMiddleware', 'WARNING') as logs:
+            PerformanceMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('12 x SELECT', logs.output[0])
+        self.assertEqual(registry.n_plus_one['unresolved'], 1)
+
+    def test_sql_shape(self):
+        self.assertEqual(sql_shape('SELECT * FROM t WHERE id IN (%s, %s, %s) AND x = %s'),
+                         'SELECT * FROM t WHERE id IN (...) AND x = %s')
+
+
+class ThrottleStoreTestCase(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'throttle.sqlite3')
+        self.store = ThrottleStore(self.path)
+
+    def test_token_bucket(self):
+        now = 1000.0
+        self.assertEqual([self.store.consume('k', 3, 1.0, now)[0] for _ in range(3)], [True] * 3)
+        allowed, wait = self.store.consume('k', 3, 1.0, now)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1.0)
+        # 1.5秒补充1.5个令牌
+        self.assertEqual([self.store.consume('k', 3, 1.0, now + 1.5)[0] for _ in range(2)], [True, False])
+        # 其他key不受影响
+        self.assertTrue(self.store.consume('other', 3, 1.0, now)[0])
+
+    def test_shared_between_store_instances(self):
+        # 每个进程各自打开同一个文件
+        other = ThrottleStore(self.path)
+        self.assertTrue(self.store.consume('k', 2, 0.001, 1000.0)[0])
+        self.assertTrue(other.consume('k', 2, 0.001, 1000.0)[0])
+        self.assertFalse(self.store.consume('k', 2, 0.001, 1000.0)[0])
+
+    def test_unavailable_store_fails_open(self):
+        # 目录不存在(不可写)
+        store = ThrottleStore(os.path.join(self.path, 'missing', 'throttle.sqlite3'))
+        with self.assertLogs('book.throttling', 'WARNING'):
+            self.assertEqual(store.consume('k', 1, 1.0), (True, 0))
+        # 其他连接长时间持有写锁
+        store = ThrottleStore(self.path, timeout=0.05)
+        store.consume('k', 1, 0.001, 1000.0)
+        locker = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(locker.close)
+        locker.execute('BEGIN EXCLUSIVE')
+        with self.assertLogs('book.throttling', 'WARNING'):
+            self.assertEqual(store.consume('k', 1, 0.001, 1000.0), (True, 0))
+        locker.execute('ROLLBACK')
+        self.assertFalse(store.consume('k', 1, 0.001, 1000.0)[0])
+
+
+# SQLite 3.35之前没有RETURNING：同样的用例走事务中的INSERT OR IGNORE、UPDATE、SELECT
+class ThrottleStoreWithoutReturningTestCase(ThrottleStoreTestCase):
+    def setUp(self):
+        patcher = mock.patch('book.throttling.RETURNING_SUPPORTED', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+        self.assertFalse(self.store.returning)
+
+    def test_scoped_throttle_on_view(self):
+        class Throttle(BucketScopedRateThrottle):
+            store = self.store
+            THROTTLE_RATES = {'contacts': '2/min'}
+
+        class View(viewsBasics.APIView):
+            throttle_classes = (Throttle,)
+            throttle_scope = 'contacts'
+
+            def get(self, request):
+                return Response('ok')
+
+        view = View.as_view()
+        statuses = [view(APIRequestFactory().get('/')).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(int(view(APIRequestFactory().get('/'))['Retry-After']), 30)
+
+
+class BookStatsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book1 = BookInfo.objects.create(name='射雕英雄传', read_count=5)
+        self.book2 = BookInfo.objects.create(name='天龙八部', read_count=9)
+        self.guo = PersonInfo.objects.create(name='郭靖', book_id=self.book1)
+        PersonInfo.objects.create(name='黄蓉', gender=1, book_id=self.book1)
+        PersonInfo.objects.create(name='乔峰', book_id=self.book2)
+
+    def counts(self, book):
+        return tuple(BookStats.objects.filter(book_id=book.id).values_list('character_count', 'male_count', 'female_count').first() or ())
+
+    def test_incremental_updates(self):
+        # 新增人物在同一事务中累加，不等提交
+        self.assertEqual(self.counts(self.book1), (2, 1, 1))
+        self.assertEqual(self.counts(self.book2), (1, 1, 0))
+
+        # 人物换书、改性别、逻辑删除：提交后两本书都重新统计
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guo.book_id = self.book2
+            self.guo.gender = 1
+            self.guo.save()
+        self.assertEqual(self.counts(self.book1), (1, 0, 1))
+        self.assertEqual(self.counts(self.book2), (2, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guo.is_delete = True
+            self.guo.save(update_fields=['is_delete', 'updated_at'])
+        self.assertEqual(self.counts(self.book2), (1, 1, 0))
+
+        # 书籍逻辑删除后没有统计行
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/book/books/%d/' % self.book1.id)
+        self.assertEqual(self.counts(self.book1), ())
+
+    def test_bulk_paths(self):
+        # 批量修改把人物移到另一本书：原书籍也要重新统计
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/book/persons/bulk/', [{'id': self.guo.id, 'book_id': self.book2.id}],
+                                         format='json')
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(self.counts(self.book1), (1, 0, 1))
+        self.assertEqual(self.counts(self.book2), (2, 2, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/book/persons/bulk/', [{'name': '段誉', 'book_id': self.book2.id}], format='json')
+            self.client.post('/book/books/bulk/', [{'name': '神雕侠侣'}], format='json')
+        self.assertEqual(self.counts(self.book2), (3, 3, 0))
+        self.assertEqual(self.counts(BookInfo.objects.get(name='神雕侠侣')), (0, 0, 0))
+
+        # 只修改阅读量不重新统计
+        with mock.patch('book.stats.refresh_book_stats') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch('/book/books/bulk/', [{'id': self.book1.id, 'read_count': 1}], format='json')
+        refresh.assert_not_called()
+
+    def test_rebuild_command(self):
+        BookStats.objects.all().delete()
+        BookInfo.objects.filter(id=self.book2.id).soft_delete()
+        call_command('rebuild_book_stats', stdout=io.StringIO())
+        self.assertEqual(self.counts(self.book1), (2, 1, 1))
+        self.assertEqual(self.counts(self.book2), ())
+
+    def test_stats_endpoint(self):
+        for i in range(3):
+            book = BookInfo.objects.create(name='书%d' % i)
+            for j in range(i + 3):
+                PersonInfo.objects.create(name='人物%d_%d' % (i, j), gender=j % 2, book_id=book)
+        # 统计一次查询、本页书籍一次查询，不连接personinfo
+        with self.assertNumQueries(2):
+            response = self.client.get('/book/books/stats/', {'page_size': 3})
+        self.assertEqual([row['character_count'] for row in response.data['results']], [5, 4, 3])
+        self.assertEqual(response.data['results'][0]['name'], '书2')
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['name'] for row in response.data['results']], ['射雕英雄传', '天龙八部'])
+
+        response = self.client.get('/book/books/stats/', {'ordering': 'character_count', 'min_characters': 2,
+                                                          'max_characters': 4, 'gender': 'female'})
+        self.assertEqual([row['name'] for row in response.data['results']], ['射雕英雄传', '书0', '书1'])
+        self.assertEqual(self.client.get('/book/books/stats/', {'gender': 'x'}).status_code, 400)
+
+        # 书籍列表带上统计，按阅读量排序
+        response = self.client.get('/book/books/', {'ordering': '-read_count', 'with_stats': 1})
+        self.assertEqual([(row['name'], row['character_count']) for row in response.data['results'][:2]],
+                         [('天龙八部', 1), ('射雕英雄传', 2)])
+        self.assertNotIn('character_count', self.client.get('/book/books/').data['results'][0])
+
+    def test_cached_list_follows_stats(self):
+        self.client.get('/book/books/', {'with_stats': 1})
+        PersonInfo.objects.create(name='梅超风', gender=1, book_id=self.book1)
+        response = self.client.get('/book/books/', {'with_stats': 1})
+        self.assertEqual(response.data['results'][0]['female_count'], 2)
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        leaderboard.clear()
+        self.counter = BookCounter(flush_interval=3600, flush_threshold=10 ** 6)
+        self.board = Leaderboard(depth=3, score_weights={'read_count': 1, 'comment_count': 20}, counter=self.counter)
+        self.books = [
+            BookInfo.objects.create(name='book%d' % i, read_count=i * 10, comment_count=5 - i,
+                                    pub_date=datetime.date(1990 + i % 2, 1, 1))
+            for i in range(5)
+        ]
+
+    def names(self, *args, **kwargs):
+        return [row['name'] for row in self.board.top(*args, **kwargs)]
+
+    def test_top_and_incremental_updates(self):
+        self.assertEqual(self.names('read_count', limit=3), ['book4', 'book3', 'book2'])
+        self.assertEqual(self.names('score', limit=2), ['book0', 'book1'])
+        self.assertEqual(self.names('read_count', year=1990), ['book4', 'book2', 'book0'])
+
+        # 榜上书籍的增加直接调整位置，不查询数据库
+        with self.assertNumQueries(0):
+            self.board.incr(self.books[2].id, 'read_count', 25)
+            self.assertEqual(self.names('read_count', limit=3), ['book2', 'book4', 'book3'])
+            self.assertEqual(self.board.top('read_count', limit=1)[0]['read_count'], 45)
+
+        # 榜外书籍超过最后一名：榜单过期，下次请求重新加载(包括尚未落库的增量)
+        self.counter.incr(self.books[1].id, amount=50)
+        self.board.incr(self.books[1].id, 'read_count', 50)
+        self.counter.incr(self.books[2].id, amount=25)
+        self.assertEqual(self.names('read_count', limit=3), ['book1', 'book2', 'book4'])
+        with self.assertNumQueries(0):
+            self.names('read_count', limit=3)
+
+    def load_with(self, during):
+        # 取计数器快照之后、查询之前执行during，模拟加载期间其他线程的计数、刷新
+        snapshot = self.counter.snapshot
+
+        def snapshot_then_run():
+            result = snapshot()
+            during()
+            return result
+
+        def receiver(sender, pk=None, field=None, amount=0, seq=None, **kwargs):
+            self.board.incr(pk, field, amount, seq)
+
+        counter_changed.connect(receiver, sender=BookInfo)
+        self.addCleanup(counter_changed.disconnect, receiver, sender=BookInfo)
+        with mock.patch.object(self.counter, 'snapshot', snapshot_then_run):
+            return self.board.top('read_count', limit=1)[0]
+
+    def test_increments_during_load(self):
+        # book2在榜上(前3名)，快照之后的增加在装上榜单时补上
+        top = self.load_with(lambda: self.counter.incr(self.books[2].id, amount=100))
+        self.assertEqual((top['name'], top['read_count']), ('book2', 120))
+        self.assertEqual(self.board.stats()['stale'], 0)
+
+    def test_flush_during_load_marks_stale(self):
+        def incr_and_flush():
+            self.counter.incr(self.books[2].id, amount=100)
+            self.counter.flush()
+
+        self.load_with(incr_and_flush)
+        # 刷新与查询重叠，结果可能重复计入；榜单过期，下次请求重新加载
+        self.assertEqual(self.board.stats()['stale'], 1)
+        top = self.board.top('read_count', limit=1)[0]
+        self.assertEqual((top['name'], top['read_count']), ('book2', 120))
+
+    def test_endpoint_and_book_changes(self):
+        client = APIClient()
+        response = client.get('/book/books/top/', {'by': 'comment_count', 'limit': 2})
+        self.assertEqual([row['name'] for row in response.data['results']], ['book0', 'book1'])
+        self.assertEqual(response.data['results'][0]['score'], 5)
+
+        # 计数器增加通过counter_changed实时计入
+        self.counter.incr(self.books[3].id, 'comment_count', 10)
+        response = client.get('/book/books/top/', {'by': 'comment_count', 'limit': 1})
+        self.assertEqual(response.data['results'][0]['name'], 'book3')
+
+        # 逻辑删除后重新加载
+        with self.captureOnCommitCallbacks(execute=True):
+            client.delete('/book/books/%d/' % self.books[3].id)
+        response = client.get('/book/books/top/', {'by': 'comment_count', 'limit': 1})
+        self.assertEqual(response.data['results'][0]['name'], 'book0')
+
+        self.assertEqual(client.get('/book/books/top/', {'by': 'x'}).status_code, 400)
+        self.assertEqual(client.get('/book/books/top/', {'year': '-1'}).status_code, 400)
+
+
+class SparseFieldsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = BookInfo.objects.create(name='射雕英雄传', pub_date=datetime.date(1957, 1, 1))
+        PersonInfo.objects.create(name='郭靖', book_id=self.book, description='降龙十八掌')
+        PersonInfo.objects.create(name='黄蓉', gender=1, book_id=self.book)
+
+    def test_fields_push_down_to_values(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/book/books/', {'fields': 'name'})
+        self.assertEqual(response.data['results'], [{'id': self.book.id, 'name': '射雕英雄传'}])
+        # 只查询需要的列(加上分页排序字段)，不查询人物
+        select = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('comment_count', select)
+        self.assertNotIn('personinfo', select)
+        self.assertEqual(len(self.client.get('/book/books/').data['results'][0]), 7)
+
+    def test_expand_prefetches_requested_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/book/books/', {'fields': 'name,personinfo_set.name', 'expand': 'personinfo_set'})
+        self.assertEqual(response.data['results'][0]['personinfo_set'], [{'name': '郭靖'}, {'name': '黄蓉'}])
+        persons = [q['sql'] for q in ctx.captured_queries if 'FROM "personinfo" WHERE' in q['sql']]
+        self.assertEqual(len(persons), 1)
+        self.assertNotIn('description', persons[0])
+
+        response = self.client.get('/book/persons/', {'fields': 'name,book_id.name', 'expand': 'book_id'})
+        self.assertEqual([(row['name'], row['book_id']) for row in response.data['results']],
+                         [('郭靖', {'name': '射雕英雄传'}), ('黄蓉', {'name': '射雕英雄传'})])
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'book_id'})
+
+        response = self.client.get('/book/books/%d/' % self.book.id, {'expand': 'personinfo_set'})
+        self.assertEqual(len(response.data['personinfo_set']), 2)
+
+    def test_invalid_and_cache(self):
+        self.assertEqual(self.client.get('/book/books/', {'fields': 'nme'}).status_code, 400)
+        self.assertEqual(self.client.get('/book/books/', {'expand': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/book/books/', {'fields': 'personinfo_set.name'}).status_code, 400)
+
+        # 展开的人物变化后，缓存的列表随之失效
+        params = {'fields': 'name,personinfo_set.name', 'expand': 'personinfo_set'}
+        self.client.get('/book/books/', params)
+        PersonInfo.objects.create(name='梅超风', gender=1, book_id=self.book)
+        response = self.client.get('/book/books/', params)
+        self.assertEqual(len(response.data['results'][0]['personinfo_set']), 3)
+
+    def test_expanded_book_change_invalidates_person_cache(self):
+        params = {'fields': 'name,book_id.name', 'expand': 'book_id'}
+        detail = '/book/persons/%d/' % PersonInfo.objects.first().id
+        for url in ('/book/persons/', detail):
+            self.client.get(url, params)
+            self.assertEqual(self.client.get(url, params)['X-Cache'], 'HIT')
+        self.book.name = '神雕侠侣'
+        self.book.save()
+        response = self.client.get('/book/persons/', params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['book_id'], {'name': '神雕侠侣'})
+        response = self.client.get(detail, params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['book_id'], {'name': '神雕侠侣'})
+
+
+class BookDocumentTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book = BookInfo.objects.create(name='射雕英雄传', pub_date=datetime.date(1957, 1, 1))
+            self.guo = PersonInfo.objects.create(name='郭靖', book_id=self.book, description='降龙十八掌')
+            PersonInfo.objects.create(name='黄蓉', gender=1, book_id=self.book)
+        self.url = '/book/books/%d/document/' % self.book.id
+
+    def test_document_matches_expanded_detail(self):
+        # 一条主键查询返回存储的文档
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        expanded = self.client.get('/book/books/%d/' % self.book.id, {'expand': 'personinfo_set'})
+        self.assertEqual(json.loads(response.content), json.loads(expanded.content))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_document_follows_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guo.name = '郭靖靖'
+            self.guo.save()
+        names = [person['name'] for person in json.loads(self.client.get(self.url).content)['personinfo_set']]
+        self.assertEqual(names, ['郭靖靖', '黄蓉'])
+
+        # 人物移到另一本书：两本书的文档都重建
+        with self.captureOnCommitCallbacks(execute=True):
+            other = BookInfo.objects.create(name='神雕侠侣')
+            self.client.patch('/book/persons/bulk/', [{'id': self.guo.id, 'book_id': other.id}], format='json')
+        self.assertEqual(len(json.loads(self.client.get(self.url).content)['personinfo_set']), 1)
+        document = json.loads(self.client.get('/book/books/%d/document/' % other.id).content)
+        self.assertEqual([person['name'] for person in document['personinfo_set']], ['郭靖靖'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/book/books/%d/' % self.book.id)
+        self.assertFalse(BookDocument.objects.filter(book_id=self.book.id).exists())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_consistency_check(self):
+        # update()不发送信号，文档不一致
+        PersonInfo.objects.filter(id=self.guo.id).update(name='杨康')
+        with self.assertRaises(CommandError):
+            call_command('check_book_documents', stdout=io.StringIO())
+
+        out = io.StringIO()
+        call_command('check_book_documents', '--fix', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['counts'], {'missing': 0, 'stale': 1, 'orphaned': 0})
+        call_command('check_book_documents', stdout=io.StringIO())
+        self.assertIn('杨康', self.client.get(self.url).content.decode())
+
+        # 没有文档时渲染一份返回，GET不写库；ETag与之后生成的文档相同
+        etag = self.client.get(self.url)['ETag']
+        BookDocument.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('杨康', response.content.decode())
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse([q['sql'] for q in queries if not q['sql'].lstrip().upper().startswith('SELECT')])
+        self.assertFalse(BookDocument.objects.exists())
+        call_command('check_book_documents', '--fix', stdout=io.StringIO())
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # 不存在、已删除的书籍
+        self.assertEqual(self.client.get('/book/books/%d/document/' % (self.book.id + 100)).status_code, 404)
@@ -0,0 +1,140 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, SimpleRateThrottle, UserRateThrottle
+
+logger = logging.getLogger(__name__)
+
+
+# 多进程共享的限流存储
+# DRF自带的限流把每个key的请求时间列表整个存在缓存中，每次请求都读出、截断、插入、整个写回，列表长度就是限流次数(O(n))；
+# 默认的locmem缓存每个进程各存一份，gunicorn开4个worker时实际限额是配置的4倍
+# 这里改为令牌桶：每个key只存(令牌数, 更新时间)两个数，每次请求一条UPSERT语句完成补充令牌、扣减、返回结果(O(1))
+# 存储在本机的SQLite文件(WAL模式)中，同一台机器上的所有worker进程共享限额；多台机器时每台各自计数
+# 桶容量为限流次数，令牌按 次数/周期 的速度补充：'100/day'即最多连续100次，之后平均每864秒恢复1次
+# 限流状态是尽力而为的：存储不可用(文件锁等待超过timeout、目录不可写)时放行并记录日志，不让接口返回500
+
+
+# INSERT ... RETURNING需要SQLite 3.35+(2021)；更早的版本在一个写事务中先补一行、更新、再查询，结果相同
+RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class ThrottleStore:
+    # 先按经过的时间补充令牌(不超过容量)，够1个时扣减并标记allowed
+    # SET中的表达式都使用更新前的值；各进程的时钟可能略有先后，经过的时间不取负数
+    refill = 'MIN(:capacity, tokens + MAX(:now - updated, 0) * :rate)'
+    update_set = ('tokens = {refill} - ({refill} >= 1), updated = MAX(updated, :now), allowed = {refill} >= 1'
+                  .format(refill=refill))
+    # 新key：满桶扣掉1个；已有key按上面更新；一条语句完成
+    consume_sql = (
+        'INSERT INTO throttle (key, tokens, updated, allowed) VALUES (:key, :capacity - 1, :now, 1) '
+        'ON CONFLICT (key) DO UPDATE SET ' + update_set + ' RETURNING tokens, allowed'
+    )
+    # 不支持RETURNING时：新key先插入满桶，再与已有key一样更新、查询
+    fallback_sql = (
+        'INSERT OR IGNORE INTO throttle (key, tokens, updated, allowed) VALUES (:key, :capacity, :now, 0)',
+        'UPDATE throttle SET ' + update_set + ' WHERE key = :key',
+    )
+
+    def __init__(self, path, timeout=1.0, cleanup_probability=0.001):
+        self.path = str(path)
+        self.timeout = timeout
+        self.cleanup_probability = cleanup_probability
+        self.returning = RETURNING_SUPPORTED
+        self._local = threading.local()
+
+    def connection(self):
+        # 每个线程一个连接；fork出的子进程(gunicorn --preload)不能沿用父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # 限流状态丢失最多多放行几次请求，不需要每次提交都刷盘
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS throttle ('
+                         'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER NOT NULL'
+                         ') WITHOUT ROWID')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def consume(self, key, capacity, rate, now=None):
+        # 返回(是否放行, 需要等待的秒数)
+        now = time.time() if now is None else now
+        params = {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}
+        conn = None
+        try:
+            conn = self.connection()
+            if self.returning:
+                tokens, allowed = conn.execute(self.consume_sql, params).fetchone()
+            else:
+                tokens, allowed = self.consume_in_transaction(conn, params)
+            if random.random() < self.cleanup_probability:
+                self.cleanup(now)
+        except sqlite3.OperationalError as e:
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            logger.warning('Throttle store %s unavailable, allowing request: %s', self.path, e)
+            return True, 0
+        if allowed:
+            return True, 0
+        return False, (1 - tokens) / rate
+
+    def consume_in_transaction(self, conn, params):
+        # BEGIN IMMEDIATE一开始就取得写锁，其他进程不能在插入和查询之间修改同一个key
+        conn.execute('BEGIN IMMEDIATE')
+        for sql in self.fallback_sql:
+            conn.execute(sql, params)
+        row = conn.execute('SELECT tokens, allowed FROM throttle WHERE key = :key', params).fetchone()
+        conn.execute('COMMIT')
+        return row
+
+    def cleanup(self, now=None):
+        # 令牌已经补满的key与不存在没有区别，删除后表的大小只与最近活跃的key数有关
+        # 不知道每个key的容量和速度，按最长的周期(1天)判断
+        now = time.time() if now is None else now
+        self.connection().execute('DELETE FROM throttle WHERE updated < ?', (now - 86400,))
+
+    def reset(self):
+        self.connection().execute('DELETE FROM throttle')
+
+
+throttle_store = ThrottleStore(
+    path=settings.THROTTLE_STORE['PATH'],
+    timeout=settings.THROTTLE_STORE['TIMEOUT'],
+)
+
+
+# 令牌桶限流：替换SimpleRateThrottle中读写缓存的部分，key、速率的配置方式不变
+class TokenBucketRateThrottle(SimpleRateThrottle):
+    store = throttle_store
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self._wait = self.store.consume(self.key, self.num_requests, self.num_requests / self.duration,
+                                                 now=self.timer())
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+# 继承顺序：ScopedRateThrottle.allow_request先按视图的throttle_scope确定速率，再调用父类(令牌桶)的allow_request
+class BucketAnonRateThrottle(AnonRateThrottle, TokenBucketRateThrottle):
+    pass
+
+
+class BucketUserRateThrottle(UserRateThrottle, TokenBucketRateThrottle):
+    pass
+
+
+class BucketScopedRateThrottle(ScopedRateThrottle, TokenBucketRateThrottle):
+    pass
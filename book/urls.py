@@ -1,5 +1,5 @@
 from django.urls import path, re_path
-from book import viewsBasics, viewsAuth
+from book import viewsBasics, viewsAuth, viewsAsync
 from rest_framework.routers import SimpleRouter, DefaultRouter
 
 from rest_framework.authtoken.views import obtain_auth_token
@@ -34,9 +34,22 @@ urlpatterns = [
     path('drf-token-auth/', obtain_auth_token),
     # 基于obtain_auth_token自定义view
     path('custom-drf-token-auth/', viewsAuth.CustomDRFObtainAuthToken.as_view()),
+    # token认证缓存命中统计
+    path('token-cache-stats/', viewsAuth.TokenCacheStatsView.as_view()),
+    # 响应缓存命中统计
+    path('response-cache-stats/', viewsAuth.ResponseCacheStatsView.as_view()),
+    # 数据库连接池统计
+    path('db-pool-stats/', viewsAuth.DBPoolStatsView.as_view()),
+    # 只读副本统计
+    path('db-replica-stats/', viewsAuth.DBReplicaStatsView.as_view()),
     # 基于DRF的 jwt auth
     path('drf-jwt-auth/', obtain_jwt_token),
 
+    # 异步只读接口，部署在ASGI下(BookLib/asgi.py)
+    path('async/books/', viewsAsync.book_list),
+    path('async/books/search/', viewsAsync.book_search),
+    path('async/books/<int:pk>/', viewsAsync.book_detail),
+
 ]
 
 # 使用Routers来帮助我们快速实现路由信息：必须配合视图集使用
@@ -57,3 +70,9 @@ urlpatterns = [
 
 # DefaultRouter继承自SimpleRouter：增加了根路径首页匹配(SimpleRouter没有)
 # router2 = DefaultRouter()
+
+# 书籍、人物视图集(键集分页、批量写入、阅读量)
+router = DefaultRouter()
+router.register('books', viewsBasics.BookModelView, basename='books')
+router.register('persons', viewsBasics.PersonModelView, basename='persons')
+urlpatterns += router.urls
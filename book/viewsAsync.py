@@ -0,0 +1,90 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django import http
+from django.db import close_old_connections
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from BookLib.utils.customDRFRenderer import FastJSONRenderer
+from book.compiled_serializer import compile_serializer
+from book.models import BookInfo
+from book.search import search_books
+from book.serializer import BookInfoModelSerializer
+from book.viewsBasics import KeysetPagination
+
+
+# 异步(ASGI原生)只读接口
+# 同步视图在ASGI下，整个请求(中间件之后的视图、序列化、渲染)都被sync_to_async放进同一个线程里串行执行，并发没有收益
+# 异步视图运行在事件循环上，只有数据库查询 + 序列化这一段放到线程池里，多个请求的查询可以并行，等待期间不占用事件循环
+# Django 3.2没有异步ORM(aget、aiterator、acount在4.1才加入)，数据库驱动也是同步的，这里用线程池执行查询；
+# 升级到4.1+后可以把run_in_db_thread里的查询换成aget/aiterator，接口不变
+# 线程池大小由asgiref的ASGI_THREADS环境变量控制
+
+renderer = FastJSONRenderer()
+compiled_book = compile_serializer(BookInfoModelSerializer)
+
+
+# 在线程池中执行数据库操作：不绑定到同一个线程(thread_sensitive=False)才能并行；
+# 前后各关闭一次过期连接，和同步请求开始、结束时的处理一致，线程池中的连接不会一直保持
+def run_in_db_thread(func):
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(inner, thread_sensitive=False)
+
+
+def render(data, status=200):
+    return http.HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+
+@run_in_db_thread
+def query_book_page(request):
+    # 复用键集分页：排序、游标、next/previous链接与同步接口一致
+    paginator = KeysetPagination()
+    queryset = BookInfo.objects.values(*set(compiled_book.columns) | set(paginator.ordering_fields))
+    page = paginator.paginate_queryset(queryset, Request(request))
+    return paginator.get_paginated_response(compiled_book.many(page)).data
+
+
+@run_in_db_thread
+def query_book(pk):
+    return BookInfo.objects.filter(pk=pk).values(*compiled_book.columns).first()
+
+
+@run_in_db_thread
+def query_search(query, limit):
+    return search_books(query, limit=limit)
+
+
+# GET /book/async/books/?ordering=-read_count&page_size=20&cursor=...
+async def book_list(request):
+    try:
+        data = await query_book_page(request)
+    except NotFound as exc:
+        return render({'detail': exc.detail}, status=404)
+    return render(data)
+
+
+# GET /book/async/books/<pk>/
+async def book_detail(request, pk):
+    row = await query_book(pk)
+    if row is None:
+        return render({'detail': '未找到'}, status=404)
+    return render(compiled_book.row(row))
+
+
+# GET /book/async/books/search/?q=射雕&limit=20
+async def book_search(request):
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return render({'q': ['需要提供搜索内容']}, status=400)
+    try:
+        limit = max(min(int(request.GET.get('limit', 20)), 100), 1)
+    except ValueError:
+        return render({'limit': ['需要整数']}, status=400)
+    return render({'q': query, 'results': await query_search(query, limit)})
@@ -2,19 +2,31 @@ from django import http
 from django.core.handlers.wsgi import WSGIRequest
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import Throttled
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from book.auth.authentication import token_cache
+from book.auth.hashing import HashingPoolFull, hashing_pool
+from book.db.pool import pool_stats
+from book.db.routers import replicas
 from book.models import User
+from book.response_cache import response_cache
 
 
 def register(request: WSGIRequest):
     username = request.POST.get('username')
     password = request.POST.get('password')
-    if User.objects.filter(username=username):
+    if User.all_objects.filter(username=username).exists():
         return http.JsonResponse({'msg': 'username is Duplicated ...'})
-    user = User.objects.create_user(username=username, password=password)
+    # 密码哈希在有上限的线程池中计算，池满时返回429，不让注册高峰占满worker
+    try:
+        encoded = hashing_pool.make_password(password)
+    except HashingPoolFull:
+        return http.JsonResponse({'msg': 'server is busy, retry later ...'}, status=429)
+    user = User(username=User.normalize_username(username), password=encoded)
+    user.save()
     return http.JsonResponse({'id': user.id})
 
 
@@ -44,6 +56,7 @@ class CustomDRFObtainAuthToken(ObtainAuthToken):
     # 重写post方法
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data, context={'request': request})
+        # 认证后端在哈希线程池中校验密码，池满时抛出HashingPoolFull(Throttled)，返回429
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
@@ -54,6 +67,39 @@ class CustomDRFObtainAuthToken(ObtainAuthToken):
             'email': user.email
         })
 
+
+# Token认证缓存命中情况
+class TokenCacheStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(token_cache.stats())
+
+
+# 响应缓存命中统计(按视图)
+class ResponseCacheStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(response_cache.stats())
+
+
+# 数据库连接池的使用情况：每个数据库的连接数、空闲数、复用次数、等待和超时次数
+class DBPoolStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(pool_stats())
+
+
+# 只读副本的健康状态、延迟和读请求分布
+class DBReplicaStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(replicas.stats())
+
+
 # 2. 第三方包djangorestframework-jwt
 # 依赖PyJWT包，提供了JWT的视图操作，安装后，无需在Django注册，只需定义好路由path，映射controller到djangorestframework-jwt中的obtain_jwt_token即可
 
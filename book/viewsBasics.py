@@ -1,10 +1,32 @@
+import base64
+import functools
 import json
+from collections import OrderedDict
 from datetime import datetime
 from django import http
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection, connections
+from django.db.models import Max, Q
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views import View
-from book.models import BookInfo
-from book.serializer import BookInfoSerializer, PersonInfoSerializer
+from book.bulk import BulkWriter
+from book.compiled_serializer import CompiledListMixin
+from book.conditional import ConditionalRequestMixin, check_if_match, instance_etag, latest, save_if_unmodified
+from book.counters import book_counter
+from book.documents import document_etag, fetch_document, render_documents
+from book.export import iter_books, iter_csv, iter_ndjson
+from book.importer import READERS, BookImporter, ImportFileError, decode_lines
+from book.leaderboard import leaderboard
+from book.models import BookInfo, BookStats, PersonInfo
+from book.response_cache import CachedResponseMixin
+from book.search import search_books
+from book.sparse_fields import SparseFieldsMixin
+from book.stats import STATS_FIELDS, attach_book_stats
+from book.serializer import BookInfoSerializer, PersonInfoSerializer, BookInfoModelSerializer, PersonInfoModelSerializer, setup_eager_loading
+from book.throttling import BucketAnonRateThrottle, BucketScopedRateThrottle, BucketUserRateThrottle
 
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action
@@ -18,7 +40,10 @@ from rest_framework.views import APIView, exception_handler
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle, ScopedRateThrottle
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework import status
+from rest_framework.utils.urls import replace_query_param
 
 
 
@@ -96,11 +121,18 @@ class BookDRFView(View):
             book = BookInfo.objects.get(id=pk)
         except Exception:
             return http.JsonResponse({'error': '错误'}, status=400)
-        s = BookInfoSerializer(book, data=data)
-        s.is_valid()
-
-        # 更新数据
-        s.save()
+        # 乐观锁：If-Match与当前ETag不一致时返回412
+        response = check_if_match(request, book)
+        if response is not None:
+            return response
+        s = BookInfoModelSerializer(book, data=data, partial=True)
+        if not s.is_valid():
+            return http.JsonResponse(s.errors, status=400)
+
+        # 更新数据：只有读取之后没有被其他请求修改过才写入，否则返回412
+        response = save_if_unmodified(book, s.validated_data)
+        if response is not None:
+            return response
         # try:
         #     book = BookInfo.objects.get(id=pk)
         # except Exception:
@@ -113,7 +145,9 @@ class BookDRFView(View):
 
         # 返回结果
         # return http.JsonResponse({'id': book.id, 'name': book.name, 'pub_date': book.pub_date, 'read_count': book.read_count, 'comment_count': book.comment_count})
-        return http.JsonResponse(s.data)
+        response = http.JsonResponse(s.data)
+        response['ETag'] = instance_etag(book.pk, book.updated_at)
+        return response
 
     def delete(self, request, pk):
         try:
@@ -121,7 +155,7 @@ class BookDRFView(View):
         except Exception:
             return http.JsonResponse({'error': '错误'})
         book.is_delete = True
-        book.save()
+        book.save(update_fields=['is_delete', 'updated_at'])      # 只更新逻辑删除字段，不重写整行
         return http.JsonResponse({'msg': 'OK'})
 
 
@@ -141,7 +175,7 @@ class BookAPIView(APIView):
         # 获取查询字符串
         query_params = request.query_params
 
-        books = BookInfo.objects.all()
+        books = setup_eager_loading(BookInfo.objects.all(), BookInfoSerializer)
 
         s = BookInfoSerializer(books, many=True)
 
@@ -255,19 +289,74 @@ class BookGenericAPIView(GenericAPIView):
 
 
 
+# 列表视图预加载：根据序列化器声明的嵌套关联自动prefetch_related，避免N+1查询
+# 与SparseFieldsMixin一起使用时放在它前面：它按需生成的Prefetch(只取需要的列)先生效，这里同名的查找会被跳过
+class PrefetchNestedMixin:
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return setup_eager_loading(queryset, self.get_serializer_class())
+
+
 # 五个扩展类：继承自object
 # ListModelMixin列表视图扩展类，提供list(request, *args, **kwargs)方法快速实现列表视图，返回200状态码。  该Mixin的list方法会对数据进行过滤和分页(若指定了过滤分页)
 # CreateModelMixin创建视图扩展类，提供create(request, *args, **kwargs)方法快速实现创建资源的视图，成功返回201状态码。如果序列化器对前端发送的数据验证失败，返回400错误
 # RetrieveModelMixin详情视图扩展类，提供retrieve(request, *args, **kwargs)方法，可以快速实现返回一个存在的数据对象。如果存在，返回200， 否则返回404
 # UpdateModelMixin更新视图扩展类，提供update(request, *args, **kwargs)方法，可以快速实现更新一个存在的数据对象。同时也提供partial_update(request, *args, **kwargs)方法，可以实现局部更新。成功返回200，序列化器校验数据失败时，返回400错误
 # DestroyModelMixin删除视图扩展类，提供destroy(request, *args, **kwargs)方法，可以快速实现删除一个存在的数据对象。成功返回204，不存在返回404
-class BookGenericCreateModelListModel(GenericAPIView, CreateModelMixin, ListModelMixin):    # 也即是继承ListCreateAPIView
+# 批量写入：前端传入列表，按块bulk_create/bulk_update，校验失败的数据按下标返回错误
+# POST  /books/bulk/          批量新增   [{...}, {...}]
+# PATCH /books/bulk/          批量修改   [{'id': 1, ...}, {'id': 2, ...}]
+# POST  /books/bulk-delete/   批量逻辑删除 {'ids': [1, 2, 3]}
+class BulkModelMixin:
+    bulk_serializer_class = None
+    bulk_chunk_size = 1000
+
+    def get_bulk_writer(self):
+        return BulkWriter(self.bulk_serializer_class, chunk_size=self.bulk_chunk_size)
+
+    def get_bulk_response(self, result, count):
+        if count == 0 and result['errors']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+    @action(methods=['post'], detail=False, url_path='bulk')
+    def bulk_create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise ValidationError('需要传入列表')
+        result = self.get_bulk_writer().create(request.data)
+        return self.get_bulk_response(result, result['created'])
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise ValidationError('需要传入列表')
+        result = self.get_bulk_writer().update(request.data)
+        return self.get_bulk_response(result, result['updated'])
+
+    @action(methods=['post'], detail=False, url_path='bulk-delete')
+    def bulk_delete(self, request, *args, **kwargs):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        # 必须是列表：字符串也可以迭代，"31"会被当成[3, 1]
+        if not isinstance(ids, list):
+            raise ValidationError({'ids': ['需要传入id列表']})
+        try:
+            ids = [int(pk) for pk in ids]
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': ['需要传入id列表']})
+        return Response(self.get_bulk_writer().soft_delete(ids))
+
+
+class BookGenericCreateModelListModel(BulkModelMixin, GenericAPIView, CreateModelMixin, ListModelMixin):    # 也即是继承ListCreateAPIView
     queryset = BookInfo.objects.all()
     serializer_class = BookInfoSerializer
+    bulk_serializer_class = BookInfoModelSerializer
 
     def get(self, request):
         return self.list(request)        # list方法包含了Response返回
     def post(self, request):
+        # 传入列表时批量新增
+        if isinstance(request.data, list):
+            return self.bulk_create(request)
         return self.create(request)        # create方法包含了返回
 
 class BookGenericUpdateModelDestroyModel(GenericAPIView, UpdateModelMixin, DestroyModelMixin):
@@ -289,7 +378,7 @@ class BookGenericUpdateModelDestroyModel(GenericAPIView, UpdateModelMixin, Destr
 # RetrieveUpdateAPIView提供get、put、patch方法   继承自： GenericAPIView、RetrieveModelMixin、UpdateModelMixin
 # RetrieveDestroyAPIView 继承自： GenericAPIView、RetrieveModelMixin、DestroyModelMixin
 # RetrieveUpdateDestroyAPIView提供get、put、patch、delete方法   继承自：GenericAPIView、RetrieveModelMixin、UpdateModelMixin、DestroyModelMixin
-class BookListCreateAPIView(ListCreateAPIView):
+class BookListCreateAPIView(PrefetchNestedMixin, ListCreateAPIView):
     queryset = BookInfo.objects.all()
     serializer_class = BookInfoSerializer
     # 内部实现了get()、post()
@@ -307,7 +396,7 @@ class BookRetrieveUpdateDestory(RetrieveUpdateDestroyAPIView):
 # GenericViewSet 继承自GenericAPIView
 class BookViewSet(ViewSet):
     def list(self, request):
-        books = BookInfo.objects.all()
+        books = setup_eager_loading(BookInfo.objects.all(), BookInfoSerializer)
         s = BookInfoSerializer(books, many=True)
         return Response(s.data)
 
@@ -336,7 +425,7 @@ class BookViewSet(ViewSet):
         return Response(s.data)
 
 
-class BookGenericViewSet(GenericViewSet):
+class BookGenericViewSet(PrefetchNestedMixin, GenericViewSet):
     queryset = BookInfo.objects.all()
     serializer_class = BookInfoSerializer
 
@@ -354,11 +443,30 @@ class BookGenericViewSet(GenericViewSet):
 
 
 
+# 阅读量：记录一次阅读只写入进程内计数器缓冲区，由计数器批量 read_count = read_count + n 落库，不再每次读改存
+class BookReadMixin:
+    counter = book_counter
+
+    @action(methods=['post'], detail=True)     # 生成的路由：^books/(?P<pk>[^/.]+)/read/$
+    def read(self, request, pk):
+        # 不查询书籍是否存在(不存在的id刷新时更新0行)，但id必须是主键范围内的整数：
+        # 超出范围的id刷新时会出错(SQLite: OverflowError)
+        if not (pk.isascii() and pk.isdigit()):
+            raise NotFound()
+        book_id = int(pk)
+        # SQLite不限制范围(返回None)，但其整数最大为64位有符号数
+        high = connection.ops.integer_field_range(BookInfo._meta.pk.get_internal_type())[1]
+        if not 1 <= book_id <= (high if high is not None else 2 ** 63 - 1):
+            raise NotFound()
+        self.counter.incr(book_id, 'read_count')
+        return Response({'id': book_id}, status=status.HTTP_202_ACCEPTED)
+
+
 # 两个拓展视图集：
 # ModelViewSet  继承自GenericAPIView和五个扩展类   增删改查均可
 # ReadOnlyModelViewSet 继承自GenericAPIView、ListModelMixin、RetrieveModelMixin  获取多个/单一数据对象(只读)
 
-class BookModelViewSet(ModelViewSet):
+class BookModelViewSet(BookReadMixin, ModelViewSet):
     queryset = BookInfo.objects.all()
     # serializer_class = BookInfoSerializer        # 下面自定义了get_serializer_class
 
@@ -462,24 +570,19 @@ class BookAPIView(APIView):
         except BookInfo.DoesNotExist:
             return HttpResponse(status=404)
 
-        json_bytes = request.body
-        json_str = json_bytes.decode()
-        book_dict = json.loads(json_str)
+        # 乐观锁：If-Match与当前ETag不一致时返回412
+        response = check_if_match(request, book)
+        if response is not None:
+            return response
 
-        # 此处详细的校验参数省略
+        s = BookInfoModelSerializer(book, data=request.data, partial=True)
+        s.is_valid(raise_exception=True)
+        # 只有读取之后没有被其他请求修改过才写入，否则返回412
+        response = save_if_unmodified(book, s.validated_data)
+        if response is not None:
+            return response
 
-        book.btitle = book_dict.get('btitle')
-        book.bpub_date = datetime.strptime(book_dict.get('bpub_date'), '%Y-%m-%d').date()
-        book.save()
-
-        return JsonResponse({
-            'id': book.id,
-            'btitle': book.btitle,
-            'bpub_date': book.bpub_date,
-            'bread': book.bread,
-            'bcomment': book.bcomment,
-            'image': book.image.url if book.image else ''
-        })
+        return Response(s.data, headers={'ETag': instance_etag(book.pk, book.updated_at)})
 
     def delete(self, request, pk):
         """
@@ -517,7 +620,9 @@ class ExampleView2(APIView):
 # 可以对接口访问的频次进行限制，以减轻服务器压力
 class ExampleView3(APIView):
     # 局部用户限流
-    throttle_classes = (UserRateThrottle, AnonRateThrottle, ScopedRateThrottle, )
+    # throttle_classes = (UserRateThrottle, AnonRateThrottle, ScopedRateThrottle, )
+    # 令牌桶限流，多进程共享限额
+    throttle_classes = (BucketUserRateThrottle, BucketAnonRateThrottle, BucketScopedRateThrottle, )
 
 class ContactListView(APIView):
     throttle_scope = 'contacts'     # 指定限流的名称，进入此试图前会根据contacts对应的限流次数进行控制是否可进入此视图
@@ -545,7 +650,7 @@ class BookListView1(ListAPIView):
 
 
 # 排序
-class BookListView2(ListAPIView):
+class BookListView2(ConditionalRequestMixin, CachedResponseMixin, CompiledListMixin, ListAPIView):
     queryset = BookInfo.objects.all()
     serializer_class = BookInfoSerializer
 
@@ -568,14 +673,374 @@ class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'page_size'      # 前端通过查询字符串参数page_size指定每页数量，如http://api.example.org/accounts/?page=4&page_size=15
     max_page_size = 20                       # 前端最多能指定每页返回的数量，若前端指定每页21条数据，依然每页只返回20条
 
-class BookModelView(ModelViewSet):
+
+# 键集(游标)分页器：PageNumberPagination每页都会LIMIT/OFFSET并COUNT(*)，页码越深越慢
+# 键集分页记住上一页最后一行的(排序字段, id)，下一页直接 WHERE (排序字段, id) > (上次的值) LIMIT n，走索引，与页深无关
+# 游标对前端不透明，如http://api.example.org/books/?ordering=-pub_date&cursor=eyJ2Ijo...
+# 默认不做COUNT，前端传with_total=1时才返回近似总数
+class KeysetPagination(BasePagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 20
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'          # 与BookListView2.ordering_fields一致，可加'-'倒序
+    ordering_fields = ('id', 'pub_date', 'read_count')
+    default_ordering = 'id'
+    pk_field = 'id'                            # 第二排序键(唯一)，游标中保存为'id'
+    total_query_param = 'with_total'
+    invalid_cursor_message = '无效的游标'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.queryset = queryset
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(request)
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor.get('r'))
+
+        # 往前翻页时反向查询，取到结果后再倒回来
+        descending = self.descending != self.reverse
+        prefix = '-' if descending else ''
+        pk = self.pk_field
+        ordering = [prefix + self.field] if self.field == pk else [prefix + self.field, prefix + pk]
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_cursor_filter(queryset.model, cursor, descending))
+
+        # 多取一条判断是否还有下一页，避免COUNT
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        ret = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if self.request.query_params.get(self.total_query_param) in ('1', 'true'):
+            ret['total'] = self.get_approximate_count(self.queryset)
+        return Response(ret)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:
+            return self.default_ordering, False
+        return field, ordering.startswith('-')
+
+    def get_cursor_filter(self, model, cursor, descending):
+        pk = cursor['id']
+        pk_lt, pk_gt = self.pk_field + '__lt', self.pk_field + '__gt'
+        if self.field == self.pk_field:
+            return Q(**{pk_lt: pk}) if descending else Q(**{pk_gt: pk})
+
+        # 组合键比较：(field, id) > (value, pk)；NULL在MySQL/SQLite中排序时视为最小值
+        field = self.field
+        value = cursor['v']
+        lt, gt = field + '__lt', field + '__gt'
+        if value is None:
+            if descending:
+                return Q(**{field + '__isnull': True, pk_lt: pk})
+            return Q(**{field + '__isnull': False}) | Q(**{field + '__isnull': True, pk_gt: pk})
+        if descending:
+            q = Q(**{lt: value}) | Q(**{field: value, pk_lt: pk})
+            if model._meta.get_field(field).null:
+                q |= Q(**{field + '__isnull': True})
+            return q
+        return Q(**{gt: value}) | Q(**{field: value, pk_gt: pk})
+
+    def get_approximate_count(self, queryset):
+        # 未过滤的查询集(默认管理器的逻辑删除过滤除外)直接读表统计信息，不扫表；有其他过滤条件时才精确COUNT
+        if str(queryset.query.where) != str(queryset.model._default_manager.all().query.where):
+            return queryset.count()
+        model = queryset.model
+        connection = connections[queryset.db]
+        if connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                    [model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            return row[0] if row else 0
+        # 其他数据库没有可用的表统计信息，精确COUNT
+        return queryset.count()
+
+    def encode_cursor(self, obj, reverse):
+        # 每行可能是模型对象，也可能是values()返回的字典(编译的序列化器)
+        get = obj.get if isinstance(obj, dict) else functools.partial(getattr, obj)
+        cursor = {'id': get(self.pk_field)}
+        if self.field != self.pk_field:
+            value = get(self.field)
+            cursor['v'] = value.isoformat() if hasattr(value, 'isoformat') else value
+        if reverse:
+            cursor['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            int(cursor['id'])
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if self.field != self.pk_field:
+            # 游标来自客户端，值按排序字段的类型转换，转换失败同样是无效的游标
+            try:
+                cursor['v'] = self.queryset.model._meta.get_field(self.field).to_python(cursor['v'])
+            except (KeyError, TypeError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+
+# 人物的键集分页：只能按人物自己的字段排序(书籍的pub_date、read_count在人物表中不存在)
+class PersonKeysetPagination(KeysetPagination):
+    ordering_fields = ('id', 'name')
+
+
+# 导出：流式输出全部书籍(可带人物)，边查边写，内存占用不随数据量增长，首字节立即返回
+# GET /books/export/?type=ndjson|csv&persons=1
+class BookExportMixin:
+    export_chunk_size = 2000
+    export_content_types = {
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+        'csv': 'text/csv; charset=utf-8',
+    }
+
+    @action(methods=['get'], detail=False)
+    def export(self, request, *args, **kwargs):
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in self.export_content_types:
+            raise ValidationError({'type': ['仅支持ndjson、csv']})
+        with_persons = request.query_params.get('persons') in ('1', 'true')
+        books = iter_books(with_persons, self.export_chunk_size)
+        if export_type == 'csv':
+            content = iter_csv(books, with_persons)
+        else:
+            content = iter_ndjson(books)
+        response = StreamingHttpResponse(content, content_type=self.export_content_types[export_type])
+        response['Content-Disposition'] = 'attachment; filename="books.%s"' % export_type
+        return response
+
+
+# 导入：上传NDJSON/CSV文件，流式读取并按批upsert书籍和人物，返回吞吐量和被拒绝的行
+# POST /books/import/   multipart表单：file=文件  type=ndjson|csv(默认按文件扩展名判断)
+class BookImportMixin:
+    import_batch_size = 1000
+
+    @action(methods=['post'], detail=False, url_path='import')
+    def import_file(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['需要上传文件']})
+        file_format = request.data.get('type') or ('csv' if upload.name.endswith('.csv') else 'ndjson')
+        if file_format not in READERS:
+            raise ValidationError({'type': ['仅支持ndjson、csv']})
+
+        importer = BookImporter(batch_size=self.import_batch_size)
+        try:
+            report = importer.run(READERS[file_format](decode_lines(upload.file)))
+        except ImportFileError as exc:
+            # 文件无法继续读取：400，指出出错的行；出错行之前的数据已经导入
+            report = importer.report()
+            report.update(file=[str(exc)], line=exc.line_no, rejected_rows=importer.rejected)
+            return Response(report, status=status.HTTP_400_BAD_REQUEST)
+        report['rejected_rows'] = importer.rejected
+        return Response(report)
+
+
+# 全文搜索：查询倒排索引(book_search_token)，按书名、人物名、人物描述的命中权重排序
+# GET /book/books/search/?q=射雕&limit=20
+class BookSearchMixin:
+    search_max_limit = 100
+
+    @action(methods=['get'], detail=False)
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ['需要提供搜索内容']})
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), self.search_max_limit)
+        except ValueError:
+            raise ValidationError({'limit': ['需要整数']})
+        return Response({'q': query, 'results': search_books(query, limit=max(limit, 1))})
+
+
+# 书籍统计的键集分页：按book_stats表的列排序，book_id为第二排序键
+class BookStatsPagination(KeysetPagination):
+    ordering_fields = ('book_id',) + STATS_FIELDS
+    default_ordering = '-character_count'
+    pk_field = 'book_id'
+
+
+# 书籍统计(人物数，按性别)：排序、筛选只查book_stats表，本页的书籍信息再按id一次查询
+# GET /book/books/stats/?ordering=-character_count&min_characters=2&max_characters=10&gender=female
+# 书籍列表带上统计：GET /book/books/?ordering=-read_count&with_stats=1
+class BookStatsMixin:
+    stats_pagination_class = BookStatsPagination
+    stats_filters = {'min_characters': 'character_count__gte', 'max_characters': 'character_count__lte'}
+    stats_query_param = 'with_stats'
+
+    @action(methods=['get'], detail=False)
+    def stats(self, request, *args, **kwargs):
+        queryset = BookStats.objects.all()
+        for param, lookup in self.stats_filters.items():
+            value = request.query_params.get(param)
+            if value is not None:
+                try:
+                    queryset = queryset.filter(**{lookup: int(value)})
+                except ValueError:
+                    raise ValidationError({param: ['需要整数']})
+        gender = request.query_params.get('gender')
+        if gender is not None:
+            if gender not in ('male', 'female'):
+                raise ValidationError({'gender': ['仅支持male、female']})
+            queryset = queryset.filter(**{gender + '_count__gt': 0})
+
+        paginator = self.stats_pagination_class()
+        page = paginator.paginate_queryset(queryset.values('book_id', 'updated_at', *STATS_FIELDS), request, view=self)
+        books = {book['id']: book for book in BookInfo.objects.filter(id__in=[row['book_id'] for row in page])
+                 .values('id', 'name', 'pub_date', 'read_count', 'comment_count')}
+        results = []
+        for row in page:
+            book = books.get(row['book_id'])
+            if book is None:
+                continue
+            book.update((field, row[field]) for field in STATS_FIELDS)
+            book['stats_updated_at'] = row['updated_at']
+            results.append(book)
+        return paginator.get_paginated_response(results)
+
+    def with_stats(self):
+        return self.request.query_params.get(self.stats_query_param) in ('1', 'true')
+
+    @property
+    def cache_models(self):
+        # 带统计的列表还依赖book_stats，人物变化更新统计后缓存随之失效
+        models = tuple(super().cache_models)
+        return models + (BookStats,) if self.with_stats() else models
+
+    def get_dependent_last_modified(self):
+        # 条件GET：带统计时人物变化也要使ETag变化
+        last_modified = super().get_dependent_last_modified()
+        if self.with_stats():
+            last_modified = latest(last_modified, BookStats.objects.aggregate(m=Max('updated_at'))['m'])
+        return last_modified
+
+    def get_paginated_response(self, data):
+        if self.with_stats():
+            attach_book_stats(data)
+        return super().get_paginated_response(data)
+
+
+# 排行榜：阅读量、评论量或加权分数(settings.LEADERBOARD['SCORE_WEIGHTS'])的前N名，可按出版年份
+# 从进程内的排行榜直接返回，不对整表排序；计数器的增加实时体现，其他变化在对账后体现
+# GET /book/books/top/?by=read_count|comment_count|score&year=1994&limit=10
+class BookLeaderboardMixin:
+    leaderboard = leaderboard
+
+    @action(methods=['get'], detail=False)
+    def top(self, request, *args, **kwargs):
+        by = request.query_params.get('by', 'read_count')
+        if by not in self.leaderboard.metrics:
+            raise ValidationError({'by': ['仅支持%s' % '、'.join(self.leaderboard.metrics)]})
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            raise ValidationError({'limit': ['需要整数']})
+        year = request.query_params.get('year') or None
+        if year is not None:
+            if not year.isdigit() or not 1 <= int(year) <= 9999:
+                raise ValidationError({'year': ['无效的年份']})
+            year = int(year)
+        limit = min(max(limit, 1), settings.LEADERBOARD['MAX_LIMIT'], self.leaderboard.depth)
+        return Response({'by': by, 'year': year, 'results': self.leaderboard.top(by, year, limit)})
+
+
+# 书籍详情文档：直接返回预先渲染好的JSON(书籍 + 人物列表)，一条主键查询，不经过ORM和序列化器
+# GET /book/books/{pk}/document/   支持If-None-Match
+class BookDocumentMixin:
+    @action(methods=['get'], detail=True)
+    def document(self, request, pk):
+        try:
+            book_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        body, etag = fetch_document(book_id)
+        if body is None:
+            # 还没有生成(如部署后尚未运行check_book_documents --fix)：只读地渲染一份返回，不在GET中写库；
+            # 存储留给下一次写入该书(提交后重建)或check_book_documents --fix，之后的ETag与这里相同
+            body = render_documents([book_id]).get(book_id)
+            if body is None:
+                raise NotFound()
+            etag = document_etag(body)
+        etag = quote_etag(etag)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+# 稀疏字段：GET /book/books/?fields=id,name,personinfo_set.name&expand=personinfo_set
+class BookModelView(BookReadMixin, BulkModelMixin, BookExportMixin, BookImportMixin, BookSearchMixin, BookStatsMixin,
+                    BookLeaderboardMixin, BookDocumentMixin, PrefetchNestedMixin, SparseFieldsMixin,
+                    ConditionalRequestMixin, CachedResponseMixin, CompiledListMixin, ModelViewSet):
     queryset = BookInfo.objects.all().order_by('id')
-    serializer_class = BookInfoSerializer
+    serializer_class = BookInfoModelSerializer
+    bulk_serializer_class = BookInfoModelSerializer
+    expandable_fields = {'personinfo_set': (PersonInfoModelSerializer, True)}
 
-    # 指定分页器类
-    pagination_class = CustomPageNumberPagination
+    # 指定分页器类：使用键集分页，深页与首页同样快
+    pagination_class = KeysetPagination
     # 请求时，默认调用了list方法中的分页功能
 
+
+# 稀疏字段：GET /book/persons/?fields=name,book_id.name&expand=book_id
+class PersonModelView(BulkModelMixin, PrefetchNestedMixin, SparseFieldsMixin, ConditionalRequestMixin, CachedResponseMixin,
+                      CompiledListMixin, ModelViewSet):
+    queryset = PersonInfo.objects.all().order_by('id')
+    serializer_class = PersonInfoModelSerializer
+    bulk_serializer_class = PersonInfoModelSerializer
+    expandable_fields = {'book_id': (BookInfoModelSerializer, False)}
+    pagination_class = PersonKeysetPagination
+
+    @property
+    def cache_models(self):
+        # 主模型为人物；不能写成类属性，否则会遮蔽SparseFieldsMixin的属性，展开的书籍变化时缓存不失效
+        return (PersonInfo,) + self.expanded_models()
+
+
 # LimitOffsetPagination分页器和PageNumberPagination使用方法一致，仅仅访问参数不同：http://api.example.org/books/?limit=100&offset=400
 # default_limit 默认限制，默认值与PAGE_SIZE设置一直
 # limit_query_param limit参数名，默认'limit'
@@ -658,7 +1123,7 @@ class BookListCreateView(ListCreateAPIView):
     """
 
 # 对于视图集ViewSet，仍在类视图的文档字符串中分开定义，但是应使用action名称区分，如
-class BookInfoViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
+class BookInfoViewSet(BookReadMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet):
     """
     list:
     返回图书列表数据